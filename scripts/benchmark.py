@@ -0,0 +1,247 @@
+#! /usr/bin/env python
+# USAGE SYNTAX:
+#  benchmark.py [number-of-cards]
+#
+# Like the other scripts, it imports the installed trellonos package
+# (pip install -e .). To run it from a checkout without installing, run it
+# as a module from the repository root:
+#
+#  python -m scripts.benchmark [number-of-cards]
+
+# Measures Trellonos performance on generated data, without touching the
+# Trello API, and how long Trellonos takes to import.
+
+import os
+import sys
+import time
+import random
+import datetime
+import subprocess
+
+from trellonos.board import Board
+from trellonos import datetools
+from trellonos.memorytools import slot_names
+
+
+CARDS_PER_LIST = 100
+
+# YAML values of generated cards
+TYPE_NAMES = ('Task', 'Event', 'Note', 'Habit')
+PRIORITIES = ('low', 'medium', 'high')
+
+
+class BenchmarkTrello(object):
+    """ Stand-in for the Trello wrapper which serves generated payloads
+    shaped like real API responses """
+
+    def __init__(self, num_cards):
+        self._num_cards = num_cards
+        self._member_ids = ['%024x' % random.getrandbits(96)
+                            for i in range(5)]
+
+    def get_lists(self, board):
+        num_lists = max(1, self._num_cards // CARDS_PER_LIST)
+        return [{'id': '%024x' % i, 'name': 'List %d' % i, 'closed': False,
+                 'idBoard': board['id'], 'pos': 1024 * (i + 1),
+                 'subscribed': False}
+                for i in range(num_lists)]
+
+    def get_cards(self, list, **params):
+        return [self._card(list, i) for i in range(CARDS_PER_LIST)]
+
+    def get_checklist(self, id):
+        return {'id': id, 'name': 'Checklist', 'checkItems': []}
+
+    def _card(self, list, index):
+        due = None
+        if index % 3 == 0:
+            due_date = datetime.datetime(2015, 1, 1) + datetime.timedelta(
+                hours=random.randint(0, 24 * 365))
+            due = due_date.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+        card_id = '%024x' % random.getrandbits(96)
+
+        return {
+            'id': card_id,
+            'name': 'Card %d of %s' % (index, list['name']),
+            'desc': 'Description of card %d\n---\ntype: %s\npriority: %s\n'
+                    % (index, random.choice(TYPE_NAMES),
+                       random.choice(PRIORITIES)),
+            'descData': {'emoji': {}},
+            'closed': index % 10 == 0,
+            'due': due,
+            'dueComplete': False,
+            'dateLastActivity': '2015-05-06T16:00:00.000Z',
+            'idBoard': list['idBoard'],
+            'idList': list['id'],
+            'idMembers': random.sample(self._member_ids, 2),
+            'idMembersVoted': [],
+            'idChecklists': [],
+            'idLabels': [],
+            'labels': [],
+            'idShort': index,
+            'idAttachmentCover': None,
+            'manualCoverAttachment': False,
+            'pos': 16384 * (index + 1),
+            'shortLink': card_id[:8],
+            'shortUrl': 'https://trello.com/c/' + card_id[:8],
+            'url': 'https://trello.com/c/' + card_id[:8] + '/card',
+            'subscribed': False,
+            'email': None,
+            'checkItemStates': [],
+            'badges': {'votes': 0, 'viewingMemberVoted': False,
+                       'subscribed': False, 'fogbugz': '', 'checkItems': 0,
+                       'checkItemsChecked': 0, 'comments': 0,
+                       'attachments': 0, 'description': True, 'due': due},
+        }
+
+
+def deep_sizeof(obj, seen):
+    """ Total size in bytes of an object and everything it references which
+    hasn't been counted yet """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, dict):
+        for key in obj:
+            size += deep_sizeof(key, seen) + deep_sizeof(obj[key], seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_sizeof(item, seen)
+    elif hasattr(obj, '__dict__') or hasattr(type(obj), '__slots__'):
+        if hasattr(obj, '__dict__'):
+            size += deep_sizeof(obj.__dict__, seen)
+
+        for cls in type(obj).__mro__:
+            for slot in slot_names(cls):
+                if hasattr(obj, slot):
+                    size += deep_sizeof(getattr(obj, slot), seen)
+
+    return size
+
+
+def benchmark_memory(trello, board):
+    """ Measures the memory held by the board per contained card """
+    # Don't count the stand-in Trello wrapper
+    seen = set([id(trello)])
+    total = deep_sizeof(board, seen)
+
+    num_cards = 0
+    for list_name in board.lists:
+        tlist = board.lists[list_name]
+        num_cards += len(tlist.cards) + len(tlist.closed_cards)
+
+    print('Memory: %d bytes for %d cards, %.0f bytes per card'
+          % (total, num_cards, float(total) / num_cards))
+
+
+def benchmark_due_dates(board, queries=1000):
+    """ Times overdue card queries against the board """
+    now = datetools.now()
+
+    # First access builds the index
+    start = time.time()
+    board.overdue_cards(now)
+    print('Due date index built in %.2f ms' % ((time.time() - start) * 1000))
+
+    start = time.time()
+    for i in range(queries):
+        board.overdue_cards(now)
+    elapsed = time.time() - start
+
+    print('Overdue query: %.1f us per query' % (elapsed / queries * 1e6))
+
+
+def benchmark_query(board, member_id, queries=1000):
+    """ Times an indexed card query against the equivalent loop over
+    every list and card """
+    now = datetools.now()
+
+    # Only boards with a meta board parse their cards' YAML
+    for list_name in board.lists:
+        tlist = board.lists[list_name]
+        for card in tlist.cards + tlist.closed_cards:
+            card.parse_description(card.card_data['desc'])
+    board.card_changed()
+
+    def loop():
+        cards = []
+        for list_name in board.lists:
+            for card in board.lists[list_name].cards:
+                due_date = card.due_date
+                if (card.type_name == 'Task' and
+                        card.yaml_data.get('priority') == 'high' and
+                        card.is_member({'id': member_id}) and
+                        due_date and due_date < now):
+                    cards.append(card)
+        return cards
+
+    def query():
+        return board.query(type='Task', yaml={'priority': 'high'},
+                           member=member_id, due_before=now)
+
+    assert len(loop()) == len(query())
+
+    for name, function in (('Loop', loop), ('Indexed query', query)):
+        start = time.time()
+        for i in range(queries):
+            function()
+        elapsed = time.time() - start
+
+        print('%s: %.1f us per query' % (name, elapsed / queries * 1e6))
+
+
+# Run in a fresh interpreter, so nothing is imported already
+IMPORT_TIME_CODE = """
+import sys
+import time
+start = time.time()
+import trellonos.cli
+elapsed = time.time() - start
+heavy = [name for name in ('requests', 'yaml', 'dateutil', 'multiprocessing',
+                           'github', 'trello') if name in sys.modules]
+print('%f %s' % (elapsed, ','.join(heavy)))
+"""
+
+
+def benchmark_import_time(runs=5):
+    """ Times importing the command line entry point, and lists the heavy
+    dependencies loaded by importing it """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    times = []
+    for i in range(runs):
+        output = subprocess.check_output([sys.executable, '-c',
+                                          IMPORT_TIME_CODE], cwd=root)
+        fields = output.decode('utf-8').split()
+        times.append(float(fields[0]))
+
+        heavy = 'none'
+        if len(fields) > 1:
+            heavy = fields[1]
+
+    print('Import time: %.1f ms (best of %d), heavy modules loaded: %s'
+          % (min(times) * 1000, runs, heavy))
+
+
+if __name__ == "__main__":
+    num_cards = 5000
+    if len(sys.argv) > 1:
+        num_cards = int(sys.argv[1])
+
+    random.seed(0)
+
+    trello = BenchmarkTrello(num_cards)
+    trello_board = {'id': '%024x' % 0, 'name': 'Benchmark', 'closed': False}
+
+    start = time.time()
+    board = Board(trello, trello_board)
+    print('Board constructed in %.2f s' % (time.time() - start))
+
+    benchmark_memory(trello, board)
+    benchmark_due_dates(board)
+    benchmark_query(board, trello._member_ids[0], 100)
+    benchmark_import_time()
@@ -0,0 +1,72 @@
+#! /usr/bin/env python
+# USAGE SYNTAX:
+#  export-boards.py [options] [board-name ...]
+#
+#  --from-snapshot     export the boards saved by the last Trellonos run
+#                      instead of fetching them from Trello
+#  --closed            include archived cards
+#  -o, --output PATH   JSON Lines file to write (default: standard output)
+#  --parquet PATH      also write a Parquet file (requires pyarrow)
+#
+# Writes one record per card: its board and list, YAML fields, due date and
+# checklist completion.
+
+import sys
+import argparse
+
+from trellonos import Trello
+from trellonos import Trellonos
+from trellonos.exporttools import write_jsonl, write_parquet
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        description='Export Trello cards as JSON Lines')
+    parser.add_argument('board_names', nargs='*', metavar='board-name')
+    parser.add_argument('--from-snapshot', action='store_true')
+    parser.add_argument('--closed', action='store_true')
+    parser.add_argument('-o', '--output')
+    parser.add_argument('--parquet')
+
+    return parser.parse_args(argv)
+
+
+def written_records(records, output):
+    """ Passes records through after writing each as JSON Lines, so both
+    files are written in one pass over the cards """
+    for record in records:
+        write_jsonl([record], output)
+        yield record
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments(sys.argv[1:])
+
+    if arguments.from_snapshot:
+        # No API calls at all
+        trellonos = Trellonos(None, 'USE_BACKUP')
+    else:
+        # Meta boards give the cards their inherited YAML, and the state
+        # of the last run is left as it was
+        trellonos = Trellonos(Trello.from_environment_vars(),
+                              arguments.board_names, read_only=True)
+
+    records = trellonos.card_records(arguments.closed)
+
+    if arguments.board_names:
+        records = (record for record in records
+                   if record['board'] in arguments.board_names)
+
+    output = sys.stdout
+    if arguments.output:
+        output = open(arguments.output, 'w')
+
+    try:
+        if arguments.parquet:
+            write_parquet(written_records(records, output),
+                          arguments.parquet)
+        else:
+            write_jsonl(records, output)
+    finally:
+        if arguments.output:
+            output.close()
@@ -1,56 +1,257 @@
 #! /usr/bin/env python
 # USAGE SYNTAX:
-#  list-to-pdf.py [list-id]
+#  list-to-pdf.py [options] [list-id ...]
+#
+#  -b, --board BOARD_ID   also print every open list of a board (repeatable)
+#  -d, --descriptions     print card descriptions under their names
+#  -c, --checklists       print card checklists under their names
+#  -s, --split            write one PDF per list instead of one combined PDF
+#  -o, --output PATH      combined PDF to write (default list.pdf), or the
+#                         directory for split PDFs (default .)
+#  -j, --jobs N           lists fetched (and with --split, rendered) at once
+#
+# Prints the path of each PDF written.
 
 # DEPENDENCIES:
 #  * Reportlab toolkit
 
+import os
+import re
 import sys
+import argparse
+import multiprocessing
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
 from trellonos import Trello
 from trellonos import FILTER_OPEN
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import inch
+from reportlab.lib.utils import simpleSplit
+
+
+PAGE_SIZE = (8.5 * inch, 11 * inch)
+
+DEFAULT_JOBS = 8
+
+# Only the card fields that get printed are fetched
+CARD_FIELDS = 'name,desc,idChecklists'
 
 
 def starting_cursor_position():
     """ Start drawing at the top left margin """
     return inch, inch * 10
 
-if __name__ == "__main__":
-    # Access the Trello API
-    trello = Trello.from_environment_vars()
 
-    # Retrieve the list to print
-    list_id = sys.argv[1]
+class PdfWriter(object):
+    """ Canvas with a cursor, which starts a new page whenever something
+    would be drawn below the bottom margin """
+
+    def __init__(self, path):
+        self.path = path
+        self._canvas = canvas.Canvas(path, PAGE_SIZE)
+        self._x, self._y = starting_cursor_position()
+
+    def _ensure_space(self, height):
+        if self._y - height < inch:
+            self.new_page()
+
+    def new_page(self):
+        self._canvas.showPage()
+        self._x, self._y = starting_cursor_position()
+
+    def draw_line(self, text, font, size, indent=0, spacing=None):
+        """ Draws one line of text, wrapped to the page width """
+        if spacing is None:
+            spacing = size * 1.5
+
+        x = self._x + indent
+        width = PAGE_SIZE[0] - inch - x
+
+        for line in simpleSplit(text, font, size, width) or ['']:
+            self._ensure_space(spacing)
+            self._y -= spacing
+            self._canvas.setFont(font, size)
+            self._canvas.drawString(x, self._y, line)
+
+    def skip(self, height):
+        self._y -= height
+
+    def save(self):
+        self._canvas.showPage()
+        self._canvas.save()
+
+
+def fetch_list(trello, list_id, checklists=False):
+    """ Retrieves a list, its open cards, and optionally their checklists """
     list_object = trello.get_list(list_id)
+    card_objects = trello.get_cards(list_object, card_filter=FILTER_OPEN,
+                                    fields=CARD_FIELDS)
+
+    if checklists:
+        for card_object in card_objects:
+            card_object['checklists'] = [
+                trello.get_checklist(checklist_id)
+                for checklist_id in card_object.get('idChecklists', [])]
+
+    return list_object, card_objects
 
-    # Retrieve the cards in the list
-    card_objects = trello.get_cards(list_object, card_filter=FILTER_OPEN)
 
-    # Open a canvas for printing
-    pdf_canvas = canvas.Canvas('list.pdf', (8.5 * inch, 11 * inch))
+def fetch_lists(trello, list_ids, jobs, checklists=False):
+    """ Generates (list, cards) pairs in the given order, fetching up to jobs
+    lists ahead at once so that no more than that are held in memory """
+    thread_pool = ThreadPool(jobs)
+    pending = deque()
 
-    # Draw the name of the list at the top of the page
-    x, y = starting_cursor_position()
-    y -= 36
-    pdf_canvas.setFont("Helvetica-Bold", 36)
-    pdf_canvas.drawString(x, y, list_object['name'])
+    try:
+        for list_id in list_ids:
+            pending.append(thread_pool.apply_async(
+                fetch_list, (trello, list_id, checklists)))
 
-    # Start drawing cards below that
-    x += inch / 2
-    y -= inch / 2
-    pdf_canvas.setFont("Helvetica", 16)
+            if len(pending) >= jobs:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        thread_pool.terminate()
+
+
+def draw_list(writer, list_object, card_objects, descriptions=False,
+              checklists=False):
+    """ Draws a list's name as a heading, followed by its cards """
+    writer.draw_line(list_object['name'], 'Helvetica-Bold', 36)
+    writer.skip(inch / 4)
 
     for card_object in card_objects:
-        pdf_canvas.drawString(x, y, card_object['name'])
-        y -= 24
+        writer.draw_line(card_object['name'], 'Helvetica', 16,
+                         indent=inch / 2)
+
+        if descriptions and card_object.get('desc'):
+            for paragraph in card_object['desc'].splitlines():
+                writer.draw_line(paragraph, 'Helvetica', 10, indent=inch)
+
+        if checklists:
+            for checklist in card_object.get('checklists', []):
+                writer.draw_line(checklist['name'], 'Helvetica-Bold', 10,
+                                 indent=inch)
+
+                for check_item in checklist['checkItems']:
+                    box = '[x] ' if check_item['state'] == 'complete' \
+                        else '[ ] '
+                    writer.draw_line(box + check_item['name'], 'Helvetica',
+                                     10, indent=inch * 1.25)
+
+
+def list_ids_to_print(trello, arguments):
+    """ The ids of the lists given directly, followed by the open lists of
+    the given boards """
+    list_ids = list(arguments.list_ids)
+
+    for board_id in arguments.boards:
+        lists = trello.get_lists({'id': board_id}, list_filter=FILTER_OPEN)
+        list_ids.extend([list_object['id'] for list_object in lists])
+
+    return list_ids
+
 
-        if y < inch:
-            pdf_canvas.showPage()
-            temp, y = starting_cursor_position()
-            pdf_canvas.setFont("Helvetica", 16)
+def pdf_filename(list_object):
+    """ A filename for a list's own PDF, from its name """
+    name = re.sub(r'[^\w\- ]+', '', list_object['name']).strip()
+    return (name or 'list') + '-' + list_object['id'][-6:] + '.pdf'
+
+
+# Each split worker process gets its own Trello wrapper
+_worker_trello = None
+
+
+def _init_worker():
+    global _worker_trello
+    _worker_trello = Trello.from_environment_vars()
+
+
+def _export_list(task):
+    """ Renders one list to its own PDF in a worker process """
+    list_id, directory, descriptions, checklists = task
+
+    list_object, card_objects = fetch_list(_worker_trello, list_id,
+                                           checklists)
+
+    writer = PdfWriter(os.path.join(directory, pdf_filename(list_object)))
+    draw_list(writer, list_object, card_objects, descriptions, checklists)
+    writer.save()
+
+    return writer.path
+
+
+def export_combined(trello, list_ids, arguments):
+    """ Draws every list into one PDF, each starting on a new page, while
+    the following lists are being fetched """
+    writer = PdfWriter(arguments.output or 'list.pdf')
+
+    lists = fetch_lists(trello, list_ids, arguments.jobs,
+                        arguments.checklists)
+
+    for index, (list_object, card_objects) in enumerate(lists):
+        if index > 0:
+            writer.new_page()
+
+        draw_list(writer, list_object, card_objects, arguments.descriptions,
+                  arguments.checklists)
+
+    writer.save()
+
+    print(writer.path)
+
+
+def export_split(list_ids, arguments):
+    """ Writes one PDF per list, in parallel worker processes """
+    directory = arguments.output or '.'
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    tasks = [(list_id, directory, arguments.descriptions,
+              arguments.checklists) for list_id in list_ids]
+
+    pool = multiprocessing.Pool(arguments.jobs, _init_worker)
+    try:
+        for path in pool.imap(_export_list, tasks):
+            print(path)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        description='Print Trello lists to PDF')
+    parser.add_argument('list_ids', nargs='*', metavar='list-id')
+    parser.add_argument('-b', '--board', dest='boards', action='append',
+                        default=[], metavar='BOARD_ID')
+    parser.add_argument('-d', '--descriptions', action='store_true')
+    parser.add_argument('-c', '--checklists', action='store_true')
+    parser.add_argument('-s', '--split', action='store_true')
+    parser.add_argument('-o', '--output')
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS)
+
+    arguments = parser.parse_args(argv)
+
+    if not arguments.list_ids and not arguments.boards:
+        parser.error('no lists or boards to print')
+
+    return arguments
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments(sys.argv[1:])
+
+    # Access the Trello API
+    trello = Trello.from_environment_vars()
 
-    pdf_canvas.showPage()
+    # Retrieve the lists to print
+    list_ids = list_ids_to_print(trello, arguments)
 
-    # Save the PDF we've generated
-    pdf_canvas.save()
+    if arguments.split:
+        export_split(list_ids, arguments)
+    else:
+        export_combined(trello, list_ids, arguments)
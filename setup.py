@@ -1,8 +1,11 @@
-from setuptools import setup
-
-setup(
-    name='Trellonos',
-    version='0.1dev',
-    packages=['trellonos','scripts',],
-    install_requires=['reportlab','markdown','trello','PyGithub','PyYAML','python-dateutil',],
-)
+from setuptools import setup
+
+setup(
+    name='Trellonos',
+    version='0.1dev',
+    packages=['trellonos','scripts',],
+    package_data={'trellonos': ['fixtures/*.json',],},
+    install_requires=['reportlab','markdown','requests','PyYAML','python-dateutil',],
+    extras_require={'parquet': ['pyarrow',],},
+    entry_points={'console_scripts': ['trellonos = trellonos.cli:main',],},
+)
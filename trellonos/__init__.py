@@ -1,10 +1,52 @@
 """ Package for automation of Trello operations """
 
-# Internal files.
-from .board import *
-from .card import *
-from .githubtools import *
-from .list import *
-from .logtools import *
-from .trellonos import *
-from .trellotools import *
+import sys
+import types
+import importlib
+
+# Internal files, whose public names the package exports. They are only
+# imported when one of their names is first used, so that importing a single
+# module (such as the command line entry point) doesn't import them all.
+# Where modules export the same name, the later module's is used
+EXPORTING_MODULES = ('board', 'card', 'githubtools', 'list', 'logtools',
+                     'trellonos', 'trellotools')
+
+
+def _public_names(module):
+    return [name for name in vars(module) if not name.startswith('_')]
+
+
+class _Package(types.ModuleType):
+    """ The package module, which imports its internal files to find the
+    names it exports """
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name != '__all__':
+            raise AttributeError(name)
+
+        names = {}
+        for module_name in reversed(EXPORTING_MODULES):
+            module = importlib.import_module('.' + module_name, self.__name__)
+
+            if name in _public_names(module):
+                value = getattr(module, name)
+                setattr(self, name, value)
+                return value
+
+            for public_name in _public_names(module):
+                names.setdefault(public_name, module)
+
+        if name == '__all__':
+            # Star imports of the package take every exported name
+            return sorted(names)
+
+        raise AttributeError("module '" + self.__name__ +
+                             "' has no attribute '" + name + "'")
+
+
+_package = _Package(__name__, __doc__)
+_package.__dict__.update(sys.modules[__name__].__dict__)
+
+# Keep this module alive, since its functions use its globals
+_package._module = sys.modules[__name__]
+sys.modules[__name__] = _package
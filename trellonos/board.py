@@ -1,7 +1,18 @@
 import re
+import time
+from collections import OrderedDict
 
 from list import List
+from journaltools import unit
+from memorytools import Slotted, trim_data
+from memotools import result_key, replayable
+from querytools import CardIndex
+from sandboxtools import RecordingTrello, MutationApplier
+from selectiontools import ALL
+import datetools
+import dependencytools
 import logtools as log
+import metricstools
 
 
 METADATA_REGEX = re.compile('^<.+>$')
@@ -17,19 +28,55 @@ SPECIAL_META_LISTS = {
     'Card Processors': '_card_processors'
 }
 
+# The fields of the raw board payload Trellonos reads
+BOARD_FIELDS = ('id', 'name', 'closed')
+INTERNED_BOARD_FIELDS = ('id',)
 
-class Board(object):
+BOARD_SECONDS = metricstools.gauge(
+    'trellonos_board_processing_seconds',
+    'Time taken by the last processing of each board', ('board',))
+
+
+class Board(Slotted):
     """ Wrapper of a Trello board """
 
+    __slots__ = ('_trello', '_board_data', '_meta_board', '_lists',
+                 '_meta_lists', '_card_index', '_version', '_changed_cards',
+                 '_bulk_change_version', '_dependents', '_is_meta') + \
+        tuple(SPECIAL_META_LISTS.values())
+
     def __init__(self, trello, trello_board, meta_board=None):
         self._trello = trello
-        self._board_data = trello_board
-        self._meta_board = meta_board
+        self._board_data = trim_data(trello_board, BOARD_FIELDS,
+                                     INTERNED_BOARD_FIELDS)
+        self._meta_board = None
+        if meta_board != None:
+            self._meta_board = trim_data(meta_board, BOARD_FIELDS,
+                                         INTERNED_BOARD_FIELDS)
 
         self._lists = {}
 
         self._meta_lists = {}
 
+        # Indexes of cards by type, YAML, member and due date, built when
+        # first queried
+        self._card_index = None
+
+        # Counts changes to cards, so the search index knows which boards
+        # to index again
+        self._version = 0
+
+        # Card ids -> (card, version) of the cards changed since loading,
+        # ordered by the version of their last change, and the version of
+        # the last change to several cards or lists at once. The search
+        # index uses them to index only the cards which changed
+        self._changed_cards = OrderedDict()
+        self._bulk_change_version = 0
+
+        # Ids of list default and archetype cards -> the sets of cards which
+        # inherit from them, to apply them again when they change
+        self._dependents = {}
+
         # Set special meta lists to empty before they are found
         for list_name in SPECIAL_META_LISTS:
             setattr(self, SPECIAL_META_LISTS[list_name], {})
@@ -47,7 +94,8 @@ class Board(object):
         for meta_list in meta_lists:
             list_name = meta_list['name']
 
-            meta_list_object = List(trello, self, meta_list)
+            # Cards in meta lists always carry YAML processor definitions
+            meta_list_object = List(trello, self, meta_list, True)
 
             # handle special meta lists
             if re.search(METADATA_REGEX, list_name):
@@ -57,7 +105,7 @@ class Board(object):
                     # If it's a special meta list, save it as an attribute
                     # Because it shouldn't be outwardly accessible
                     attribute_name = SPECIAL_META_LISTS[list_name]
-                    self.__dict__[attribute_name] = meta_list_object
+                    setattr(self, attribute_name, meta_list_object)
 
             # handle regular meta lists
             else:
@@ -72,27 +120,29 @@ class Board(object):
 
             list_object = List(trello, self, trello_list, self._is_meta)
 
-            # if this list has a default type name, apply it
-            if self._list_defaults:
-                # Find the default card
-                default_card = self._list_defaults.get_card(list_name)
-
-                # Only apply a default if it exists
-                if default_card:
-                    type_name = default_card.type_name
-                    list_object.apply_default_type(type_name)
-
-            # if archetypes are defined, apply them to this list
-            if self._archetypes:
-                list_object.apply_archetypes(self._archetypes)
+            # Apply the list's default type name, then archetypes
+            for card in list_object.cards + list_object.closed_cards:
+                self._inherit(card)
 
             # map the list by name
             self._lists[list_name] = list_object
 
+        # Inheritance applied while loading isn't a change
+        self._changed_cards.clear()
+
+    @property
+    def trello(self):
+        """ The Trello wrapper changes to this board are made through """
+        return self._trello
+
     @property
     def is_meta(self):
         return self._is_meta
  
+    @property
+    def id(self):
+        return self._board_data['id']
+
     @property
     def name(self):
         return self._board_data['name']
@@ -115,17 +165,35 @@ class Board(object):
 
     @property
     def lists(self):
+        if dependencytools.recording:
+            dependencytools.record('board', self._board_data['id'])
         return self._lists
 
     @property
     def meta_lists(self):
         return self._meta_lists
 
+    def all_lists(self):
+        """ Returns every list of this board and its meta board, including
+        special meta lists """
+        all_lists = list(self._lists.values()) + \
+            list(self._meta_lists.values())
+
+        for attribute_name in SPECIAL_META_LISTS.values():
+            special_list = getattr(self, attribute_name)
+            if special_list:
+                all_lists.append(special_list)
+
+        return all_lists
+
     def update_trello_instance(self, trello):
+        """ Gives this board and everything it contains a live Trello wrapper,
+        for example after loading it from a snapshot """
         self._trello = trello
-        for list in self._lists:
-            self.lists[list]._trello = trello
-            for card in self.lists[list].cards:
+
+        for list_object in self.all_lists():
+            list_object._trello = trello
+            for card in list_object.cards + list_object.closed_cards:
                 card._trello = trello
 
     def create_list(self, name):
@@ -134,7 +202,7 @@ class Board(object):
 
         trello_list = self._trello.create_list(self._board_data, name)
 
-        new_list = List(self._trello, self, trello_list)
+        new_list = List(self._trello, self, trello_list, self._is_meta)
         self._lists[name] = new_list
 
         return new_list
@@ -179,29 +247,210 @@ class Board(object):
                 'Tried to sort list between two non-existent lists')
 
     def get_cards(self, type_name):
-        """ Retrieve the cards from this board given a type name """
-        cards = []
+        """ Retrieve the open cards from this board given a type name, or
+        '<All>' for all of them """
+        if type_name == '<All>':
+            return self.query()
+
+        return self.query(type=type_name)
 
-        # Iterate through lists
-        for list_key in self._lists:
-            tlist = self._lists[list_key]
+    # Card queries
+
+    @property
+    def version(self):
+        """ Number which changes whenever cards of this board change """
+        return self._version
 
-            # For each list, iterate through cards
-            for card in tlist.cards:
-                # Add the card if it matches OR if we want all cards
-                if type_name == '<All>' or card.type_name == type_name:
-                    cards.append(card)
+    def cards_changed_since(self, version):
+        """ The cards changed since the given version of this board, which
+        may no longer belong to it, or None if several cards or lists
+        changed at once, so any card could have """
+        if version < self._bulk_change_version:
+            return None
+
+        cards = []
+        for card_id in reversed(self._changed_cards):
+            card, changed_version = self._changed_cards[card_id]
+            if changed_version <= version:
+                break
+
+            cards.append(card)
 
         return cards
 
-    def execute_processor(self, script_manager, github, processor, input):
-        """ Executes a board/list/card processor using the yaml data in the
-        card which defines it """
+    def has_card(self, card):
+        """ Whether a card is in one of this board's regular lists """
+        parent_list = card.parent_list
+        return (self._lists.get(parent_list.name) is parent_list and
+                (card in parent_list.cards or
+                 card in parent_list.closed_cards))
+
+    def card_changed(self, card=None, inheritance=True):
+        """ Called whenever cards of this board change. Given the card which
+        changed, updates its entries in the card indexes, and applies
+        inheritance again if the change could affect it (its name, YAML,
+        list or archival). Without a card, several cards or lists changed,
+        so the indexes are discarded to be rebuilt by the next query """
+        self._version += 1
+
+        if card is None:
+            self._card_index = None
+            self._bulk_change_version = self._version
+            return
 
-        yaml_data = processor.yaml_data
+        self._changed_cards.pop(card.id, None)
+        self._changed_cards[card.id] = (card, self._version)
 
-        gist_id = yaml_data['gist_id']
-        gist_file = yaml_data['gist_file']
+        self._update_card_index(card)
+
+        if inheritance:
+            self._inheritance_changed(card)
+
+    def _update_card_index(self, card):
+        """ Updates the index entries of a card, if the indexes are built """
+        index = self._card_index
+        if index is None:
+            return
+
+        present = self.has_card(card)
+
+        if present and ('list', card.parent_list.id) not in index.keys:
+            # The card is in a list made since the indexes were built
+            self._card_index = None
+        else:
+            index.update(card, present)
+
+    # Inheritance from list defaults and archetypes
+
+    def _is_inheritance_card(self, card):
+        parent_list = card.parent_list
+        return (parent_list is self._list_defaults or
+                parent_list is self._archetypes)
+
+    def _inherit(self, card):
+        """ Applies the default type of a card's list, then the archetype
+        of its type, to a card of a regular list. Inheritance applied before
+        is removed first """
+        for dependents in self._dependents.values():
+            dependents.discard(card)
+
+        card.clear_inherited_data()
+
+        if self._list_defaults:
+            default_card = self._list_defaults.get_card(card.parent_list.name)
+
+            # Only apply a default if it exists
+            if default_card:
+                self._dependents.setdefault(default_card.id, set()).add(card)
+                card.apply_default_type(default_card.type_name)
+
+        # Archetypes only apply to open cards
+        if self._archetypes and card.open:
+            archetype = self._archetypes.get_card(card.type_name or '')
+
+            if archetype:
+                self._dependents.setdefault(archetype.id, set()).add(card)
+                card.apply_archetype(archetype)
+
+        # Inherited YAML may have been removed without any applied
+        self.card_changed(card, False)
+
+    def inheritance_dependents(self, card):
+        """ The cards which inherit from the given list default or
+        archetype card, or would if it was renamed to its current name """
+        dependents = set(self._dependents.get(card.id, ()))
+
+        if card.open and card.parent_list is self._archetypes:
+            dependents.update(self.query(type=card.name))
+        elif card.open and card.parent_list is self._list_defaults:
+            list_object = self._lists.get(card.name)
+            if list_object:
+                dependents.update(list_object.cards +
+                                  list_object.closed_cards)
+
+        return dependents
+
+    def _inheritance_changed(self, card):
+        """ Applies inheritance again to the cards affected by a change of
+        the given card, and only to them """
+        parent_list = card.parent_list
+
+        if self._is_inheritance_card(card) or card.id in self._dependents:
+            dependents = self.inheritance_dependents(card)
+
+            # Dependents which still inherit from the card are added back
+            self._dependents.pop(card.id, None)
+
+            for dependent in dependents:
+                self._inherit(dependent)
+        elif self._lists.get(parent_list.name) is parent_list:
+            if card in parent_list.cards or card in parent_list.closed_cards:
+                self._inherit(card)
+            else:
+                # Deleted
+                for dependents in self._dependents.values():
+                    dependents.discard(card)
+
+    def _get_card_index(self):
+        if self._card_index is None:
+            self._card_index = CardIndex(self._lists.values())
+
+        return self._card_index
+
+    def query(self, type=None, yaml=None, member=None, due_before=None,
+              due_after=None, open=True, list=None, checked=None,
+              where=None):
+        """ Retrieve the cards of this board's lists matching every given
+        criterion, in board order:
+
+        type: type name
+        yaml: dictionary of YAML values. querytools.ANY matches any value
+              of a key which is present
+        member: member id, or member dictionary
+        due_before, due_after: datetimes, taken to be in UTC if they have
+              no timezone. Cards due on due_after match, cards due on
+              due_before don't
+        open: True for open cards, False for archived ones, None for both
+        list: name of the containing list
+        checked: dictionary of check item names to their completion state
+        where: function of a card which must return True
+
+        type, yaml, member and due dates are answered from indexes """
+        index = self._get_card_index()
+
+        # The results could change with any list or card of this board
+        dependencytools.record('board', self._board_data['id'])
+        dependencytools.record_all(index.keys)
+
+        return index.query(type, yaml, member, datetools.aware(due_before),
+                           datetools.aware(due_after), open, list, checked,
+                           where)
+
+    def cards_due_between(self, start=None, end=None):
+        """ Retrieve the open cards of this board due on or after start and
+        before end, ordered by due date. Either bound can be None to leave
+        that side open. Bounds without a timezone are taken to be in UTC,
+        like Trello's dates """
+        dependencytools.record('board', self._board_data['id'])
+
+        return [card for card in
+                self._get_card_index().due_between(datetools.aware(start),
+                                                   datetools.aware(end))
+                if card.open]
+
+    def overdue_cards(self, now=None):
+        """ Retrieve the open cards of this board whose due date has
+        passed, ordered by due date """
+        if now is None:
+            now = datetools.now()
+
+        return self.cards_due_between(None, now)
+
+    def processor_input(self, script_manager, github, processor, input):
+        """ Completes the input dictionary of a board/list/card processor
+        using the yaml data in the card which defines it """
+
+        yaml_data = processor.yaml_data
 
         # Pass all yaml data as input, including gist_id and gist_file
         # Although they will rarely be used, there's no harm in it
@@ -227,36 +476,217 @@ class Board(object):
         # TODO is this secure?
         input['script_manager'] = script_manager
 
+        return input
+
+    def execute_processor(self, script_manager, github, processor, input,
+                          continue_on_error=True):
+        """ Executes a board/list/card processor using the yaml data in the
+        card which defines it """
+
+        yaml_data = processor.yaml_data
+
+        gist_id = yaml_data['gist_id']
+        gist_file = yaml_data['gist_file']
+
+        input = self.processor_input(script_manager, github, processor, input)
+
         # Return the output dictionary
-        return github.execute_gist(script_manager, gist_id, gist_file, input)
+        return github.execute_gist(script_manager, gist_id, gist_file, input,
+                                   continue_on_error)
+
+    def execute_recorded_processor(self, script_manager, github, processor,
+                                   input, continue_on_error=True):
+        """ Executes a processor like execute_processor, recording the
+        mutations it makes through the Trello wrapper. Returns its output
+        dictionary and mutations """
+        yaml_data = processor.yaml_data
+
+        input = self.processor_input(script_manager, github, processor, input)
+
+        trello = RecordingTrello(self._trello, passthrough=True)
+        input['trello'] = trello
+
+        output = github.execute_gist(script_manager, yaml_data['gist_id'],
+                                     yaml_data['gist_file'], input,
+                                     continue_on_error)
+
+        return output, trello.mutations
+
+    def _execute_in_process(self, script_manager, github, processor, input,
+                            recorded):
+        """ Executes a processor in this process, recording its mutations
+        if recorded is True. Returns its output, mutations, and whether it
+        finished without error """
+        try:
+            if recorded:
+                output, mutations = self.execute_recorded_processor(
+                    script_manager, github, processor, input, False)
+            else:
+                output = self.execute_processor(script_manager, github,
+                                                processor, input, False)
+                mutations = []
+        except Exception:
+            # The script manager has logged the error
+            return {}, [], False
+
+        return output, mutations, True
+
+    def run_processor(self, trellonos, github, script_manager, processor,
+                      input_name, targets):
+        """ Runs a processor on each of the given targets (this board, or
+        lists or cards of it), passed to the processor as input_name. Uses
+        worker processes if Trellonos has a processor pool.
+
+        Processors whose YAML sets pure or cache are assumed to be
+        deterministic: their output and mutations are cached by input and
+        gist revision, and replayed instead of running them again. Such
+        processors must make all their changes through input['trello'].
+        Runs which fail aren't cached, and objects created by a cached run
+        aren't created again when it is replayed.
+
+        Targets the journal of an interrupted run shows were processed are
+        skipped. Returns the output dictionaries of the others """
+        pool = trellonos.processor_pool
+        yaml_data = processor.yaml_data
+
+        journal = trellonos.journal
+        units = [None] * len(targets)
+        if journal is not None:
+            units = [unit(self, processor, target) for target in targets]
+            remaining = [i for i in range(len(targets))
+                         if not journal.is_complete(units[i])]
+
+            if len(remaining) < len(targets):
+                log.message(str(len(targets) - len(remaining)) + ' of ' +
+                            str(len(targets)) + ' targets of processor ' +
+                            processor.name + ' already processed')
+
+            targets = [targets[i] for i in remaining]
+            units = [units[i] for i in remaining]
+
+        if not targets:
+            return []
+
+        log.open_context('Processor ' + processor.name, board=self.name,
+                         processor=processor.name,
+                         gist_id=yaml_data.get('gist_id'),
+                         targets=len(targets))
+
+        # Look up cached results first
+        keys = [None] * len(targets)
+        results = [None] * len(targets)
+
+        cache = None
+        if yaml_data.get('pure') or yaml_data.get('cache'):
+            cache = trellonos.result_cache
+            revision = github.get_gist(yaml_data['gist_id'])['revision']
+
+            applier = MutationApplier(self._trello, trellonos)
+
+            for i in range(len(targets)):
+                keys[i] = result_key(processor, revision, input_name,
+                                     targets[i])
+                cached = cache.get(keys[i])
 
-    def process(self, trellonos, github, script_manager):
-        """ Run each of this board's many types of processors """
+                if cached:
+                    output, mutations = cached
+                    results[i] = (output, mutations, True)
+
+                    if journal is not None:
+                        journal.begin(units[i])
+
+                    applier.apply(replayable(mutations))
+
+                    if journal is not None:
+                        journal.complete(units[i])
+
+            log.message(str(len(targets) - results.count(None)) + ' of ' +
+                        str(len(targets)) + ' results of processor ' +
+                        processor.name + ' replayed from cache')
+
+        uncached = [i for i in range(len(targets)) if results[i] is None]
+
+        if pool:
+            # The pool applies the mutations of each target through this
+            # board's Trello wrapper, journaling them under its unit
+            pool_results = pool.run(trellonos, github, self, processor,
+                                    input_name,
+                                    [targets[i] for i in uncached],
+                                    [units[i] for i in uncached])
+
+            for i, result in zip(uncached, pool_results):
+                results[i] = result
+        else:
+            # Errors retrieving the gist stop the run, unlike errors of the
+            # processor itself
+            if uncached:
+                github.get_script(yaml_data['gist_id'],
+                                  yaml_data['gist_file'])
+
+            for i in uncached:
+                if journal is not None:
+                    journal.begin(units[i])
+
+                results[i] = self._execute_in_process(
+                    script_manager, github, processor,
+                    {input_name: targets[i]}, cache is not None)
+
+                # Failed runs are run again when the run is resumed
+                if journal is not None and results[i][2]:
+                    journal.complete(units[i])
+
+        if cache:
+            for i in uncached:
+                output, mutations, ok = results[i]
+
+                # Failures may be transient, so they are run again
+                if ok:
+                    cache.put(keys[i], output, mutations)
+
+        log.close_context()
+
+        return [result[0] for result in results]
+
+    def _selected_processors(self, selection, kind, processors):
+        """ The processors of a special meta list which the selection asks
+        for """
+        if not processors or not selection.wants_kind(kind):
+            return []
+
+        return [processor for processor in processors
+                if selection.wants_processor(processor)]
+
+    def process(self, trellonos, github, script_manager, selection=ALL):
+        """ Run each of this board's many types of processors, or those the
+        given selection asks for """
         if len(self.meta_lists) == 0:
             log.message('Board ' + self.name + ' has no meta lists and won\'t be processed.')
             return
 
-        log.open_context('Processing board ' + self.name)
+        log.open_context('Processing board ' + self.name, board=self.name)
+        start = time.time()
 
         # first, processors of the whole board
-        for board_processor in self._board_processors:
+        for board_processor in self._selected_processors(
+                selection, 'board', self._board_processors):
             # send the board as an argument, and trello wrapper
-            input_dict = {'board': self}
-
-            # execute the board processor
-            self.execute_processor(script_manager, github, board_processor, input_dict)
+            self.run_processor(trellonos, github, script_manager,
+                               board_processor, 'board', [self])
 
         # Then list processors
-        for list_processor in self._list_processors:
+        for list_processor in self._selected_processors(
+                selection, 'list', self._list_processors):
             list_name = list_processor.name
-            input_list = self._lists[list_name]
+            input_lists = selection.filter_lists([self._lists[list_name]])
 
             # Pass the list with the same name as an argument
-            input_dict = {'list': input_list}
-            self.execute_processor(script_manager, github, list_processor, input_dict)
+            if input_lists:
+                self.run_processor(trellonos, github, script_manager,
+                                   list_processor, 'list', input_lists)
 
         # Then regex list processors
-        for regex_processor in self._regex_list_processors:
+        for regex_processor in self._selected_processors(
+                selection, 'regex', self._regex_list_processors):
             # retrieve the regex
             list_regex = re.compile(regex_processor.name)
 
@@ -267,26 +697,33 @@ class Board(object):
                 if re.search(list_regex, list_name):
                     matching_lists.append(self._lists[list_name])
 
+            matching_lists = selection.filter_lists(matching_lists)
+
             # now process each matching list
-            for input_list in matching_lists:
-                input_dict = {'list': input_list}
-                self.execute_processor(script_manager, github, regex_processor, input_dict)
+            self.run_processor(trellonos, github, script_manager,
+                               regex_processor, 'list', matching_lists)
 
         # Then card processors
-        for card_processor in self._card_processors:
+        for card_processor in self._selected_processors(
+                selection, 'card', self._card_processors):
             type_name = card_processor.name
             # process all cards of the given type name individually
-            cards = self.get_cards(type_name)
+            cards = selection.filter_cards(self.get_cards(type_name))
+
+            if cards:
+                self.run_processor(trellonos, github, script_manager,
+                                   card_processor, 'card', cards)
 
-            for card in cards:
-                input_dict = {'card': card}
-                self.execute_processor(script_manager, github, card_processor, input_dict)
+        BOARD_SECONDS.set(time.time() - start, board=self.name)
 
         log.close_context()
 
     # Markup functions
-    def fill_cards_markup(self, script_manager):
-        """ Fill all markup expressions in cards contained by this board """
+    def fill_cards_markup(self, script_manager, dependencies=None,
+                          selection=ALL):
+        """ Fill all markup expressions in cards contained by this board, or
+        in the selected card """
         for name in self.lists:
-            self.lists[name].fill_cards_markup(script_manager)
+            self.lists[name].fill_cards_markup(script_manager, dependencies,
+                                               selection)
 
@@ -1,18 +1,40 @@
 import string
 import re
 
-import yaml
-import dateutil.parser
-
 from checklist import Checklist
+from memorytools import Slotted, intern_string, trim_data
+import datetools
+import dependencytools
+import metricstools
+
+MARKUP_CARDS = metricstools.counter(
+    'trellonos_markup_cards_total',
+    'Cards with markup, by result: filled, or skipped as unchanged',
+    ('result',))
 
 DIVIDER_REGEX = re.compile('^-+$')  # Any natural number of hyphens
 DIVIDER_LINE = '---\n'  # splits description plaintext and YAML
 
+# The fields of the raw card payload Trellonos reads, and those processors
+# commonly read through card_data. Everything else (badges, check item
+# states and the like) is dropped to keep cards small.
+CARD_FIELDS = ('id', 'name', 'desc', 'closed', 'due', 'dateLastActivity',
+               'idMembers', 'idChecklists', 'idList', 'idBoard', 'pos',
+               'url', 'shortUrl', 'shortLink', 'idShort', 'labels',
+               'idLabels')
+INTERNED_CARD_FIELDS = ('id', 'idMembers', 'idChecklists', 'idList',
+                        'idBoard')
+
+# Shared by every card that hasn't inherited any YAML keys
+NO_INHERITED_KEYS = frozenset()
+
 
-class Card(object):
+class Card(Slotted):
     """ Wrapper of a Trello card """
 
+    __slots__ = ('_trello', '_parent_list', '_card_data', '_inherited_data',
+                 '_yaml_data', '_parsed_dates', '_checklists')
+
     def parse_description(self, description):
         """ Helper function updates this card's yaml data based on the new
         description supplied """
@@ -38,20 +60,31 @@ class Card(object):
         # update description stripped of yaml
         self._card_data['desc'] = desc_lines
 
-        self._yaml_lines = yaml_lines  # save source yaml for future updates
-        self._yaml_data = yaml.load(yaml_lines)  # parse yaml attributes
+        # Inherited keys are applied again by the board, after parsing
+        self._inherited_data = NO_INHERITED_KEYS
+
+        # Most cards have no YAML, so the parser is only loaded when one does
+        self._yaml_data = None
+        if yaml_lines.strip():
+            import yaml
+            self._yaml_data = yaml.load(yaml_lines)  # parse yaml attributes
 
         if not self._yaml_data:
             self._yaml_data = {}  # no null yaml data
+        elif 'type' in self._yaml_data:
+            # type names repeat across many cards
+            self._yaml_data['type'] = intern_string(self._yaml_data['type'])
 
     def __init__(self, trello, parent_list, trello_card, is_meta):
         """ Constructs a Trellonos wrapper of the given card in the given
         parent list """
         self._trello = trello
         self._parent_list = parent_list
-        self._card_data = trello_card
-        self._inherited_data = []
+        self._card_data = trim_data(trello_card, CARD_FIELDS,
+                                    INTERNED_CARD_FIELDS)
+        self._inherited_data = NO_INHERITED_KEYS
         self._yaml_data = {}
+        self._parsed_dates = None
 
         desc = trello_card['desc']  # retrieve full description including yaml
 
@@ -64,17 +97,38 @@ class Card(object):
 
         # Checklists are stored in a dictionary despite the possibility of
         # collision because usually when one card has multiple checklist, I name
-        # them to make the distinction clear
-        self._checklists = {}
-        for checklist_id in checklist_ids:
-            checklist_data = trello.get_checklist(checklist_id)
+        # them to make the distinction clear. Most cards have none, so the
+        # dictionary is only created when needed
+        self._checklists = None
+        if checklist_ids:
+            self._checklists = {}
+
+        # Checklists fetched with the card need no request of their own
+        checklists_data = trello_card.get('checklists')
+        if checklists_data is None:
+            checklists_data = [trello.get_checklist(checklist_id)
+                               for checklist_id in checklist_ids]
+
+        for checklist_data in checklists_data:
             checklist = Checklist(checklist_data)
             self._checklists[checklist.name] = checklist
 
+    def _record_read(self):
+        """ Helper function reports a read of this card's content to the
+        markup dependency recording, if any """
+        dependencytools.record('card', self._card_data['id'])
+
     @property
     def card_data(self):
+        """ The card's Trello payload, trimmed to CARD_FIELDS """
+        if dependencytools.recording:
+            self._record_read()
         return self._card_data
 
+    @property
+    def id(self):
+        return self._card_data['id']
+
     @property
     def parent_list(self):
         return self._parent_list
@@ -85,31 +139,58 @@ class Card(object):
 
     @property
     def name(self):
+        if dependencytools.recording:
+            self._record_read()
         return self._card_data['name']
 
     @property
     def open(self):
+        if dependencytools.recording:
+            self._record_read()
         return not self._card_data['closed']
 
     @property
     def closed(self):
+        if dependencytools.recording:
+            self._record_read()
         return self._card_data['closed']
 
+    def _parse_date_field(self, field):
+        """ Helper function parses a date field of the card data, caching
+        the result until the field's value changes """
+        if dependencytools.recording:
+            self._record_read()
+        date_string = self._card_data.get(field)
+
+        if not date_string:
+            return None
+
+        if self._parsed_dates is None:
+            self._parsed_dates = {}
+
+        # Only parse again if the string has changed since the last parse
+        cached = self._parsed_dates.get(field)
+        if cached and cached[0] == date_string:
+            return cached[1]
+
+        date = datetools.parse_date(date_string)
+        self._parsed_dates[field] = (date_string, date)
+
+        return date
+
     @property
     def due_date(self):
-        if 'due' in self._card_data:
-            if self._card_data['due']:
-                return dateutil.parser.parse(self._card_data['due'])
+        return self._parse_date_field('due')
 
     @property
     def last_date_modified(self):
-        if 'dateLastActivity' in self._card_data:
-            if self._card_data['dateLastActivity']:
-                return dateutil.parser.parse(self._card_data['dateLastActivity'])
+        return self._parse_date_field('dateLastActivity')
 
     @property
     def type_name(self):
         """ The type name of this card (for archetypal inheritance) """
+        if dependencytools.recording:
+            self._record_read()
         if 'type' not in self._yaml_data:
             return None
         else:
@@ -117,11 +198,14 @@ class Card(object):
 
     @type_name.setter
     def type_name(self, value):
-        self._yaml_data['type'] = value
+        self._yaml_data['type'] = intern_string(value)
+        self.parent_board.card_changed(self, False)
 
     @property
     def description(self):
         """ The trimmed description of this card (excluding yaml_data) """
+        if dependencytools.recording:
+            self._record_read()
         return self._card_data['desc']
 
     @property
@@ -131,13 +215,12 @@ class Card(object):
 
         uninherited_yaml_data = {}
         for key in self._yaml_data:
-            if not self._inherited_data:
-                uninherited_yaml_data[key] = self._yaml_data[key]
-            elif key not in self._inherited_data:
+            if key not in self._inherited_data:
                 uninherited_yaml_data[key] = self._yaml_data[key]
 
         # Only add the YAML divider if there's actually yaml data!
         if len(uninherited_yaml_data) > 0:
+            import yaml
             yaml_lines = yaml.safe_dump(uninherited_yaml_data,
                                         encoding='utf-8', allow_unicode=True,
                                         default_flow_style=False)
@@ -149,6 +232,8 @@ class Card(object):
 
     @property
     def yaml_data(self):
+        if dependencytools.recording:
+            self._record_read()
         return self._yaml_data
 
     def set_name(self, trello, name):
@@ -163,6 +248,8 @@ class Card(object):
         # In instance fields
         self._card_data['name'] = name
 
+        self.parent_board.card_changed(self)
+
     def set_description(self, trello, full_description):
         """ Gives this card a new description """
 
@@ -176,6 +263,8 @@ class Card(object):
         # Parse out Yaml data from the new description
         self.parse_description(full_description)
 
+        self.parent_board.card_changed(self)
+
     def update_description(self, trello):
         """ Updates this card's description to persist new changes to YAML
         data and (less often) the description field """
@@ -183,9 +272,42 @@ class Card(object):
 
         trello.update_card_description(self._card_data, full_description)
 
+        # Changes to YAML data are only known to the card indexes from here
+        self.parent_board.card_changed(self)
+
+    def set_due_date(self, trello, due_date):
+        """ Gives this card a new due date (a datetime or ISO 8601 string, or
+        None to remove the due date) """
+        due = due_date
+        if hasattr(due_date, 'isoformat'):
+            due = due_date.isoformat()
+
+        # Through the API
+        trello.update_card_due(self._card_data, due)
+        # In instance fields
+        self._card_data['due'] = due
+
+        self.parent_board.card_changed(self, False)
+
+    def _mark_inherited(self, key):
+        """ Helper function records that a YAML key was inherited, so it
+        won't be written back into the card's own description """
+        if not self._inherited_data:
+            self._inherited_data = set()
+
+        self._inherited_data.add(key)
+
+    def clear_inherited_data(self):
+        """ Removes every YAML key inherited from a list default or an
+        archetype, so they can be applied again """
+        for key in self._inherited_data:
+            self._yaml_data.pop(key, None)
+
+        self._inherited_data = NO_INHERITED_KEYS
+
     def apply_default_type(self, default_type):
         if not self.type_name:
-            self._inherited_data.append('type')
+            self._mark_inherited('type')
             self.type_name = default_type
 
     def apply_archetype(self, archetype_card):
@@ -195,7 +317,9 @@ class Card(object):
         for key in yaml_data:
             if key not in self._yaml_data:
                 self._yaml_data[key] = yaml_data[key]
-                self._inherited_data.append(key)
+                self._mark_inherited(key)
+
+        self.parent_board.card_changed(self, False)
 
     def archive(self, trello):
         # update card data to reflect change
@@ -208,6 +332,8 @@ class Card(object):
         self._parent_list.cards.remove(self)
         self._parent_list.closed_cards.append(self)
 
+        self.parent_board.card_changed(self)
+
     def unarchive(self, trello):
         # update card data to reflect change
         self._card_data['closed'] = False
@@ -219,25 +345,82 @@ class Card(object):
         self._parent_list.closed_cards.remove(self)
         self._parent_list.cards.append(self)
 
+        self.parent_board.card_changed(self)
+
+    def delete(self, trello):
+        """ Deletes this card from Trello permanently """
+        # make the change through API call
+        trello.delete_card(self._card_data)
+
+        # Remove from the parent container
+        if self.open:
+            self._parent_list.cards.remove(self)
+        else:
+            self._parent_list.closed_cards.remove(self)
+
+        self.parent_board.card_changed(self)
+
     def is_member(self, member):
         return member['id'] in self._card_data['idMembers']
 
+    def add_member(self, trello, member):
+        """ Adds the given Trello member to this card """
+        if not self.is_member(member):
+            trello.add_card_member(self._card_data, member)
+            self._card_data['idMembers'].append(intern_string(member['id']))
+            self.parent_board.card_changed(self, False)
+
+    def remove_member(self, trello, member):
+        """ Removes the given Trello member from this card """
+        if self.is_member(member):
+            trello.remove_card_member(self._card_data, member)
+            self._card_data['idMembers'].remove(member['id'])
+            self.parent_board.card_changed(self, False)
+
     def subscribe(self, trello):
         if not self.is_member(trello.member):
             trello.subscribe_card(self._card_data)
-            self._card_data['idMembers'].append(trello.member['id'])
+            self._card_data['idMembers'].append(
+                intern_string(trello.member['id']))
+            self.parent_board.card_changed(self, False)
 
     def unsubscribe(self, trello):
         if self.is_member(trello.member):
             trello.unsubscribe_card(self._card_data)
             self._card_data['idMembers'].remove(trello.member['id'])
+            self.parent_board.card_changed(self, False)
 
     def move(self, trello, destination_list):
-        # TODO this is a hack which moves cards by copying them, then
-        # archiving the original. It's done this way because the API card
-        # movement functions seem to be broken
-        self.copy(trello, destination_list)
-        self.archive(trello)
+        """ Moves this card to the given Trellonos list """
+        if destination_list is self._parent_list:
+            return
+
+        source_list = self._parent_list
+
+        # Only name the board in the API call when it changes
+        destination_board = None
+        if destination_list.parent_board is not source_list.parent_board:
+            destination_board = destination_list.parent_board._board_data
+
+        # make the change through API call
+        trello.move_card(self._card_data, destination_list._list_data,
+                         destination_board)
+
+        # update card data to reflect change
+        self._card_data['idList'] = destination_list.id
+
+        # Move to the proper parent container
+        if self.open:
+            source_list.cards.remove(self)
+            destination_list.cards.append(self)
+        else:
+            source_list.closed_cards.remove(self)
+            destination_list.closed_cards.append(self)
+
+        self._parent_list = destination_list
+
+        source_list.parent_board.card_changed(self)
+        destination_list.parent_board.card_changed(self)
 
     def copy(self, trello, destination_list=None, override_params={}):
         """ Copies this Card in the given Trellonos list or the same list """
@@ -250,20 +433,70 @@ class Card(object):
                                     override_params)
 
         # Make the wrapper
-        card_object = Card(self._trello, destination_list, new_card)
+        card_object = Card(self._trello, destination_list, new_card,
+                           destination_list.is_meta)
         # Add the wrapper to the destination list's container
         destination_list._cards.append(card_object)
+        destination_list.parent_board.card_changed(card_object)
 
         return card_object
 
     @property
     def checklists(self):
+        if dependencytools.recording:
+            self._record_read()
+        if self._checklists is None:
+            return {}
+
         return self._checklists
 
-    def fill_markup(self, trello, script_manager):
+    def fill_markup(self, trello, script_manager, dependencies=None):
         """ Replace all markup expressions in the card's name and description
-        with their values """
-        self.set_name(trello, script_manager.evaluate_markup(self.name))
+        with their values. If markup dependencies are given, cards filled
+        by an earlier run are filled again from their markup when what it
+        read has changed, and skipped otherwise """
+        name = self.name
+        full_description = self.full_description
+
+        if dependencies:
+            text = name + full_description
+            source = dependencies.markup_source(self.id, text)
+
+            if source:
+                if dependencies.is_current(self.id, text):
+                    MARKUP_CARDS.inc(result='skipped')
+                    return
+
+                # Start again from the markup the card was filled from
+                if source[0] is not None:
+                    name = source[0]
+                if source[1] is not None:
+                    full_description = source[1]
+
+        # Only touch the name and description if they contain markup, so
+        # cards without any cost no API calls
+        name_markup = script_manager.has_markup(name)
+        description_markup = script_manager.has_markup(full_description)
+
+        if not (name_markup or description_markup):
+            return
 
-        self.set_description(
-            trello, script_manager.evaluate_markup(self.full_description.strip()))
+        MARKUP_CARDS.inc(result='filled')
+
+        dependencytools.start_recording()
+        try:
+            if name_markup:
+                self.set_name(trello, script_manager.evaluate_markup(name))
+
+            if description_markup:
+                self.set_description(
+                    trello,
+                    script_manager.evaluate_markup(full_description.strip()))
+        finally:
+            keys = dependencytools.stop_recording()
+
+        if dependencies:
+            dependencies.update(self.id, self.name + self.full_description,
+                                keys, name if name_markup else None,
+                                full_description if description_markup
+                                else None)
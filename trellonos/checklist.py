@@ -1,13 +1,18 @@
-class Checklist(object):
+from memorytools import Slotted, intern_string
+
+
+class Checklist(Slotted):
     """ Wrapper class for a Trello checklist attached to a card """
 
+    __slots__ = ('_name', '_checkitems')
+
     def __init__(self, checklist_data):
-        self._name = checklist_data['name']
+        self._name = intern_string(checklist_data['name'])
 
         # Store check items as a dictionary of bools for easy lookup
         self._checkitems = {}
         for check_item in checklist_data['checkItems']:
-            name = check_item['name']
+            name = intern_string(check_item['name'])
             status = check_item['state']
 
             is_complete = (not status == 'incomplete')
@@ -0,0 +1,136 @@
+""" Command line entry point of Trellonos. Modules are imported when a run
+needs them, so that short cron runs start quickly """
+
+import os
+import sys
+import argparse
+
+from selectiontools import PROCESSOR_KINDS, RunSelection
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        prog='trellonos', description='Run Trellonos processing')
+    parser.add_argument('--board', dest='boards', action='append',
+                        metavar='NAME',
+                        help='only fetch and process this board '
+                             '(repeatable)')
+    parser.add_argument('--kind', dest='kinds', action='append',
+                        choices=PROCESSOR_KINDS,
+                        help='only run this kind of processing (repeatable)')
+    parser.add_argument('--processor', dest='processors', action='append',
+                        metavar='NAME_OR_ID',
+                        help='only run the processor card with this name or '
+                             'id (repeatable)')
+    parser.add_argument('--card', dest='card_id', metavar='ID',
+                        help='only process the card with this id: its card '
+                             'processors and markup, unless --kind is given')
+    parser.add_argument('--no-dump', dest='dump', action='store_false',
+                        help="don't dump the log to the output board")
+    parser.add_argument('--quiet', dest='echo', action='store_false',
+                        help="don't print the log (it is still dumped)")
+    parser.add_argument('--resume', action='store_true',
+                        help='resume an interrupted run from its journal, '
+                             'skipping the processors it finished')
+    parser.add_argument('--trace', metavar='PATH',
+                        help='write timing spans of the run to PATH (with '
+                             '--accounts, of each account to PATH with the '
+                             'account name before its extension)')
+    parser.add_argument('--accounts', metavar='CONFIG',
+                        help='run every account of a YAML config file, '
+                             'instead of the account of the environment')
+    parser.add_argument('--workers', type=int, metavar='N',
+                        help='worker processes running --accounts (by '
+                             'default, the workers setting of the config)')
+    parser.add_argument('--report', metavar='PATH',
+                        help='write the report of an --accounts run to PATH '
+                             'as JSON')
+
+    return parser.parse_args(argv)
+
+
+def run_accounts(arguments):
+    """ Runs every account of a config file, and reports on the run.
+    Returns the exit status: 1 if any account failed """
+    if arguments.card_id:
+        raise SystemExit('--card can\'t be used with --accounts')
+
+    # Checks the selection before any account runs
+    RunSelection(arguments.boards, arguments.kinds, arguments.processors)
+
+    import json
+    import metricstools
+    import runnertools
+
+    metricstools.serve_from_environment_vars()
+
+    config = runnertools.load_config(arguments.accounts)
+    selection_arguments = {'boards': arguments.boards,
+                           'kinds': arguments.kinds,
+                           'processors': arguments.processors}
+
+    reports = runnertools.run(config, selection_arguments, arguments.workers,
+                              arguments.dump, arguments.resume)
+
+    sys.stdout.write(runnertools.format_report(reports))
+
+    if arguments.report:
+        with open(arguments.report, 'w') as f:
+            json.dump(reports, f, indent=1, sort_keys=True)
+
+    metricstools.export_from_environment_vars()
+
+    if all([report['ok'] for report in reports]):
+        return 0
+
+    return 1
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    arguments = parse_arguments(argv)
+
+    import logtools as log
+    log.init_from_environment_vars()
+    log.set_echo(arguments.echo)
+
+    import tracetools
+    if arguments.trace:
+        os.environ['TRELLONOS_TRACE_PATH'] = arguments.trace
+        tracetools.enable()
+
+    if arguments.accounts:
+        return run_accounts(arguments)
+
+    selection = RunSelection(arguments.boards, arguments.kinds,
+                             arguments.processors, arguments.card_id)
+
+    from trellonos import Trellonos
+    import metricstools
+
+    # Serve metrics while the run lasts, if a port is configured
+    metricstools.serve_from_environment_vars()
+
+    # Construct a Trellonos object from environment variables, fetching
+    # only the selected boards, or loading them from the journal of an
+    # interrupted run
+    trellonos = Trellonos.from_environment_vars(selection, arguments.resume)
+
+    # Run Trellonos processing
+    trellonos.process()
+
+    # Write the run's timing spans and metrics, if requested
+    tracetools.export_from_environment_vars()
+    metricstools.export_from_environment_vars()
+
+    # Dump all console output to a Trello card
+    if arguments.dump:
+        trellonos.dump_log()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+import datetime
+
+# Helpers for the timestamps stored on Trello objects. Trello always
+# serializes dates the same way (e.g. 2015-05-06T16:00:00.000Z), so most
+# strings can be parsed by slicing instead of going through dateutil.
+
+TRELLO_DATE_LENGTH = len('2015-05-06T16:00:00.000Z')
+
+_ZERO = datetime.timedelta(0)
+
+
+class _UTC(datetime.tzinfo):
+    """ UTC timezone, equivalent to dateutil.tz.tzutc() """
+
+    def utcoffset(self, dt):
+        return _ZERO
+
+    def tzname(self, dt):
+        return 'UTC'
+
+    def dst(self, dt):
+        return _ZERO
+
+    def __repr__(self):
+        return 'UTC'
+
+UTC = _UTC()
+
+
+def _parse_trello_date(date_string):
+    """ Parses a timestamp in Trello's fixed format. Returns None if the
+    string is in any other format """
+    if (len(date_string) != TRELLO_DATE_LENGTH or date_string[10] != 'T'
+            or date_string[19] != '.' or date_string[-1] != 'Z'):
+        return None
+
+    try:
+        return datetime.datetime(int(date_string[0:4]),
+                                 int(date_string[5:7]),
+                                 int(date_string[8:10]),
+                                 int(date_string[11:13]),
+                                 int(date_string[14:16]),
+                                 int(date_string[17:19]),
+                                 int(date_string[20:23]) * 1000,
+                                 UTC)
+    except ValueError:
+        return None
+
+
+def aware(date):
+    """ The given datetime, taken to be in UTC if it has no timezone, so
+    it can be compared with parsed Trello dates """
+    if date is not None and date.tzinfo is None:
+        date = date.replace(tzinfo=UTC)
+
+    return date
+
+
+def parse_date(date_string):
+    """ Parses a timestamp retrieved from Trello into a timezone-aware
+    datetime """
+    date = _parse_trello_date(date_string)
+
+    if date is None:
+        # Anything unusual goes through the slow, general parser, which
+        # leaves dates without an offset naive
+        import dateutil.parser
+        date = aware(dateutil.parser.parse(date_string))
+
+    return date
+
+
+def now():
+    """ The current time as a timezone-aware datetime, comparable with
+    parsed Trello dates """
+    return datetime.datetime.now(UTC)
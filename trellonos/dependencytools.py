@@ -0,0 +1,221 @@
+import json
+import hashlib
+
+# This module records which Trello objects are read while markup is
+# evaluated. Accessors of Trellonos, Board, List and Card report reads with
+# record(). Hot accessors check the recording flag first, so reads cost a
+# single test unless a recording is in progress:
+#
+#   if dependencytools.recording:
+#       dependencytools.record('card', card_id)
+#
+# Each read is a key naming what was read:
+#   ('boards', None)   the names of all boards
+#   ('board', id)      the names of a board's lists
+#   ('list', id)       which cards a list contains
+#   ('card', id)       the content of a card
+#
+# Failed evaluations report FAILURE, so their results are never reused: the
+# failure may have been caused by something no key names, like the network.
+
+FAILURE = ('failure', None)
+
+_recordings = []
+
+# Whether any recording is in progress
+recording = False
+
+
+def start_recording():
+    """ Starts collecting reads. Recordings can be nested """
+    global recording
+
+    _recordings.append(set())
+    recording = True
+
+
+def stop_recording():
+    """ Stops the innermost recording and returns the keys it read """
+    global recording
+
+    keys = _recordings.pop()
+    recording = bool(_recordings)
+
+    return keys
+
+
+def reset():
+    """ Stops every recording, such as those a failure left in progress """
+    global recording
+
+    del _recordings[:]
+    recording = False
+
+
+def record(kind, id=None):
+    """ Reports a read of the given object to the innermost recording """
+    if _recordings:
+        _recordings[-1].add((kind, id))
+
+
+def record_all(keys):
+    """ Reports reads of all the given keys to the innermost recording """
+    if _recordings:
+        _recordings[-1].update(keys)
+
+
+def record_failure():
+    """ Reports a failed evaluation to the innermost recording """
+    if _recordings:
+        _recordings[-1].add(FAILURE)
+
+
+def _hash(value):
+    """ Stable hash of a JSON-like value """
+    text = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def card_content(card):
+    """ JSON-like summary of everything a card contains """
+    checklists = {}
+    for name in card.checklists:
+        checklists[name] = card.checklists[name].check_items
+
+    card_data = card.card_data
+    return [card_data['name'], card_data['desc'], card_data['closed'],
+            card_data.get('due'), card_data['idMembers'], card.yaml_data,
+            checklists]
+
+
+def content_hash(card):
+    """ Hash of everything a card contains """
+    return _hash(card_content(card))
+
+
+class MarkupDependencies(object):
+    """ Dependency graph from cards to the objects their markup expressions
+    read, persisted between runs so cards are only evaluated again when
+    something they read has changed.
+
+    Filling markup replaces its expressions in Trello with their values, so
+    the graph also keeps each card's markup source, and the hash of the
+    text filling left the card with. As long as the card still has that
+    text, the next run evaluates the source again if what it read has
+    changed, and skips the card otherwise. A card edited since then keeps
+    its edits, and only markup it contains now is evaluated """
+
+    def __init__(self, trellonos, previous_graph=None):
+        if previous_graph is None:
+            previous_graph = {}
+
+        self._trellonos = trellonos
+        self._previous_graph = previous_graph
+        self._graph = {}
+
+        # Every object by its key, found when first needed
+        self._objects = None
+
+    @property
+    def graph(self):
+        """ The dependency graph of the cards visited this run, to be passed
+        as previous_graph in the next run """
+        return self._graph
+
+    def _find_objects(self):
+        """ Helper function finds every object by its key, without recording
+        reads """
+        self._objects = {('boards', None): self._trellonos}
+
+        boards = self._trellonos.boards
+        for board_name in boards:
+            board = boards[board_name]
+            self._objects[('board', board.id)] = board
+
+            for list_name in board.lists:
+                list_object = board.lists[list_name]
+                self._objects[('list', list_object.id)] = list_object
+
+                for card in list_object.cards + list_object.closed_cards:
+                    self._objects[('card', card.id)] = card
+
+    def fingerprint(self, key):
+        """ Hash of the current state of the object named by the key, or None
+        if it no longer exists """
+        if self._objects is None:
+            self._find_objects()
+
+        if key not in self._objects:
+            return None
+
+        kind = key[0]
+        obj = self._objects[key]
+
+        if kind == 'boards':
+            content = sorted(obj.boards.keys())
+        elif kind == 'board':
+            content = sorted([[name, obj.lists[name].id]
+                              for name in obj.lists])
+        elif kind == 'list':
+            content = [card.id for card in obj.cards + obj.closed_cards]
+        else:
+            content = card_content(obj)
+
+        return _hash(content)
+
+    def _entry(self, card_id, text):
+        """ Helper function returns the previous run's entry of a card, if
+        the card still has the text filling its markup left it with """
+        entry = self._previous_graph.get(card_id)
+
+        if not entry or entry['text'] != _hash(text):
+            return None
+
+        return entry
+
+    def markup_source(self, card_id, text):
+        """ The name and full description a card with the given text had
+        before the previous run filled its markup, or None if it wasn't
+        filled or has been edited since. Either is None if it had no
+        markup """
+        entry = self._entry(card_id, text)
+
+        if not entry:
+            return None
+
+        return entry['name'], entry['description']
+
+    def is_current(self, card_id, text):
+        """ Whether the markup of a card with the given text was filled by
+        the previous run without errors, and nothing it read has changed
+        since. If so, the card's entry carries over to this run """
+        entry = self._entry(card_id, text)
+
+        # Cards whose evaluation failed have no dependencies
+        if not entry or entry['dependencies'] is None:
+            return False
+
+        for key in entry['dependencies']:
+            if self.fingerprint(key) != entry['dependencies'][key]:
+                return False
+
+        self._graph[card_id] = entry
+
+        return True
+
+    def update(self, card_id, text, keys, name=None, description=None):
+        """ Stores the keys read by filling the markup of a card's name and
+        full description, which left it with the given text. Cards whose
+        evaluation failed are evaluated again by the next run """
+        dependencies = None
+        if FAILURE not in keys:
+            dependencies = {}
+            for key in keys:
+                dependencies[key] = self.fingerprint(key)
+
+        self._graph[card_id] = {
+            'name': name,
+            'description': description,
+            'text': _hash(text),
+            'dependencies': dependencies
+        }
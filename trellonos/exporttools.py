@@ -0,0 +1,143 @@
+import json
+import itertools
+
+# This module exports board data as flat card records, one per card, for
+# reporting. Records are produced by a chain of generators, so only one card
+# (or one batch of cards, for columnar files) is held in memory at a time.
+
+# Columns of every card record, in order
+CARD_COLUMNS = ('board', 'board_id', 'list', 'list_id', 'card_id', 'name',
+                'closed', 'type', 'due', 'last_modified', 'checked_items',
+                'total_items', 'yaml')
+
+# Cards per row group of columnar files
+DEFAULT_BATCH_SIZE = 1000
+
+
+def iter_cards(boards, include_closed=False):
+    """ Generates (board, list, card) for every card of the given dictionary
+    of boards """
+    for board_name in sorted(boards):
+        board = boards[board_name]
+
+        for list_name in sorted(board.lists):
+            list_object = board.lists[list_name]
+
+            cards = list_object.cards
+            if include_closed:
+                cards = cards + list_object.closed_cards
+
+            for card in cards:
+                yield board, list_object, card
+
+
+def _isoformat(date):
+    if date is None:
+        return None
+
+    return date.isoformat()
+
+
+def card_record(board, list_object, card):
+    """ Flat dictionary of a card's data, with the names of its board and
+    list, its YAML fields and how many of its check items are checked """
+    checked_items = 0
+    total_items = 0
+    for name in card.checklists:
+        check_items = card.checklists[name].check_items
+        checked_items += sum(1 for item in check_items if check_items[item])
+        total_items += len(check_items)
+
+    return {
+        'board': board.name,
+        'board_id': board.id,
+        'list': list_object.name,
+        'list_id': list_object.id,
+        'card_id': card.id,
+        'name': card.name,
+        'closed': card.closed,
+        'type': card.type_name,
+        'due': _isoformat(card.due_date),
+        'last_modified': _isoformat(card.last_date_modified),
+        'checked_items': checked_items,
+        'total_items': total_items,
+        'yaml': card.yaml_data
+    }
+
+
+def card_records(boards, include_closed=False):
+    """ Generates a record for every card of the given boards """
+    for board, list_object, card in iter_cards(boards, include_closed):
+        yield card_record(board, list_object, card)
+
+
+def write_jsonl(records, f):
+    """ Writes records to a file as JSON Lines. Returns how many were
+    written """
+    count = 0
+
+    for record in records:
+        f.write(json.dumps(record, sort_keys=True, default=str))
+        f.write('\n')
+        count += 1
+
+    return count
+
+
+def _batches(records, batch_size):
+    records = iter(records)
+
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return
+
+        yield batch
+
+
+def write_parquet(records, path, batch_size=DEFAULT_BATCH_SIZE):
+    """ Writes records to a Parquet file, one row group per batch of cards.
+    YAML fields are stored as a JSON string column, since they differ from
+    card to card. Requires pyarrow. Returns how many records were written """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Parquet export requires pyarrow '
+                          '(pip install trellonos[parquet])')
+
+    schema = pyarrow.schema([
+        ('board', pyarrow.string()),
+        ('board_id', pyarrow.string()),
+        ('list', pyarrow.string()),
+        ('list_id', pyarrow.string()),
+        ('card_id', pyarrow.string()),
+        ('name', pyarrow.string()),
+        ('closed', pyarrow.bool_()),
+        ('type', pyarrow.string()),
+        ('due', pyarrow.string()),
+        ('last_modified', pyarrow.string()),
+        ('checked_items', pyarrow.int32()),
+        ('total_items', pyarrow.int32()),
+        ('yaml', pyarrow.string())
+    ])
+
+    count = 0
+    writer = pyarrow.parquet.ParquetWriter(path, schema)
+
+    try:
+        for batch in _batches(records, batch_size):
+            columns = {}
+            for column in CARD_COLUMNS:
+                columns[column] = [record[column] for record in batch]
+
+            columns['yaml'] = [json.dumps(yaml_data, sort_keys=True,
+                                          default=str)
+                               for yaml_data in columns['yaml']]
+
+            writer.write_table(pyarrow.Table.from_pydict(columns, schema))
+            count += len(batch)
+    finally:
+        writer.close()
+
+    return count
@@ -0,0 +1,549 @@
+import re
+import copy
+import json
+import datetime
+
+# This module provides transports for the Trello wrapper which don't need
+# network access:
+#
+#   FakeTrello          an in-memory Trello, loaded from a fixture, which
+#                       implements every endpoint trellotools uses
+#   RecordingTransport  passes requests to another transport and records
+#                       them with their responses to a cassette file
+#   ReplayTransport     answers requests from a recorded cassette
+#
+# Fixtures are JSON files of nested boards, lists, cards and checklists:
+#
+#   {"member": {"username": "trellonos"},
+#    "boards": [{"name": "Board", "lists": [{"name": "List", "cards": [
+#        {"name": "Card", "desc": "", "checklists": [
+#            {"name": "Checklist", "checkItems": [
+#                {"name": "Item", "state": "complete"}]}]}]}]}]}
+#
+# Anything left out (ids, positions, closed flags) is filled in.
+
+# Space between the positions of new lists and cards, as in Trello
+POSITION_STEP = 16384
+
+# Credentials aren't written to cassettes
+AUTH_PARAMS = ('key', 'token')
+
+
+class FakeTrelloError(Exception):
+    """ Raised for requests Trello would answer with an error status """
+
+    def __init__(self, status, message):
+        Exception.__init__(self, str(status) + ' ' + message)
+        self.status = status
+
+
+class ReplayError(Exception):
+    """ Raised for requests a cassette has no response to """
+    pass
+
+
+def _is_true(value):
+    return value is True or value == 'true'
+
+
+def _now_string():
+    return datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+class FakeTrello(object):
+    """ In-memory stand-in for the Trello API, used as a transport """
+
+    def __init__(self, fixture=None):
+        self._next_id = 0
+
+        self.member = None
+        self.boards = {}
+        self.lists = {}
+        self.cards = {}
+        self.checklists = {}
+        self.attachments = {}
+
+        if fixture is None:
+            fixture = {}
+        self.load(fixture)
+
+    @classmethod
+    def from_fixture(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    # FIXTURES #
+
+    def _new_id(self):
+        self._next_id += 1
+        return '%024x' % self._next_id
+
+    def _next_position(self, objects):
+        positions = [obj['pos'] for obj in objects]
+        return max(positions + [0]) + POSITION_STEP
+
+    def load(self, fixture):
+        """ Adds the member and boards of a fixture """
+        member = dict(fixture.get('member', {}))
+        member.setdefault('id', self._new_id())
+        member.setdefault('username', 'trellonos')
+        member.setdefault('fullName', 'Trellonos')
+        self.member = member
+
+        for board_fixture in fixture.get('boards', []):
+            board = self._add_board(board_fixture)
+
+            for list_fixture in board_fixture.get('lists', []):
+                list_data = self._add_list(board['id'], list_fixture)
+
+                for card_fixture in list_fixture.get('cards', []):
+                    self._add_card(list_data, card_fixture)
+
+    def _add_board(self, fixture):
+        board = {
+            'id': fixture.get('id') or self._new_id(),
+            'name': fixture['name'],
+            'closed': fixture.get('closed', False)
+        }
+        self.boards[board['id']] = board
+
+        return board
+
+    def _add_list(self, board_id, fixture, position=None):
+        if position is None:
+            position = fixture.get('pos')
+        if position is None:
+            position = self._next_position(self._board_lists(board_id))
+
+        list_data = {
+            'id': fixture.get('id') or self._new_id(),
+            'name': fixture['name'],
+            'closed': fixture.get('closed', False),
+            'pos': position,
+            'idBoard': board_id
+        }
+        self.lists[list_data['id']] = list_data
+
+        return list_data
+
+    def _add_card(self, list_data, fixture):
+        card = {
+            'id': fixture.get('id') or self._new_id(),
+            'name': fixture['name'],
+            'desc': fixture.get('desc', ''),
+            'closed': fixture.get('closed', False),
+            'due': fixture.get('due'),
+            'dateLastActivity': fixture.get('dateLastActivity',
+                                            _now_string()),
+            'idList': list_data['id'],
+            'idBoard': list_data['idBoard'],
+            'idMembers': list(fixture.get('idMembers', [])),
+            'idChecklists': [],
+            'pos': fixture.get('pos') or self._next_position(
+                self._list_cards(list_data['id']))
+        }
+        self.cards[card['id']] = card
+
+        for checklist_fixture in fixture.get('checklists', []):
+            checklist = {
+                'id': checklist_fixture.get('id') or self._new_id(),
+                'name': checklist_fixture['name'],
+                'idCard': card['id'],
+                'checkItems': []
+            }
+
+            for item_fixture in checklist_fixture.get('checkItems', []):
+                checklist['checkItems'].append({
+                    'id': item_fixture.get('id') or self._new_id(),
+                    'name': item_fixture['name'],
+                    'state': item_fixture.get('state', 'incomplete')
+                })
+
+            self.checklists[checklist['id']] = checklist
+            card['idChecklists'].append(checklist['id'])
+
+        return card
+
+    # QUERIES #
+
+    def _get(self, objects, id):
+        if id not in objects:
+            raise FakeTrelloError(404, 'The requested resource was not found.')
+
+        return objects[id]
+
+    def _board_lists(self, board_id):
+        return [list_data for list_data in self.lists.values()
+                if list_data['idBoard'] == board_id]
+
+    def _list_cards(self, list_id):
+        return [card for card in self.cards.values()
+                if card['idList'] == list_id]
+
+    def _filter(self, objects, filter_name):
+        if filter_name == 'open':
+            objects = [obj for obj in objects if not obj['closed']]
+        elif filter_name == 'closed':
+            objects = [obj for obj in objects if obj['closed']]
+
+        return objects
+
+    def _position(self, value, siblings):
+        """ A numeric position from a position parameter """
+        if value == 'top':
+            return min([obj['pos'] for obj in siblings] +
+                       [POSITION_STEP * 2]) / 2
+        if value in (None, 'bottom'):
+            return self._next_position(siblings)
+
+        return float(value)
+
+    # TRANSPORT #
+
+    def request(self, method, path, params=None, data=None, files=None):
+        """ Answers a Trello API request, like a transport """
+        arguments = {}
+        arguments.update(params or {})
+        arguments.update(data or {})
+
+        for route_method, route, handler_name in ROUTES:
+            if route_method != method:
+                continue
+
+            match = route.match(path)
+            if match:
+                handler = getattr(self, handler_name)
+                result = handler(arguments, files, *match.groups())
+
+                # Callers can't change the fake's data through responses
+                return copy.deepcopy(result)
+
+        raise FakeTrelloError(404, 'Cannot ' + method + ' /' + path)
+
+    # MEMBERS #
+
+    def _get_member(self, arguments, files, member_id):
+        if member_id not in ('me', self.member['id']):
+            raise FakeTrelloError(404, 'model not found')
+
+        return self.member
+
+    def _get_member_boards(self, arguments, files, member_id):
+        self._get_member(arguments, files, member_id)
+
+        boards = sorted(self.boards.values(), key=lambda board: board['id'])
+        return self._filter(boards, arguments.get('filter', 'all'))
+
+    # BOARDS #
+
+    def _update_board_closed(self, arguments, files, board_id):
+        board = self._get(self.boards, board_id)
+        board['closed'] = _is_true(arguments['value'])
+
+        return board
+
+    def _get_board_lists(self, arguments, files, board_id):
+        self._get(self.boards, board_id)
+
+        lists = sorted(self._board_lists(board_id),
+                       key=lambda list_data: list_data['pos'])
+        return self._filter(lists, arguments.get('filter', 'open'))
+
+    # LISTS #
+
+    def _get_list(self, arguments, files, list_id):
+        return self._get(self.lists, list_id)
+
+    def _update_list(self, arguments, files, list_id, field):
+        list_data = self._get(self.lists, list_id)
+        value = arguments['value']
+
+        if field == 'closed':
+            value = _is_true(value)
+        elif field == 'pos':
+            siblings = [other for other in
+                        self._board_lists(list_data['idBoard'])
+                        if other is not list_data]
+            value = self._position(value, siblings)
+
+        list_data[field] = value
+
+        return list_data
+
+    def _create_list(self, arguments, files):
+        board_id = arguments['idBoard']
+        self._get(self.boards, board_id)
+
+        position = self._position(arguments.get('pos'),
+                                  self._board_lists(board_id))
+        list_data = self._add_list(board_id, {'name': arguments['name']},
+                                   position)
+
+        # Copying a list copies its open cards
+        source_id = arguments.get('idListSource')
+        if source_id:
+            self._get(self.lists, source_id)
+
+            source_cards = sorted(self._filter(self._list_cards(source_id),
+                                               'open'),
+                                  key=lambda card: card['pos'])
+            for card in source_cards:
+                self._copy_card(card, list_data, {})
+
+        return list_data
+
+    def _archive_all_cards(self, arguments, files, list_id):
+        self._get(self.lists, list_id)
+
+        for card in self._list_cards(list_id):
+            card['closed'] = True
+
+    def _move_all_cards(self, arguments, files, list_id):
+        self._get(self.lists, list_id)
+        destination = self._get(self.lists, arguments['idList'])
+
+        for card in self._filter(self._list_cards(list_id), 'open'):
+            card['idList'] = destination['id']
+            card['idBoard'] = destination['idBoard']
+
+    def _get_list_cards(self, arguments, files, list_id):
+        self._get(self.lists, list_id)
+
+        cards = sorted(self._list_cards(list_id),
+                       key=lambda card: card['pos'])
+        cards = self._filter(cards, arguments.get('filter', 'open'))
+
+        fields = arguments.get('fields')
+        if fields and fields != 'all':
+            fields = ['id'] + fields.split(',')
+            cards = [dict((field, card[field]) for field in fields
+                          if field in card)
+                     for card in cards]
+
+        # Checklists can be nested in the cards
+        if arguments.get('checklists') == 'all':
+            cards = [dict(card, checklists=[
+                self.checklists[checklist_id]
+                for checklist_id in card.get('idChecklists', [])])
+                for card in cards]
+
+        return cards
+
+    # CARDS #
+
+    def _copy_card(self, source, list_data, overrides):
+        fixture = dict(source)
+        del fixture['id']
+        del fixture['pos']
+        fixture['idMembers'] = []
+        fixture.update(overrides)
+
+        # Checklists are copied with new ids
+        fixture['checklists'] = []
+        for checklist_id in source['idChecklists']:
+            checklist = self.checklists[checklist_id]
+            fixture['checklists'].append({
+                'name': checklist['name'],
+                'checkItems': [{'name': item['name'], 'state': item['state']}
+                               for item in checklist['checkItems']]
+            })
+
+        return self._add_card(list_data, fixture)
+
+    def _create_card(self, arguments, files):
+        list_data = self._get(self.lists, arguments['idList'])
+
+        due = arguments.get('due')
+        if due == 'null':
+            due = None
+
+        source_id = arguments.get('idCardSource')
+        if source_id:
+            source = self._get(self.cards, source_id)
+
+            overrides = {'due': due}
+            if 'name' in arguments:
+                overrides['name'] = arguments['name']
+            if 'desc' in arguments:
+                overrides['desc'] = arguments['desc']
+
+            return self._copy_card(source, list_data, overrides)
+
+        return self._add_card(list_data, {'name': arguments['name'],
+                                          'desc': arguments.get('desc', ''),
+                                          'due': due})
+
+    def _get_card(self, arguments, files, card_id):
+        card = self._get(self.cards, card_id)
+
+        fields = arguments.get('fields')
+        if fields and fields != 'all':
+            fields = ['id'] + fields.split(',')
+            card = dict((field, card[field]) for field in fields
+                        if field in card)
+
+        return card
+
+    def _delete_card(self, arguments, files, card_id):
+        card = self._get(self.cards, card_id)
+
+        for checklist_id in card['idChecklists']:
+            del self.checklists[checklist_id]
+        del self.cards[card_id]
+
+    def _update_card(self, arguments, files, card_id, field):
+        card = self._get(self.cards, card_id)
+        value = arguments['value']
+
+        if field == 'closed':
+            value = _is_true(value)
+        elif field == 'due' and value == 'null':
+            value = None
+
+        card[field] = value
+        card['dateLastActivity'] = _now_string()
+
+        return card
+
+    def _move_card(self, arguments, files, card_id):
+        card = self._get(self.cards, card_id)
+        list_data = self._get(self.lists, arguments['idList'])
+
+        card['idList'] = list_data['id']
+        card['idBoard'] = list_data['idBoard']
+        card['pos'] = self._next_position(self._list_cards(list_data['id']))
+        card['dateLastActivity'] = _now_string()
+
+        return card
+
+    def _add_card_member(self, arguments, files, card_id):
+        card = self._get(self.cards, card_id)
+
+        if arguments['value'] not in card['idMembers']:
+            card['idMembers'].append(arguments['value'])
+
+        return card['idMembers']
+
+    def _remove_card_member(self, arguments, files, card_id, member_id):
+        card = self._get(self.cards, card_id)
+
+        if member_id in card['idMembers']:
+            card['idMembers'].remove(member_id)
+
+        return card['idMembers']
+
+    def _add_card_attachment(self, arguments, files, card_id):
+        self._get(self.cards, card_id)
+
+        filename, data, mime_type = files['file']
+        attachment = {
+            'id': self._new_id(),
+            'name': arguments.get('name', filename),
+            'mimeType': mime_type,
+            'bytes': len(data)
+        }
+        self.attachments.setdefault(card_id, []).append(attachment)
+
+        return attachment
+
+    # CHECKLISTS #
+
+    def _get_checklist(self, arguments, files, checklist_id):
+        return self._get(self.checklists, checklist_id)
+
+
+_ID = r'([^/]+)'
+
+# Endpoints of the fake: method, path regex and handler method name
+ROUTES = [
+    ('GET', re.compile('^members/' + _ID + '$'), '_get_member'),
+    ('GET', re.compile('^members/' + _ID + '/boards$'), '_get_member_boards'),
+    ('PUT', re.compile('^boards/' + _ID + '/closed$'),
+     '_update_board_closed'),
+    ('GET', re.compile('^boards/' + _ID + '/lists$'), '_get_board_lists'),
+    ('GET', re.compile('^lists/' + _ID + '$'), '_get_list'),
+    ('PUT', re.compile('^lists/' + _ID + '/(name|closed|pos)$'),
+     '_update_list'),
+    ('POST', re.compile('^lists$'), '_create_list'),
+    ('POST', re.compile('^lists/' + _ID + '/archiveAllCards$'),
+     '_archive_all_cards'),
+    ('POST', re.compile('^lists/' + _ID + '/moveAllCards$'),
+     '_move_all_cards'),
+    ('GET', re.compile('^lists/' + _ID + '/cards$'), '_get_list_cards'),
+    ('GET', re.compile('^cards/' + _ID + '$'), '_get_card'),
+    ('POST', re.compile('^cards$'), '_create_card'),
+    ('DELETE', re.compile('^cards/' + _ID + '$'), '_delete_card'),
+    ('PUT', re.compile('^cards/' + _ID + '/(name|desc|due|closed)$'),
+     '_update_card'),
+    ('PUT', re.compile('^cards/' + _ID + '$'), '_move_card'),
+    ('POST', re.compile('^cards/' + _ID + '/idMembers$'), '_add_card_member'),
+    ('DELETE', re.compile('^cards/' + _ID + '/idMembers/' + _ID + '$'),
+     '_remove_card_member'),
+    ('POST', re.compile('^cards/' + _ID + '/attachments$'),
+     '_add_card_attachment'),
+    ('GET', re.compile('^checklists/' + _ID + '$'), '_get_checklist'),
+]
+
+
+def _normalize(value):
+    """ The JSON form of request arguments, without credentials, so that
+    recorded and replayed requests compare equal """
+    value = dict(value or {})
+    for param in AUTH_PARAMS:
+        value.pop(param, None)
+
+    return json.loads(json.dumps(value, sort_keys=True, default=str))
+
+
+class RecordingTransport(object):
+    """ Passes requests to another transport, recording each with its
+    response for replay """
+
+    def __init__(self, transport):
+        self._transport = transport
+        self.interactions = []
+
+    def request(self, method, path, params=None, data=None, files=None):
+        response = self._transport.request(method, path, params, data, files)
+
+        self.interactions.append({
+            'method': method,
+            'path': path,
+            'params': _normalize(params),
+            'data': _normalize(data),
+            'response': response
+        })
+
+        return response
+
+    def save(self, path):
+        """ Writes the recorded requests to a cassette file """
+        with open(path, 'w') as f:
+            json.dump(self.interactions, f, indent=1, sort_keys=True)
+
+
+class ReplayTransport(object):
+    """ Answers requests with the responses recorded for them, in order """
+
+    def __init__(self, interactions):
+        self._interactions = list(interactions)
+
+    @classmethod
+    def from_cassette(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def request(self, method, path, params=None, data=None, files=None):
+        params = _normalize(params)
+        data = _normalize(data)
+
+        # Identical requests are answered in the order they were recorded
+        for i, interaction in enumerate(self._interactions):
+            if (interaction['method'] == method and
+                    interaction['path'] == path and
+                    interaction['params'] == params and
+                    interaction['data'] == data):
+                del self._interactions[i]
+                return copy.deepcopy(interaction['response'])
+
+        raise ReplayError('No recorded response to ' + method + ' /' + path)
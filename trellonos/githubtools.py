@@ -1,20 +1,131 @@
 import os
+import sys
+import json
+import hashlib
+import marshal
+from os.path import expanduser
 
-from github import Github
 import logtools as log
+import metricstools
+
+
+GIST_API_URL = 'https://api.github.com/gists/'
+GIST_CACHE_DIR = expanduser('~/.trellonos/gists')
+
+# Seconds to wait on GitHub before falling back to the cached revision
+GITHUB_TIMEOUT = 10
+
+# Marshalled code is only valid for the Python version that wrote it
+CODE_SUFFIX = '.py%d%d.code' % sys.version_info[:2]
+
+
+GIST_FETCHES = metricstools.counter(
+    'trellonos_gist_fetches_total',
+    'Gists retrieved from GitHub, by result: fetched, not_modified, or '
+    'cached when GitHub was unreachable', ('result',))
 
 
 class SecurityException(Exception):
     pass
 
 
+class GistUnavailableException(Exception):
+    pass
+
+
+def _is_transient(error):
+    """ Whether a requests error means GitHub couldn't answer for now
+    (no connection, a timeout or a server error), rather than that the
+    request itself was refused """
+    import requests
+
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+
+    response = getattr(error, 'response', None)
+    return response is not None and response.status_code >= 500
+
+
+def _write_atomically(path, data):
+    """ Writes a file so concurrent readers never see a partial version """
+    temp_path = path + '.tmp' + str(os.getpid())
+
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+
+    os.rename(temp_path, path)
+
+
+class GistCache(object):
+    """ On-disk cache of gist file contents and their compiled code, keyed by
+    gist id and revision """
+
+    def __init__(self, directory=GIST_CACHE_DIR):
+        self._directory = directory
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _entry_path(self, id):
+        return os.path.join(self._directory, id + '.json')
+
+    def _code_path(self, id, revision, filename):
+        filename_hash = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+        return os.path.join(self._directory, id + '.' + revision + '.' +
+                            filename_hash[:12] + CODE_SUFFIX)
+
+    def load(self, id):
+        """ Retrieves the last known-good revision of a gist, as a dictionary
+        of etag, revision, public, files and users (the GitHub users it was
+        fetched or revalidated for), or None if it isn't cached """
+        try:
+            with open(self._entry_path(id), 'rb') as f:
+                return json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, id, entry):
+        """ Stores a new revision of a gist, discarding code compiled from
+        older revisions """
+        _write_atomically(self._entry_path(id),
+                          json.dumps(entry).encode('utf-8'))
+
+        current_prefix = id + '.' + entry['revision'] + '.'
+        for name in os.listdir(self._directory):
+            if (name.startswith(id + '.') and name.endswith(CODE_SUFFIX) and
+                    not name.startswith(current_prefix)):
+                os.remove(os.path.join(self._directory, name))
+
+    def load_code(self, id, revision, filename):
+        """ Retrieves the compiled code of a gist file, or None if it hasn't
+        been compiled by this Python version yet """
+        try:
+            with open(self._code_path(id, revision, filename), 'rb') as f:
+                return marshal.loads(f.read())
+        except (IOError, OSError, ValueError, EOFError, TypeError):
+            return None
+
+    def save_code(self, id, revision, filename, code):
+        """ Stores the compiled code of a gist file """
+        _write_atomically(self._code_path(id, revision, filename),
+                          marshal.dumps(code))
+
+
 class GithubManager(object):
     """ Wrapper for Github operations, specifically retrieving scripts from
     gists """
 
-    def __init__(self, username, password):
-        self.__github = Github(username, password)
+    def __init__(self, username, password, cache=None):
+        self.__auth = (username, password)
+
+        if cache is None:
+            cache = GistCache()
+        self._cache = cache
+
+        # Gists already retrieved during this run, and gist files whose
+        # compiled code has been handed to a script manager
         self._gists = {}
+        self._loaded_code = set()
 
     @classmethod
     def from_environment_vars(cls):
@@ -23,6 +134,133 @@ class GithubManager(object):
         password = os.environ['GITHUB_PASSWORD']
         return cls(username, password)
 
+    def _fetch_file(self, gist_file):
+        """ Retrieves the content of a gist file, which GitHub leaves out of
+        the gist itself for large files """
+        if not gist_file.get('truncated'):
+            return gist_file['content']
+
+        import requests
+
+        response = requests.get(gist_file['raw_url'], auth=self.__auth,
+                                timeout=GITHUB_TIMEOUT)
+        response.raise_for_status()
+
+        return response.text
+
+    def get_gist(self, id):
+        """ Retrieves a gist as a dictionary of etag, revision, public and
+        files. Unchanged gists are revalidated with a conditional request,
+        and the cached revision is used if GitHub can't be reached, but
+        only if GitHub has let this user read it. Gists GitHub refuses
+        (deleted, or hidden from revoked credentials) are unavailable even
+        if cached """
+
+        # don't make redundant API calls
+        if id in self._gists:
+            return self._gists[id]
+
+        # Only loaded once a processor actually needs a gist
+        import requests
+
+        entry = self._cache.load(id)
+        username = self.__auth[0]
+
+        # Unchanged gists cost a 304 response and no rate limit budget
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+
+        try:
+            response = requests.get(GIST_API_URL + id, auth=self.__auth,
+                                    headers=headers, timeout=GITHUB_TIMEOUT)
+
+            if response.status_code == 200:
+                gist_data = response.json()
+
+                revision = gist_data['updated_at']
+                if gist_data.get('history'):
+                    revision = gist_data['history'][0]['version']
+
+                files = {}
+                for filename in gist_data['files']:
+                    files[filename] = self._fetch_file(
+                        gist_data['files'][filename])
+
+                entry = {
+                    'etag': response.headers.get('ETag'),
+                    'revision': revision,
+                    'public': gist_data['public'],
+                    'files': files,
+                    'users': [username]
+                }
+
+                self._cache.save(id, entry)
+                GIST_FETCHES.inc(result='fetched')
+            elif response.status_code == 304:
+                # The cache is shared by accounts, so GitHub's answer only
+                # vouches for this user
+                if username not in entry.get('users', []):
+                    entry['users'] = entry.get('users', []) + [username]
+                    self._cache.save(id, entry)
+
+                GIST_FETCHES.inc(result='not_modified')
+            else:
+                response.raise_for_status()
+        except requests.RequestException as e:
+            # A revision cached for another user may not be this user's
+            if entry and username not in entry.get('users', []):
+                entry = None
+
+            if not entry or not _is_transient(e):
+                log.message('Error: gist ' + id + ' is unavailable: ' +
+                            str(e))
+                raise GistUnavailableException(
+                    'Gist ' + id + ' is unavailable: ' + str(e))
+
+            log.message('Using cached revision ' + entry['revision'] +
+                        ' of gist ' + id + ': ' + str(e))
+            GIST_FETCHES.inc(result='cached')
+
+        self._gists[id] = entry
+
+        return entry
+
+    def get_script(self, id, filename):
+        """ Retrieves the source of a gist file, refusing public gists """
+        gist = self.get_gist(id)
+
+        # security check
+        if gist['public']:
+            raise SecurityException('Error: attempted to run public code')
+
+        return gist['files'][filename]
+
+    def prepare_script(self, scriptManager, id, filename):
+        """ Retrieves the source of a gist file and makes sure the given
+        script manager has its compiled code, reusing code compiled by a
+        previous run of the same revision """
+        script = self.get_script(id, filename)
+        revision = self._gists[id]['revision']
+
+        code_key = (id, revision, filename)
+        if code_key not in self._loaded_code:
+            self._loaded_code.add(code_key)
+
+            code = self._cache.load_code(id, revision, filename)
+
+            if code is not None:
+                scriptManager.add_compiled(script, code)
+            else:
+                try:
+                    code = scriptManager.compile(script)
+                    self._cache.save_code(id, revision, filename, code)
+                except SyntaxError:
+                    # Reported when the script is executed
+                    pass
+
+        return script
+
     def execute_gist(self, scriptManager, id, filename, input={},
                      continue_on_error=True):
 
@@ -32,26 +270,14 @@ class GithubManager(object):
         continue_on_error is false.
         """
 
-        log.open_context('Script ' + filename + ' from gist ' + id)
-
-
-        # retrieve the gist, but don't make redundant API calls
-        gist = None
-        if id in self._gists:
-            gist = self._gists[id]
-        else:
-            gist = self.__github.get_gist(id)
-            self._gists[id] = gist
-
-        # security check
-        if gist.public:
-            raise SecurityException('Error: attempted to run public code')
+        log.open_context('Script ' + filename + ' from gist ' + id,
+                         gist_id=id, gist_file=filename)
 
-        # extract the script
-        script = gist.files[filename].content
+        try:
+            script = self.prepare_script(scriptManager, id, filename)
 
-        output = scriptManager.execute(script, input, continue_on_error)
-        log.close_context()
+            output = scriptManager.execute(script, input, continue_on_error)
+        finally:
+            log.close_context()
 
         return output
-
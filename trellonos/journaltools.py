@@ -0,0 +1,305 @@
+import os
+import copy
+import pickle
+from collections import deque
+
+import logtools as log
+from sandboxtools import RecordingTrello, MUTATING_METHODS
+
+# This module lets a run interrupted halfway through processing (by a network
+# error, a GitHub outage or a kill) be resumed instead of started over. While
+# processors run, every mutation made through the Trello wrapper, and the
+# start and successful end of every unit of work, is appended to a journal in
+# the state directory:
+#
+#   header      the boards as loaded at the start of processing
+#   start       (board id, processor card id, target id) of a processor run
+#               about to start. The mutations which follow belong to it
+#   mutation    (method name, args, kwargs, result) of a Trello change
+#   unit        the key of a processor run which finished without error
+#
+# A resumed run loads the boards from the header instead of fetching them,
+# applies the mutations of finished units to them in memory only (their
+# results are replayed instead of calling Trello again), and skips those
+# units. Units which were cut short or failed are run again. The mutations
+# they had already made are answered from the journal instead of being made
+# a second time, for as long as the run repeats them in the same order. The
+# journal is removed when processing ends.
+
+HEADER = 'header'
+START = 'start'
+MUTATION = 'mutation'
+UNIT = 'unit'
+
+
+def unit(board, processor, target):
+    """ The key of one run of a processor on one target (a board, list or
+    card) of a board """
+    return (board.id, processor.id, target.id)
+
+
+def _signature(value):
+    """ A mutation's arguments with Trello objects replaced by their ids, to
+    compare mutations made again with those of an interrupted run """
+    if isinstance(value, dict):
+        if 'id' in value:
+            return value['id']
+
+        return tuple(sorted((key, _signature(value[key])) for key in value))
+
+    if isinstance(value, (list, tuple)):
+        return tuple(_signature(item) for item in value)
+
+    return value
+
+
+class Journal(object):
+    """ Append-only record of the progress of processing """
+
+    def __init__(self, path):
+        self._path = path
+        self._file = None
+
+        # What was read back from an interrupted run, or written so far:
+        # the mutations of finished units, and the keys of those units
+        self._boards = None
+        self._mutations = []
+        self._units = set()
+
+        # Unit key -> mutations of a unit which didn't finish, and the unit
+        # in progress
+        self._unfinished = {}
+        self._current = None
+
+    @classmethod
+    def load(cls, path):
+        """ Reads the journal of an interrupted run, or returns None if
+        there is none """
+        journal = cls(path)
+
+        try:
+            f = open(path, 'rb')
+        except (IOError, OSError):
+            return None
+
+        with f:
+            try:
+                kind, journal._boards = pickle.load(f)
+            except Exception:
+                return None
+
+            if kind != HEADER:
+                return None
+
+            while True:
+                # A record cut short by the interruption ends the journal
+                try:
+                    kind, record = pickle.load(f)
+                except Exception:
+                    break
+
+                if kind == START:
+                    journal._current = record
+                    journal._unfinished[record] = []
+                elif kind == MUTATION:
+                    journal._unfinished.setdefault(journal._current,
+                                                   []).append(record)
+                elif kind == UNIT:
+                    journal._units.add(record)
+                    journal._mutations.extend(
+                        journal._unfinished.pop(record, []))
+                    journal._current = None
+
+        # Only the units which are run again can use their mutations
+        journal._unfinished.pop(None, None)
+        journal._current = None
+
+        return journal
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def boards(self):
+        return self._boards
+
+    @property
+    def mutations(self):
+        return self._mutations
+
+    @property
+    def units(self):
+        return self._units
+
+    @property
+    def unfinished_units(self):
+        """ Keys of the units which made mutations without finishing """
+        return [unit_key for unit_key in self._unfinished
+                if self._unfinished[unit_key]]
+
+    def _write(self, kind, record):
+        pickle.dump((kind, record), self._file, pickle.HIGHEST_PROTOCOL)
+
+        # Records must reach the file before the run can be interrupted
+        self._file.flush()
+
+    def start(self, boards):
+        """ Begins a new journal of the processing of the given boards """
+        directory = os.path.dirname(self._path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._boards = boards
+        self._mutations = []
+        self._units = set()
+        self._unfinished = {}
+        self._current = None
+
+        self._file = open(self._path, 'wb')
+        self._write(HEADER, boards)
+
+    def reopen(self):
+        """ Continues the journal of an interrupted run """
+        self._file = open(self._path, 'ab')
+
+    def begin(self, unit_key):
+        """ Records that a unit of work is starting. The mutations an
+        interrupted run of it made are answered by take_made_mutation """
+        self._current = unit_key
+        self._write(START, unit_key)
+
+    def add_mutation(self, mutation):
+        self._mutations.append(mutation)
+        self._write(MUTATION, mutation)
+
+    def take_made_mutation(self, method_name, args, kwargs):
+        """ The journaled mutation an interrupted run of the current unit
+        made, if it is the given one, or None. Once the unit makes a
+        different mutation, none of the rest are answered """
+        made = self._unfinished.get(self._current)
+        if not made:
+            return None
+
+        mutation = made.pop(0)
+        if (mutation[0], _signature(mutation[1]), _signature(mutation[2])) \
+                == (method_name, _signature(args), _signature(kwargs)):
+            return mutation
+
+        log.message('Processor run differs from its interrupted run after ' +
+                    'a ' + method_name + ' call. ' + str(len(made) + 1) +
+                    ' mutations it made before may be made again')
+        del made[:]
+
+        return None
+
+    def complete(self, unit_key):
+        """ Records that a unit of work finished without error """
+        self._units.add(unit_key)
+        self._unfinished.pop(unit_key, None)
+        self._current = None
+        self._write(UNIT, unit_key)
+
+    def is_complete(self, unit_key):
+        return unit_key in self._units
+
+    def finish(self):
+        """ Removes the journal once processing is over """
+        if self._file:
+            self._file.close()
+            self._file = None
+
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+
+
+class JournalingTrello(RecordingTrello):
+    """ Stand-in for the Trello wrapper which carries out mutations and
+    appends them to a journal """
+
+    def __init__(self, trello, journal):
+        RecordingTrello.__init__(self, trello, passthrough=True)
+        self._journal = journal
+
+    def _record(self, method_name, args, kwargs):
+        made = self._journal.take_made_mutation(method_name, args, kwargs)
+        if made is not None:
+            # An interrupted run of the same unit made it already
+            self._journal.add_mutation(made)
+            return copy.deepcopy(made[3])
+
+        result = RecordingTrello._record(self, method_name, args, kwargs)
+
+        # The journal keeps the mutations, so they aren't kept twice
+        self._journal.add_mutation(self._mutations.pop())
+
+        return result
+
+
+def _replayed_method(method_name):
+    """ Makes a ReplayTrello method which returns the journaled result of
+    the Trello wrapper method of the same name """
+    def method(self, *args, **kwargs):
+        return self._replay(method_name)
+
+    method.__name__ = method_name
+    return method
+
+
+class ReplayTrello(object):
+    """ Stand-in for the Trello wrapper used to apply journaled mutations in
+    memory. Mutations return their journaled results, in the order they
+    were made, without calling Trello. Reads go to the wrapped Trello
+    wrapper """
+
+    def __init__(self, trello, mutations):
+        self._trello = trello
+        self._results = {}
+
+        for method_name, args, kwargs, result in mutations:
+            self._results.setdefault(method_name, deque()).append(result)
+
+    @property
+    def member(self):
+        return self._trello.member
+
+    def __getattr__(self, name):
+        return getattr(self._trello, name)
+
+    def _replay(self, method_name):
+        results = self._results.get(method_name)
+        if not results:
+            return None
+
+        return copy.deepcopy(results.popleft())
+
+
+# Install the replaying methods
+for _method_name in MUTATING_METHODS:
+    setattr(ReplayTrello, _method_name, _replayed_method(_method_name))
+
+
+def replay(trellonos, journal):
+    """ Applies the mutations of an interrupted run to the boards of its
+    journal, which Trellonos has loaded, without changing Trello """
+    from sandboxtools import MutationApplier
+
+    boards = journal.boards.values()
+    replay_trello = ReplayTrello(trellonos.trello, journal.mutations)
+
+    for board in boards:
+        board.update_trello_instance(replay_trello)
+
+    MutationApplier(replay_trello, trellonos).apply(journal.mutations)
+
+    # Objects created by the mutations get the live wrapper too
+    for board in boards:
+        board.update_trello_instance(trellonos.trello)
+
+    log.message('Resuming an interrupted run: replayed ' +
+                str(len(journal.mutations)) + ' mutations, skipping ' +
+                str(len(journal.units)) + ' finished processor runs. ' +
+                str(len(journal.unfinished_units)) + ' processor runs ' +
+                'which were cut short will be run again')
@@ -1,19 +1,33 @@
 import random
 from card import Card
+from memorytools import Slotted, trim_data
+import dependencytools
+from selectiontools import ALL
+from trellotools import FILTER_ALL
 
+# The fields of the raw list payload Trellonos reads
+LIST_FIELDS = ('id', 'name', 'closed', 'pos', 'idBoard')
+INTERNED_LIST_FIELDS = ('id', 'idBoard')
 
-class List(object):
 
-    def __init__(self, trello, parent_board, trello_list, is_meta):
+class List(Slotted):
+
+    __slots__ = ('_trello', '_parent_board', '_list_data', '_is_meta',
+                 '_cards', '__closed_cards', '__index')
+
+    def __init__(self, trello, parent_board, trello_list, is_meta=False):
         self._trello = trello
         self._parent_board = parent_board
-        self._list_data = trello_list
+        self._list_data = trim_data(trello_list, LIST_FIELDS,
+                                    INTERNED_LIST_FIELDS)
+        self._is_meta = is_meta
 
         self._cards = []
         self.__closed_cards = []
 
         # store contained cards in a list
-        for trello_card in trello.get_cards(trello_list):
+        for trello_card in trello.get_cards(trello_list,
+                                            checklists=FILTER_ALL):
             # in trellonos form
             card = Card(trello, self, trello_card, is_meta)
 
@@ -43,8 +57,14 @@ class List(object):
     def position(self):
         return self._list_data['pos']
 
+    @property
+    def is_meta(self):
+        return self._is_meta
+
     @property
     def cards(self):
+        if dependencytools.recording:
+            dependencytools.record('list', self._list_data['id'])
         return self._cards
 
     @property
@@ -53,6 +73,8 @@ class List(object):
 
     @property
     def closed_cards(self):
+        if dependencytools.recording:
+            dependencytools.record('list', self._list_data['id'])
         return self.__closed_cards
 
     def set_name(self, trello, name):
@@ -78,15 +100,59 @@ class List(object):
 
         # Remove this list from the parent board's dictionary
         self._parent_board.lists.pop(self.name)
+        self._parent_board.card_changed()
+
+    def unarchive(self, trello):
+        # Update self-contained data to reflect this call
+        self._list_data['closed'] = False
+
+        # Trello API call to unarchive
+        trello.update_list_closed(self._list_data, False)
+
+        # Add this list back to the parent board's dictionary
+        self._parent_board.lists[self.name] = self
+        self._parent_board.card_changed()
 
     def archive_all_cards(self, trello):
         """ Archives all cards in this list that are not already archived """
-        for i in reversed(range(len(self.cards))):
-            # Loop through the collection in reverse to avoid indexing
-            # errors. Don't iterate because archive() will modify the
-            # contents of self.cards
-            card = self.cards[i]
-            card.archive(trello)
+        if not self._cards:
+            return
+
+        # One API call archives the whole list's cards
+        trello.archive_all_cards(self._list_data)
+
+        # Update self-contained data to reflect the call
+        for card in self._cards:
+            card.card_data['closed'] = True
+
+        archived_cards = self._cards
+        self.__closed_cards.extend(archived_cards)
+        self._cards = []
+
+        for card in archived_cards:
+            self._parent_board.card_changed(card)
+
+    def move_all_cards(self, trello, destination_list):
+        """ Moves all open cards in this list to the given Trellonos list """
+        if not self._cards or destination_list is self:
+            return
+
+        # One API call moves the whole list's cards
+        trello.move_all_cards(self._list_data, destination_list._list_data)
+
+        # Update the moved cards and both containers to reflect the call
+        for card in self._cards:
+            card.card_data['idList'] = destination_list.id
+            card._parent_list = destination_list
+
+        moved_cards = self._cards
+        destination_list._cards.extend(moved_cards)
+        self._cards = []
+
+        for card in moved_cards:
+            if self._parent_board is not destination_list.parent_board:
+                self._parent_board.card_changed(card)
+            destination_list.parent_board.card_changed(card)
 
     def unarchive_all_cards(self, trello):
         """ Unarchives all archived cards in this list """
@@ -113,13 +179,15 @@ class List(object):
 
         return cards
 
-    def create_card(self, trello, name):
-        """ Creates a card in this list. Adds the card to this lists's
-        container and returns the Trellonos wrapper object """
+    def create_card(self, trello, name, description=''):
+        """ Creates a card in this list, optionally with a description. Adds
+        the card to this lists's container and returns the Trellonos wrapper
+        object """
 
-        trello_card = trello.create_card(self._list_data, name)
-        new_card = Card(trello, self, trello_card)
+        trello_card = trello.create_card(self._list_data, name, description)
+        new_card = Card(trello, self, trello_card, self._is_meta)
         self._cards.append(new_card)
+        self._parent_board.card_changed(new_card)
 
         return new_card
 
@@ -161,10 +229,18 @@ class List(object):
                                     override_params)
 
         # Make the wrapper
-        list_object = List(self._trello, destination_board, new_list)
+        list_object = List(self._trello, destination_board, new_list,
+                           destination_board.is_meta)
         # Add the wrapper to the destination board's container
         destination_board._lists[list_object.name] = list_object
 
+        # The copied cards inherit from the destination board
+        destination_board.card_changed()
+        for card in list_object.cards + list_object.closed_cards:
+            destination_board.card_changed(card)
+
+        return list_object
+
     def copy_contents(self, trello, destination_list):
         """ Copies the cards contained in this list into the given Trellonos
         list """
@@ -193,7 +269,9 @@ class List(object):
             return self.cards[self.__index - 1]
 
     # Markup functions
-    def fill_cards_markup(self, script_manager):
-        """ Fill in all markup expressions in cards contained by this list """
-        for card in self.cards:
-            card.fill_markup(self._trello, script_manager)
+    def fill_cards_markup(self, script_manager, dependencies=None,
+                          selection=ALL):
+        """ Fill in all markup expressions in cards contained by this list, or
+        in the selected card """
+        for card in selection.filter_cards(self.cards):
+            card.fill_markup(self._trello, script_manager, dependencies)
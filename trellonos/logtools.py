@@ -1,5 +1,12 @@
+import io
 import os
+import sys
+import time
+import hashlib
 import datetime
+from collections import deque
+
+import tracetools
 
 PRIORITY_LOW = 0
 PRIORITY_MEDIUM = 1
@@ -9,96 +16,344 @@ PRIORITY_HIGH = 2
 # This module manages the program's debug log with respect to nested
 # contexts. For example, a loop might be a context, and debug
 # information within this context all share a priority level.
+#
+# Messages are kept as structured records in a bounded buffer, and are only
+# formatted when a sink or the dump needs their text. Messages below the
+# minimum priority are discarded before anything is formatted.
 
 _minimum_priority = PRIORITY_MEDIUM
 _tab_width = 4
 
+# Most records kept for dumping before the oldest are dropped
+DEFAULT_BUFFER_SIZE = 100000
+
+# Trello rejects card descriptions longer than this
+MAX_DESCRIPTION_LENGTH = 16384
+# Longer logs are attached to a card as a gzipped file
+MAX_LOG_CARDS = 5
+CODE_FENCE = '```\n'
+
+# Digest of the last dumped log, so identical logs aren't dumped again
+LOG_DIGEST_PATH = os.path.expanduser('~/.trellonos/lastlog.digest')
+
+
+class Record(object):
+    """ One log message, with the state of the log when it was written """
+
+    __slots__ = ('timestamp', 'depth', 'priority', 'context', 'message',
+                 'args')
+
+    def __init__(self, depth, priority, context, message, args):
+        self.timestamp = time.time()
+        self.depth = depth
+        self.priority = priority
+        self.context = context
+        self.message = message
+        self.args = args
+
+    @property
+    def text(self):
+        """ The message, formatted on demand. Messages can be strings,
+        format strings with arguments, or functions returning strings """
+        message = self.message
+        if callable(message):
+            message = message()
+
+        if self.args:
+            return str(message) % self.args
+
+        return str(message)
+
+    def render(self, tab_width):
+        """ The message indented by its context depth """
+        return ' ' * (tab_width * self.depth) + self.text
+
+
+class StdoutSink(object):
+    """ Prints each message as it is written """
+
+    def write(self, record):
+        print(record.render(_tab_width))
+
+    def flush(self):
+        sys.stdout.flush()
+
+
+class FileSink(object):
+    """ Appends each message to a file, with its timestamp """
+
+    def __init__(self, path):
+        self._file = open(path, 'a')
+
+    def write(self, record):
+        timestamp = datetime.datetime.fromtimestamp(record.timestamp)
+        self._file.write(timestamp.strftime('%Y-%m-%d %H:%M:%S ') +
+                         record.render(_tab_width) + '\n')
+
+    def flush(self):
+        self._file.flush()
+
 
 _contexts = []
 _context_priorities = []
-_text = ''
+_context_path = ()
+_records = deque(maxlen=DEFAULT_BUFFER_SIZE)
+_dropped_records = 0
+_stdout_sink = StdoutSink()
+_sinks = [_stdout_sink]
 
 def init_from_environment_vars():
+    """ Configures the log from the environment variables which are set:
+    TRELLONOS_DEBUG_PRIORITY, TRELLONOS_TAB_WIDTH,
+    TRELLONOS_LOG_BUFFER_SIZE and TRELLONOS_LOG_FILE """
     global _minimum_priority
     global _tab_width
-    _minimum_priority = int(os.environ['TRELLONOS_DEBUG_PRIORITY'])
-    _tab_width = int(os.environ['TRELLONOS_TAB_WIDTH'])
+    global _records
+    _minimum_priority = int(os.environ.get('TRELLONOS_DEBUG_PRIORITY',
+                                           _minimum_priority))
+    _tab_width = int(os.environ.get('TRELLONOS_TAB_WIDTH', _tab_width))
+
+    buffer_size = os.environ.get('TRELLONOS_LOG_BUFFER_SIZE')
+    if buffer_size:
+        _records = deque(_records, maxlen=int(buffer_size))
+
+    log_file = os.environ.get('TRELLONOS_LOG_FILE')
+    if log_file:
+        add_sink(FileSink(log_file))
+
+def add_sink(sink):
+    """ Sends all future messages to the given sink, an object with write(record)
+    and flush() methods """
+    _sinks.append(sink)
 
-def _context_depth():
+def remove_sink(sink):
+    _sinks.remove(sink)
+
+def flush():
+    for sink in _sinks:
+        sink.flush()
+
+def set_echo(echo):
+    """ Turns printing of messages on or off. They are still saved for
+    dumping either way """
+    if echo and _stdout_sink not in _sinks:
+        _sinks.insert(0, _stdout_sink)
+    elif not echo and _stdout_sink in _sinks:
+        _sinks.remove(_stdout_sink)
+
+def take_records():
+    """ Returns all records saved since the last dump, and clears them """
+    global _dropped_records
+    records = list(_records)
+    _records.clear()
+    _dropped_records = 0
+    return records
+
+def take_text():
+    """ Returns all output saved since the last dump, and clears it """
+    return _render(take_records())
+
+def _render(records):
+    return ''.join([record.render(_tab_width) + '\n' for record in records])
+
+def context_depth():
+    """ How many contexts are open """
     return len(_contexts)
 
 def _current_priority():
-    if _context_depth() == 0:
+    if context_depth() == 0:
         return PRIORITY_MEDIUM
 
-    return _context_priorities[_context_depth() - 1]
+    return _context_priorities[-1]
 
-def _print(line):
-    global _text
-    # Print the line
-    _text += line + '\n'
-    # Also save it in the log's text for dumping
-    print(line)
+def _write(text, args=()):
+    global _dropped_records
 
-def _message(text):
-    # Add a tab for each level of depth
-    message = ''
-    for i in range(_context_depth()):
-        for i in range(_tab_width):
-            message += ' '
+    record = Record(len(_contexts), _current_priority(), _context_path,
+                    text, args)
 
-    # Then print the message
-    message += str(text)
+    # Count what falls out of the bounded buffer
+    if len(_records) == _records.maxlen:
+        _dropped_records += 1
+    _records.append(record)
 
-    _print(message)
+    for sink in _sinks:
+        sink.write(record)
 
-def open_context(context_name, priority=None):
-    if not priority:
-        priority = _current_priority
+def open_context(context_name, priority=None, **attributes):
+    """ Opens a nested context, which is timed as a span with the given
+    attributes """
+    global _context_path
+
+    if priority is None:
+        priority = _current_priority()
 
     # Announce the opening if priority warrants
-    message('Opening debug context: ' + context_name)
+    message('Opening debug context: %s', context_name)
 
     # Add the priority to the end of the list
     # But if the current context is lower priority, keep the current
-    _context_priorities.append(min(_current_priority, priority))
+    _context_priorities.append(min(_current_priority(), priority))
 
     # Add the name to the end of the list
     # It is important that this call comes second!
     _contexts.append(context_name)
+    _context_path = _context_path + (context_name,)
+
+    tracetools.start_span(context_name, **attributes)
 
 def close_context():
+    global _context_path
+
     # Retrieve the name of the current context, removing it from the list
     context_name = _contexts.pop()
+    _context_path = _context_path[:-1]
 
     # Remove the current priority from the end of the list
     _context_priorities.pop()
 
-    # Annouce the removal of the context
-    _message('Closing debug context: ' + context_name)
+    tracetools.end_span()
+
+    # Annouce the removal of the context if priority warrants
+    message('Closing debug context: %s', context_name)
+
+def close_contexts(depth=0):
+    """ Closes the contexts open deeper than the given depth, such as those
+    a failure left open """
+    while context_depth() > depth:
+        close_context()
+
+def message(text, *args):
+    """ Logs a message if the current context's priority warrants. If
+    arguments are given, the message is a format string only formatted when
+    its text is needed """
+    if _current_priority() >= _minimum_priority:
+        _write(text, args)
+
+def _month_list(board, time):
+    """ Finds or creates the list for the current month in the given
+    board """
+    list_name = time.strftime('%B %Y')
+
+    month_list = board.lists.get(list_name)
+    if not month_list:
+        month_list = board.create_list(list_name)
+
+    return month_list
+
+def _split_lines(text, size):
+    """ Splits text into chunks of at most the given size, breaking between
+    lines where possible """
+    chunks = []
+    chunk = []
+    chunk_length = 0
+
+    for line in text.splitlines(True):
+        # Break up lines too long for any chunk
+        while len(line) > size:
+            if chunk:
+                chunks.append(''.join(chunk))
+                chunk = []
+                chunk_length = 0
+            chunks.append(line[:size])
+            line = line[size:]
+
+        if chunk_length + len(line) > size:
+            chunks.append(''.join(chunk))
+            chunk = []
+            chunk_length = 0
+
+        chunk.append(line)
+        chunk_length += len(line)
+
+    if chunk:
+        chunks.append(''.join(chunk))
+
+    return chunks
+
+def _write_cards(trello, month_list, card_name, text):
+    """ Writes text into the descriptions of as many numbered cards as it
+    takes """
+    chunk_size = MAX_DESCRIPTION_LENGTH - len(CODE_FENCE) * 2
+    chunks = _split_lines(text, chunk_size)
+
+    for index, chunk in enumerate(chunks):
+        name = card_name
+        if len(chunks) > 1:
+            name += ' (%d/%d)' % (index + 1, len(chunks))
 
-def message(text):
-    if _current_priority >= _minimum_priority:
-        _message(text)
+        month_list.create_card(trello, name, CODE_FENCE + chunk + CODE_FENCE)
 
-# Dump all previous output into a card in the given board
-def dump(trello, board):
-    global _text
+def _attach_text(trello, month_list, card_name, text):
+    """ Writes the start of the text into a card, and attaches all of it as
+    a gzipped file """
+    import gzip
 
+    data = io.BytesIO()
+    with gzip.GzipFile(fileobj=data, mode='wb') as f:
+        f.write(text.encode('utf-8'))
+
+    preview = _split_lines(text, MAX_DESCRIPTION_LENGTH // 2)[0]
+    description = (CODE_FENCE + preview + CODE_FENCE +
+                   'Full log (%d lines) attached.' % text.count('\n'))
+
+    output_card = month_list.create_card(trello, card_name, description)
+    trello.add_card_attachment(output_card.card_data, card_name + '.log.gz',
+                               data.getvalue(), 'application/gzip')
+
+def _digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def _last_digest(digest_path):
+    """ The digest of the log text dumped last time, or None """
+    try:
+        with open(digest_path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+def _save_digest(digest, digest_path):
+    directory = os.path.dirname(digest_path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    with open(digest_path, 'w') as f:
+        f.write(digest)
+
+def _write_card(trello, board, text):
     # Get the date and time
     time = datetime.datetime.now()
-    # Place the new output card in a list for the current month
-    list_name = time.strftime('%B %Y')
-    # Create the list if it doesn't exist yet
-    if list_name not in board.lists.keys():
-        board.create_list(list_name)
-    # Get the list
-    month_list = board.lists[list_name]
-    # Create a card for this session
+    # Place the new output cards in a list for the current month
+    month_list = _month_list(board, time)
+    # Name the cards for this session
     card_name = time.strftime('%c')
-    output_card = month_list.create_card(trello, card_name)
-    # Dump all output into the output card
-    output = '```\n' + _text + '```\n'
-    output_card.set_description(trello, output)
-    # Clear text stored in the log
-    _text = ''
+
+    # Logs too long for a handful of cards are attached instead
+    if len(text) > MAX_DESCRIPTION_LENGTH * MAX_LOG_CARDS:
+        _attach_text(trello, month_list, card_name, text)
+    else:
+        _write_cards(trello, month_list, card_name, text)
+
+# Dump all previous output into cards in the given board, unless it is the
+# same as the last dump
+def dump(trello, board, digest_path=LOG_DIGEST_PATH):
+    flush()
+
+    dropped_records = _dropped_records
+    records = take_records()
+
+    text = _render(records)
+    digest = _digest(text)
+
+    if _last_digest(digest_path) == digest:
+        return
+
+    if dropped_records:
+        text = _render([Record(0, PRIORITY_HIGH, (),
+                               '(%d earlier lines dropped)',
+                               (dropped_records,))]) + text
+
+    _write_card(trello, board, text)
+
+    # Only a dump which was uploaded holds back the next identical one
+    _save_digest(digest, digest_path)
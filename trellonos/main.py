@@ -1,11 +1,6 @@
-from trellonos import Trellonos
+import sys
 
-if __name__ == "__main__":
-    # Construct a Trellonos object from environment variables
-    trellonos = Trellonos.from_environment_vars()
-
-    # Run Trellonos processing
-    trellonos.process()
+from cli import main
 
-    # Dump all console output to a Trello card
-    trellonos.dump_log()
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+# Helpers for keeping the Trellonos object model small in memory. A
+# long-running process holds every board warm, so equal strings repeated
+# across thousands of objects are shared, and raw Trello payloads are
+# trimmed down to the fields Trellonos actually reads.
+
+_strings = {}
+
+
+def intern_string(string):
+    """ Returns a shared copy of the given string so equal strings (ids,
+    member ids, type names) are only stored once. Works for unicode as
+    well, unlike the builtin intern(). None is returned unchanged """
+    try:
+        return _strings.setdefault(string, string)
+    except TypeError:
+        # Unhashable values (e.g. YAML lists) can't be shared
+        return string
+
+
+def trim_data(data, fields, interned_fields=()):
+    """ Returns a copy of a raw Trello payload containing only the given
+    fields. Values of interned_fields are interned, including the items
+    of list values """
+    trimmed = {}
+
+    for field in fields:
+        if field not in data:
+            continue
+
+        value = data[field]
+
+        if field in interned_fields:
+            if isinstance(value, list):
+                value = [intern_string(item) for item in value]
+            else:
+                value = intern_string(value)
+
+        trimmed[field] = value
+
+    return trimmed
+
+
+def slot_names(cls):
+    """ Yields the attribute names of the slots declared by a class, with
+    private names mangled the way Python stores them """
+    for slot in cls.__dict__.get('__slots__', ()):
+        if slot.startswith('__') and not slot.endswith('__'):
+            slot = '_' + cls.__name__.lstrip('_') + slot
+
+        yield slot
+
+
+class Slotted(object):
+    """ Base class of the slotted Trello wrappers. Pickles every slot except
+    the live Trello connection, which is restored with
+    Board.update_trello_instance after loading """
+
+    __slots__ = ()
+
+    def __getstate__(self):
+        state = {}
+
+        for cls in type(self).__mro__:
+            for slot in slot_names(cls):
+                if slot != '_trello' and hasattr(self, slot):
+                    state[slot] = getattr(self, slot)
+
+        return state
+
+    def __setstate__(self, state):
+        if hasattr(type(self), '_trello'):
+            self._trello = None
+
+        for slot in state:
+            setattr(self, slot, state[slot])
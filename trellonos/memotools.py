@@ -0,0 +1,139 @@
+import os
+import json
+import pickle
+import hashlib
+from collections import OrderedDict
+from os.path import expanduser
+
+from dependencytools import card_content
+from sandboxtools import CREATING_METHODS
+
+RESULT_CACHE_PATH = expanduser('~/.trellonos/results.pickle')
+
+# Most results kept before the least recently used are evicted
+DEFAULT_MAX_ENTRIES = 10000
+
+# Results with bigger pickled outputs aren't worth caching
+MAX_OUTPUT_SIZE = 64 * 1024
+
+
+def target_content(target):
+    """ JSON-like summary of a processor target: a board, list or card """
+    if hasattr(target, 'card_data'):
+        return card_content(target)
+
+    if hasattr(target, 'cards'):
+        return [target.id, target.name,
+                [card_content(card) for card in target.cards]]
+
+    return [target.id, target.name,
+            [target_content(target.lists[name]) for name in
+             sorted(target.lists.keys())]]
+
+
+def result_key(processor, revision, input_name, target):
+    """ Hash identifying a processor run: the processor's YAML (including its
+    gist id and file), the gist revision and the processor's input """
+    content = [processor.yaml_data, revision, input_name, target.id,
+               target_content(target)]
+
+    text = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def replayable(mutations):
+    """ The mutations of a cached result which are applied when it is
+    replayed. The objects the cached run created exist already, so they
+    aren't created again, and mutations of them are left out """
+    created = set()
+    mutations_to_apply = []
+
+    for mutation in mutations:
+        method_name, args, kwargs, result = mutation
+
+        if method_name in CREATING_METHODS:
+            if isinstance(result, dict):
+                created.add(result['id'])
+            continue
+
+        if any([isinstance(arg, dict) and arg.get('id') in created
+                for arg in args]):
+            continue
+
+        mutations_to_apply.append(mutation)
+
+    return mutations_to_apply
+
+
+class ResultCache(object):
+    """ Size-bounded, least recently used cache of processor results (output
+    and recorded mutations), persisted between runs """
+
+    def __init__(self, path=RESULT_CACHE_PATH,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        self._path = path
+        self._max_entries = max_entries
+        self._entries = None
+
+    @classmethod
+    def from_environment_vars(cls, path=RESULT_CACHE_PATH):
+        max_entries = int(os.environ.get('TRELLONOS_RESULT_CACHE_SIZE',
+                                         DEFAULT_MAX_ENTRIES))
+        return cls(path, max_entries)
+
+    def _load(self):
+        if self._entries is not None:
+            return
+
+        try:
+            with open(self._path, 'rb') as f:
+                self._entries = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            self._entries = OrderedDict()
+
+    def get(self, key):
+        """ Returns the cached (output, mutations) for a key, or None """
+        self._load()
+
+        if key not in self._entries:
+            return None
+
+        # Mark as most recently used
+        result = self._entries.pop(key)
+        self._entries[key] = result
+
+        return result
+
+    def put(self, key, output, mutations):
+        """ Caches a result, unless its output can't be stored """
+        self._load()
+
+        try:
+            pickled_output = pickle.dumps(output, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return
+
+        if len(pickled_output) > MAX_OUTPUT_SIZE:
+            return
+
+        self._entries.pop(key, None)
+        self._entries[key] = (output, mutations)
+
+        # Evict the least recently used results
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def save(self):
+        """ Writes the cache to disk, if it was used """
+        if self._entries is None:
+            return
+
+        directory = os.path.dirname(self._path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        temp_path = self._path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            pickle.dump(self._entries, f, pickle.HIGHEST_PROTOCOL)
+
+        os.rename(temp_path, self._path)
@@ -0,0 +1,272 @@
+import os
+import threading
+
+# This module keeps Prometheus-style metrics of a Trellonos run: counters,
+# gauges and histograms with labels. They can be written in the text
+# exposition format for node_exporter's textfile collector after a run
+# (TRELLONOS_METRICS_TEXTFILE), and served at /metrics while Trellonos runs
+# (TRELLONOS_METRICS_PORT).
+#
+# Modules define their metrics once, at import:
+#
+#   REQUESTS = metricstools.counter('trellonos_trello_requests_total',
+#                                   'Trello API requests',
+#                                   ('method', 'endpoint', 'status'))
+#   REQUESTS.inc(method='GET', endpoint='lists/:id', status='200')
+
+# Seconds, suited to API requests and processor runs
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+_lock = threading.Lock()
+_metrics = {}
+_metric_names = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n') \
+        .replace('"', '\\"')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+
+    return '{' + ','.join(['%s="%s"' % (name, _escape(value))
+                           for name, value in zip(names, values)]) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value))
+
+
+class Metric(object):
+    """ A named metric with one value per combination of label values """
+
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('Metric ' + self.name + ' takes labels ' +
+                             ', '.join(self.labelnames))
+
+        return tuple([str(labels[name]) for name in self.labelnames])
+
+    def samples(self):
+        """ (suffix, label names, label values, value) of every sample """
+        for key in sorted(self._values):
+            yield '', self.labelnames, key, self._values[key]
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s %s' % (self.name, self.kind)]
+
+        for suffix, names, values, value in self.samples():
+            lines.append(self.name + suffix + _format_labels(names, values) +
+                         ' ' + _format_value(value))
+
+        return lines
+
+    def merge(self, values):
+        """ Adds values taken from the same metric in another process """
+        for key in values:
+            self._values[key] = self._values.get(key, 0) + values[key]
+
+
+class Counter(Metric):
+    """ A value which only goes up """
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """ A value which is set """
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+
+        with _lock:
+            self._values[key] = value
+
+    def merge(self, values):
+        self._values.update(values)
+
+
+class Histogram(Metric):
+    """ Counts of observed values in cumulative buckets, with their sum """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, help, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+
+        with _lock:
+            # Bucket counts, then the sum
+            counts = self._values.get(key)
+            if counts is None:
+                counts = [0] * len(self.buckets) + [0]
+                self._values[key] = counts
+
+            for i in range(len(self.buckets)):
+                if value <= self.buckets[i]:
+                    counts[i] += 1
+            counts[-1] += value
+
+    def samples(self):
+        names = self.labelnames + ('le',)
+
+        for key in sorted(self._values):
+            counts = self._values[key]
+
+            for bound, count in zip(self.buckets, counts):
+                yield '_bucket', names, key + (_format_value(bound),), count
+
+            yield '_sum', self.labelnames, key, counts[-1]
+            yield '_count', self.labelnames, key, counts[-2]
+
+    def merge(self, values):
+        for key in values:
+            counts = self._values.get(key)
+            if counts is None:
+                self._values[key] = list(values[key])
+            else:
+                for i in range(len(counts)):
+                    counts[i] += values[key][i]
+
+
+def _register(cls, name, *args):
+    with _lock:
+        if name not in _metrics:
+            _metrics[name] = cls(name, *args)
+            _metric_names.append(name)
+
+        return _metrics[name]
+
+
+def counter(name, help, labelnames=()):
+    """ The counter of the given name, created if needed """
+    return _register(Counter, name, help, labelnames)
+
+
+def gauge(name, help, labelnames=()):
+    """ The gauge of the given name, created if needed """
+    return _register(Gauge, name, help, labelnames)
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """ The histogram of the given name, created if needed """
+    return _register(Histogram, name, help, labelnames, buckets)
+
+
+def render():
+    """ All metrics in the Prometheus text exposition format """
+    lines = []
+
+    with _lock:
+        for name in _metric_names:
+            lines.extend(_metrics[name].render())
+
+    return '\n'.join(lines) + '\n'
+
+
+def take_values():
+    """ Returns the values of all metrics, and clears them. Used to send
+    the metrics of a worker process to its parent """
+    values = {}
+
+    with _lock:
+        for name in _metric_names:
+            if _metrics[name]._values:
+                values[name] = _metrics[name]._values
+                _metrics[name]._values = {}
+
+    return values
+
+
+def merge_values(values):
+    """ Adds values taken from another process """
+    with _lock:
+        for name in values:
+            if name in _metrics:
+                _metrics[name].merge(values[name])
+
+
+def write_textfile(path):
+    """ Writes all metrics to a file for the textfile collector, which must
+    never see a partial file """
+    temp_path = path + '.tmp' + str(os.getpid())
+
+    with open(temp_path, 'w') as f:
+        f.write(render())
+
+    os.rename(temp_path, path)
+
+
+def export_from_environment_vars():
+    """ Writes all metrics if TRELLONOS_METRICS_TEXTFILE is set """
+    path = os.environ.get('TRELLONOS_METRICS_TEXTFILE')
+    if path:
+        write_textfile(os.path.expanduser(path))
+
+
+def start_server(port, address=''):
+    """ Serves all metrics at /metrics from a background thread. Returns
+    the server """
+    try:
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    except ImportError:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+
+            body = render().encode('utf-8')
+
+            self.send_response(200)
+            self.send_header('Content-Type',
+                             'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes don't belong in the Trellonos log
+            pass
+
+    server = HTTPServer((address, port), MetricsHandler)
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server
+
+
+def serve_from_environment_vars():
+    """ Starts the metrics server if TRELLONOS_METRICS_PORT is set """
+    port = os.environ.get('TRELLONOS_METRICS_PORT')
+    if port:
+        return start_server(int(port))
@@ -1,5 +1,48 @@
 import logtools as log
+import dependencytools
+import metricstools
 import re
+import sys
+import time
+import hashlib
+import traceback
+
+
+# Markup expressions are contained in double braces {{ expression }}. The
+# pattern is lazy so two expressions on one line stay separate.
+MARKUP_OPEN = '{{'
+MARKUP_REGEX = re.compile(r'\{\{(.+?)\}\}')
+
+# Markup expressions are attributes of the Trellonos object
+MARKUP_PREFIX = "input['trellonos']."
+
+
+PROCESSOR_RUNS = metricstools.counter(
+    'trellonos_processor_executions_total',
+    'Script executions by processor name and result (ok or error)',
+    ('processor', 'result'))
+PROCESSOR_SECONDS = metricstools.histogram(
+    'trellonos_processor_duration_seconds',
+    'Time taken by script executions, by processor name', ('processor',))
+MARKUP_EVALUATIONS = metricstools.counter(
+    'trellonos_markup_evaluations_total',
+    'Markup expressions filled in, by result: evaluated, reused or error',
+    ('result',))
+
+
+def _source_hash(code):
+    """ Hash identifying a script's source code """
+    if not isinstance(code, bytes):
+        code = code.encode('utf-8')
+
+    return hashlib.sha1(code).hexdigest()
+
+
+def _script_filename(source_hash):
+    """ Name given to compiled scripts, so tracebacks can be traced back to
+    the right script """
+    return '<script ' + source_hash[:12] + '>'
+
 
 class ScriptManager(object):
     """ Wrapper for the execution of embedded Python code in a hopefully
@@ -13,97 +56,157 @@ class ScriptManager(object):
             'output': {}
         }
 
-    def execute(self, code, input={}, continue_on_error=True):
-        self.__interface['input'] = input  # provide the given input
-        self.__interface['output'] = {}  # clear previous output
+        # Compiled code objects, keyed by the hash of their source
+        self._compiled = {}
 
-        error = None
+        # Compiled markup expressions, and their values during this run
+        self._expressions = {}
+        self._markup_values = {}
 
-        # make a place to store the script locals
-        script_locals = {}
+    def compile(self, code):
+        """ Compile a script into a code object. Each distinct source is only
+        compiled once per run """
+        source_hash = _source_hash(code)
 
-        # Split the code up by lines
-        script_lines = code.splitlines()
+        if source_hash not in self._compiled:
+            self._compiled[source_hash] = compile(
+                code, _script_filename(source_hash), 'exec')
 
-        # Track the current line for error reporting
-        current_line = 0
+        return self._compiled[source_hash]
 
-        while current_line < len(script_lines):
-            script_block = script_lines[current_line]
+    def add_compiled(self, code, code_object):
+        """ Register a code object compiled from the given source earlier,
+        e.g. loaded from a cache, so it won't be compiled again """
+        self._compiled[_source_hash(code)] = code_object
 
-            # if the line starts a block, process the entire block at once.
-            # Do it this way to avoid a syntax error:
-            # This allows us to still execute line by line. Blocks just have
-            # less precision in the error report.
-            if len(script_block) > 0 and script_block.strip()[-1:] == ':':
-                i = 1
-                while True:
-                    if current_line + i >= len(script_lines):
-                        break
+    def _log_error(self, error, code):
+        """ Log an error raised by the given script, with the number and
+        source of the line which raised it. Must be called while handling
+        the error """
+        filename = _script_filename(_source_hash(code))
 
-                    next_line = script_lines[current_line + i]
+        line_number = None
+        if isinstance(error, SyntaxError) and error.filename == filename:
+            line_number = error.lineno
+        else:
+            # The innermost traceback frame from this script is the failing
+            # line
+            for frame in traceback.extract_tb(sys.exc_info()[2]):
+                if frame[0] == filename:
+                    line_number = frame[1]
 
-                    script_block += '\n' + script_lines[current_line + i]
-                    i += 1  # almost forgot!
+        if line_number is None:
+            log.message(type(error).__name__ + ': ' + str(error))
+            return
 
-                    # If the next line is tab-shifted left, end the block
-                    if not (next_line[0:4] == '    ' or next_line == ''):
-                        # Unless it is an elif: or an else: line
-                        if not (next_line[0:5] == 'else:' or
-                                next_line[0:5] == 'elif:'):
-                            break
+        log.message(type(error).__name__ + ' in line ' +
+                    str(line_number) + ': ' + str(error))
 
-                current_line += (i - 1)
+        script_lines = code.splitlines()
+        if line_number <= len(script_lines):
+            log.message(script_lines[line_number - 1])
 
-            try:
-                # try to run the line
-                exec(script_block, self.__interface, script_locals)
-            except Exception as e:
-                # Log the error
-                log.message(type(e).__name__ + ' in line ' +
-                            str(current_line + 1) + ': ' + str(e))
+    def execute(self, code, input={}, continue_on_error=True):
+        self.__interface['input'] = input  # provide the given input
+        self.__interface['output'] = {}  # clear previous output
+
+        error = None
+
+        # make a place to store the script locals
+        script_locals = {}
+
+        # Processors pass their card as input
+        processor_name = 'script'
+        if 'processor' in input:
+            processor_name = input['processor'].name
 
-                for script_line in script_block.splitlines():
-                    log.message(script_line)
+        start = time.time()
 
-                error = e
-                break
+        try:
+            # run the whole script at once
+            exec(self.compile(code), self.__interface, script_locals)
+        except Exception as e:
+            self._log_error(e, code)
+            error = e
 
-            # increment the line number
-            current_line += 1
+        PROCESSOR_SECONDS.observe(time.time() - start,
+                                  processor=processor_name)
+        PROCESSOR_RUNS.inc(processor=processor_name,
+                           result='error' if error else 'ok')
 
         if error and not continue_on_error:
             raise error
 
         return self.__interface['output']
 
+    def _compile_expression(self, expression):
+        """ Compile a single python expression. Each distinct expression is
+        only compiled once per run """
+        if expression not in self._expressions:
+            self._expressions[expression] = compile(
+                expression, '<expression>', 'eval')
+
+        return self._expressions[expression]
+
     def evaluate_expression(self, expression):
         """ Evaluate a single python expression and return the result """
-        log.open_context('Evaluating expression ' + expression)
-
-        # We need to store the result somewhere so we can return it
-        prefix = "output['result'] = "
-        # Execute the expression with the given Trellonos object as the only
+        # Evaluate the expression with the given Trellonos object as the only
         # input
-        result = self.execute(
-            prefix + expression, { 'trellonos': self._trellonos })
-
-        log.close_context()
-
-        return result['result']
+        return eval(self._compile_expression(expression),
+                    {'input': {'trellonos': self._trellonos}})
+
+    def clear_markup_values(self):
+        """ Forget the memoized values of markup expressions, which must be
+        done whenever the data they read may have changed """
+        self._markup_values = {}
+
+    def has_markup(self, text):
+        """ Whether the given string contains any markup expressions """
+        return MARKUP_OPEN in text
+
+    def _markup_value(self, expression):
+        """ Return the value of a markup expression, evaluating identical
+        expressions only once. The reads of the first evaluation are
+        reported again whenever the value is reused """
+        if expression in self._markup_values:
+            value, keys = self._markup_values[expression]
+            dependencytools.record_all(keys)
+            MARKUP_EVALUATIONS.inc(result='reused')
+            return value
+
+        dependencytools.start_recording()
+        try:
+            value = self.evaluate_expression(MARKUP_PREFIX + expression)
+        finally:
+            # Failed expressions depend on what they read, too
+            keys = dependencytools.stop_recording()
+            dependencytools.record_all(keys)
+
+        self._markup_values[expression] = (value, keys)
+        MARKUP_EVALUATIONS.inc(result='evaluated')
+
+        return value
 
     def evaluate_markup(self, text):
         """ Return the given string with all markup expressions evaluated
-        and filled in """
+        and filled in. Expressions which can't be evaluated are left in
+        place """
 
-        # Markup expressions are contained in double braces {{ expression }}
-        markup_regex = re.compile('\{\{.+\}\}')
+        # Most text contains no markup at all
+        if not self.has_markup(text):
+            return text
 
-        for match in re.findall(markup_regex, text):
-            print(match)
-            text = text.replace(
-                match,
-                self.evaluate_expression(
-                        "input['trellonos']." + match[2:-2].strip()))
+        def fill_expression(match):
+            expression = match.group(1).strip()
 
-        return text
+            try:
+                return '%s' % (self._markup_value(expression),)
+            except Exception as e:
+                # The card's markup must be evaluated again next run
+                dependencytools.record_failure()
+                MARKUP_EVALUATIONS.inc(result='error')
+                log.message(type(e).__name__ + ' in markup expression ' +
+                            expression + ': ' + str(e))
+                return match.group(0)
+
+        return MARKUP_REGEX.sub(fill_expression, text)
@@ -0,0 +1,321 @@
+from bisect import bisect_left, bisect_right
+
+# This module answers queries for the cards of a board, so processors and
+# markup don't need to loop over every list and card themselves:
+#
+#   board.query(type='Task', yaml={'priority': 'high'},
+#               due_before=datetools.now())
+#
+# Queries are answered from secondary indexes of the board's cards by type
+# name, YAML key and value, member id and due date. The indexes are built
+# when first queried. When a card changes only its own entries are updated;
+# they are built again after changes to several cards or lists at once.
+
+
+class _Any(object):
+    """ YAML query value matching any value of a key which is present """
+
+    def __repr__(self):
+        return 'ANY'
+
+
+ANY = _Any()
+
+
+def _is_hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+
+    return True
+
+
+class CardIndex(object):
+    """ Secondary indexes of the cards, open and closed, of a board's
+    regular lists """
+
+    def __init__(self, lists):
+        self._lists = sorted(lists, key=lambda l: l.position)
+
+        # The dependency keys of the board's lists and cards, reported by
+        # every query because any change could change its results
+        self.keys = set()
+
+        self.by_type = {}
+        self.by_yaml_key = {}
+        self.by_yaml_value = {}
+        self.by_member = {}
+
+        # Parallel lists of sorted due dates and their cards
+        self.due_dates = []
+        self.due_cards = []
+
+        # Card ids -> (list id and whether open, index entries, due date) of
+        # each card as it was indexed, to update its entries when it changes
+        self._entries = {}
+
+        # Sets of the cards of index entries, made when first intersected
+        self._sets = {}
+
+        # Every card in board order: lists by position, then cards in list
+        # order, and the positions of cards in it by id. Query results keep
+        # this order. Made again when cards are added, removed or moved
+        self._cards = []
+        self._order = {}
+
+        due_entries = []
+
+        for list_object in self._lists:
+            self.keys.add(('list', list_object.id))
+
+            for card in list_object.cards + list_object.closed_cards:
+                self._order[card.id] = len(self._cards)
+                self._cards.append(card)
+
+                due_date = self._add_entries(card)
+                if due_date:
+                    due_entries.append((due_date, card))
+
+        # Sort by date only, because cards themselves aren't comparable
+        due_entries.sort(key=lambda entry: entry[0])
+
+        self.due_dates = [entry[0] for entry in due_entries]
+        self.due_cards = [entry[1] for entry in due_entries]
+
+    @property
+    def cards(self):
+        """ Every card in board order """
+        if self._cards is None:
+            self._cards = []
+            for list_object in self._lists:
+                self._cards.extend(list_object.cards +
+                                   list_object.closed_cards)
+
+            self._order = dict((card.id, position)
+                               for position, card in enumerate(self._cards))
+
+        return self._cards
+
+    @property
+    def order(self):
+        """ Positions of cards in board order, by id """
+        if self._cards is None:
+            self.cards
+
+        return self._order
+
+    def _add_entry(self, index_name, key, card, entries):
+        getattr(self, index_name).setdefault(key, []).append(card)
+        self._sets.pop((index_name, key), None)
+        entries.append((index_name, key))
+
+    def _add_entries(self, card):
+        """ Adds a card to the indexes by type, YAML and member. Returns its
+        due date, which the caller adds to the due date index """
+        entries = []
+
+        self._add_entry('by_type', card.type_name, card, entries)
+
+        yaml_data = card.yaml_data
+        for key in yaml_data:
+            self._add_entry('by_yaml_key', key, card, entries)
+
+            # Unhashable values (lists, dictionaries) can only be found by
+            # scanning the cards which have the key
+            value = yaml_data[key]
+            if _is_hashable(value):
+                self._add_entry('by_yaml_value', (key, value), card, entries)
+
+        for member_id in card.card_data['idMembers']:
+            self._add_entry('by_member', member_id, card, entries)
+
+        due_date = card.due_date
+
+        self.keys.add(('card', card.id))
+        self._entries[card.id] = ((card.parent_list.id, card.open), entries,
+                                  due_date)
+
+        return due_date
+
+    def _remove_entries(self, card):
+        position, entries, due_date = self._entries.pop(card.id)
+
+        for index_name, key in entries:
+            index = getattr(self, index_name)
+            cards = index[key]
+
+            cards.remove(card)
+            if not cards:
+                del index[key]
+
+            self._sets.pop((index_name, key), None)
+
+        if due_date:
+            i = bisect_left(self.due_dates, due_date)
+            while self.due_cards[i] is not card:
+                i += 1
+
+            del self.due_dates[i]
+            del self.due_cards[i]
+
+        self.keys.discard(('card', card.id))
+
+        return position
+
+    def update(self, card, present=True):
+        """ Brings the entries of one card up to date after it changed.
+        present is whether it is still one of the board's cards """
+        position = None
+        if card.id in self._entries:
+            position = self._remove_entries(card)
+
+        if not present:
+            if position is not None:
+                self._cards = None
+            return
+
+        due_date = self._add_entries(card)
+        if due_date:
+            i = bisect_right(self.due_dates, due_date)
+            self.due_dates.insert(i, due_date)
+            self.due_cards.insert(i, card)
+
+        # New and moved cards change the board order
+        if position != self._entries[card.id][0]:
+            self._cards = None
+
+    def due_between(self, start=None, end=None):
+        """ Cards due on or after start and before end, ordered by due
+        date. Either bound can be None """
+        first = 0
+        last = len(self.due_dates)
+
+        if start is not None:
+            first = bisect_left(self.due_dates, start)
+
+        if end is not None:
+            last = bisect_left(self.due_dates, end)
+
+        return self.due_cards[first:last]
+
+    def _entry(self, index_name, key):
+        """ The cards of an index entry, and a test of whether a card is one
+        of them. Sets for the test are made when first needed """
+        cards = getattr(self, index_name).get(key, [])
+
+        members = self._sets.get((index_name, key))
+        if members is None:
+            members = set(cards)
+            self._sets[(index_name, key)] = members
+
+        return cards, members.__contains__
+
+    def _candidates(self, type, yaml, member, due_after, due_before):
+        """ (cards, membership test) pairs, one per indexed criterion given,
+        which every result must pass. Returns the YAML criteria the indexes
+        couldn't answer """
+        candidates = []
+        unindexed_yaml = {}
+
+        if type is not None:
+            candidates.append(self._entry('by_type', type))
+
+        for key in yaml:
+            value = yaml[key]
+
+            if value is ANY:
+                candidates.append(self._entry('by_yaml_key', key))
+            elif _is_hashable(value):
+                candidates.append(self._entry('by_yaml_value', (key, value)))
+            else:
+                candidates.append(self._entry('by_yaml_key', key))
+                unindexed_yaml[key] = value
+
+        if member is not None:
+            candidates.append(self._entry('by_member', member))
+
+        if due_after is not None or due_before is not None:
+            def is_due(card):
+                due_date = card.due_date
+                return (due_date is not None and
+                        (due_after is None or due_date >= due_after) and
+                        (due_before is None or due_date < due_before))
+
+            candidates.append((self.due_between(due_after, due_before),
+                               is_due))
+
+        return candidates, unindexed_yaml
+
+    def query(self, type=None, yaml=None, member=None, due_before=None,
+              due_after=None, open=True, list=None, checked=None,
+              where=None):
+        """ The cards matching every given criterion, in board order. See
+        Board.query """
+        if yaml is None:
+            yaml = {}
+
+        # Members can be given as Trello member dictionaries
+        if isinstance(member, dict):
+            member = member['id']
+
+        candidates, unindexed_yaml = self._candidates(type, yaml, member,
+                                                      due_after, due_before)
+
+        if candidates:
+            # Start from the fewest cards and test them against the others
+            candidates.sort(key=lambda candidate: len(candidate[0]))
+            cards = candidates[0][0]
+
+            for other_cards, contains in candidates[1:]:
+                cards = [card for card in cards if contains(card)]
+
+            # Due dates are the only entries not in board order
+            cards = sorted(cards, key=lambda card: self.order[card.id])
+        else:
+            cards = self.cards
+
+        # The remaining criteria are checked card by card
+        results = []
+
+        for card in cards:
+            if open is not None and card.open != open:
+                continue
+
+            if list is not None and card.parent_list.name != list:
+                continue
+
+            yaml_data = card.yaml_data
+            if any(yaml_data.get(key) != unindexed_yaml[key]
+                   for key in unindexed_yaml):
+                continue
+
+            if checked and not _matches_checked(card, checked):
+                continue
+
+            if where is not None and not where(card):
+                continue
+
+            results.append(card)
+
+        return results
+
+
+def _matches_checked(card, checked):
+    """ Whether the named check items of a card, in any of its checklists,
+    have the given states """
+    checklists = card.checklists
+
+    for item_name in checked:
+        state = None
+
+        for checklist_name in checklists:
+            check_items = checklists[checklist_name].check_items
+            if item_name in check_items:
+                state = check_items[item_name]
+                break
+
+        if state is None or state != checked[item_name]:
+            return False
+
+    return True
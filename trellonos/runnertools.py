@@ -0,0 +1,295 @@
+import os
+import time
+from os.path import expanduser
+
+import dependencytools
+import logtools as log
+import metricstools
+import tracetools
+
+# This module runs Trellonos for many accounts in one process, instead of a
+# cron job per account. Accounts are read from a YAML config file:
+#
+#   workers: 4
+#   accounts:
+#     - name: alice
+#       api_key: ...
+#       token: ...
+#       github_user: ...        (optional, for processors)
+#       github_password: ...
+#       boards: [Planner]       (optional, all boards by default)
+#       rate_limit: 100         (optional, requests per 10 seconds)
+#       state_directory: ...    (optional)
+#
+# Accounts are split into shards, one per worker process. A worker runs its
+# accounts one after another, sharing an HTTP session (and its connection
+# pool) and the gist cache between them, which are safe to share because
+# requests carry their own credentials, gists are cached by revision, and a
+# cached gist is only used without GitHub's answer by the users GitHub has
+# let read it. Everything else is kept apart: each account has its own
+# Trello rate limit budget, state directory (snapshot, markup dependencies,
+# result cache, journal), log dump and trace, and the module state of
+# logging, tracing and markup dependency recording is reset between
+# accounts. The workers' reports are collected into one report of the run.
+
+DEFAULT_CONFIG_PATH = expanduser('~/.trellonos/accounts.yaml')
+
+# State directories of accounts which don't name one
+DEFAULT_STATE_ROOT = expanduser('~/.trellonos/accounts')
+
+REQUIRED_FIELDS = ('name', 'api_key', 'token')
+
+ACCOUNT_RUNS = metricstools.counter(
+    'trellonos_account_runs_total',
+    'Runs of accounts, by account and result (ok or error)',
+    ('account', 'result'))
+ACCOUNT_SECONDS = metricstools.gauge(
+    'trellonos_account_run_duration_seconds',
+    'Time taken by the last run of each account', ('account',))
+ACCOUNT_REQUESTS = metricstools.gauge(
+    'trellonos_account_trello_requests',
+    'Trello API requests made by the last run of each account',
+    ('account',))
+
+
+def load_config(path=DEFAULT_CONFIG_PATH):
+    """ Reads and checks a config file of accounts """
+    import yaml
+
+    with open(expanduser(path)) as f:
+        config = yaml.safe_load(f) or {}
+
+    accounts = config.get('accounts')
+    if not accounts:
+        raise ValueError('No accounts in ' + path)
+
+    names = set()
+    for account in accounts:
+        for field in REQUIRED_FIELDS:
+            if not account.get(field):
+                raise ValueError('Account in ' + path + ' without ' + field)
+
+        if account['name'] in names:
+            raise ValueError('Account ' + account['name'] +
+                             ' appears twice in ' + path)
+        names.add(account['name'])
+
+    return config
+
+
+def shard(accounts, workers):
+    """ Splits accounts into at most the given number of shards of nearly
+    equal size """
+    shards = [accounts[i::workers] for i in range(workers)]
+    return [accounts_shard for accounts_shard in shards if accounts_shard]
+
+
+def state_directory(account):
+    """ Directory of the state an account keeps between runs """
+    directory = account.get('state_directory')
+    if directory:
+        directory = expanduser(directory)
+    else:
+        directory = os.path.join(DEFAULT_STATE_ROOT, account['name'])
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    return directory
+
+
+def run_account(account, selection_arguments, session=None, gist_cache=None,
+                dump=True, processor_pool=False, resume=False):
+    """ Runs Trellonos for one account, sharing the given HTTP session and
+    gist cache. Processors run in a pool of worker processes if
+    processor_pool is True and TRELLONOS_WORKERS is set, which can't be
+    done from a worker process itself. If resume is True, an interrupted
+    run of the account is resumed. Returns the account's report """
+    from trellonos import Trellonos
+    from sandboxtools import ProcessorPool
+    from trellotools import (Trello, HttpTransport, RateLimiter,
+                             TOKEN_RATE_LIMIT)
+    from githubtools import GithubManager
+    from selectiontools import RunSelection
+
+    name = account['name']
+    report = {'account': name, 'ok': False, 'error': None, 'boards': 0,
+              'seconds': 0, 'requests': 0}
+    start = time.time()
+
+    rate_limiter = RateLimiter(account.get('rate_limit', TOKEN_RATE_LIMIT))
+    trello = Trello(account['api_key'], account['token'],
+                    transport=HttpTransport(session=session),
+                    rate_limiter=rate_limiter)
+
+    pool = None
+    if processor_pool:
+        pool = ProcessorPool.from_environment_vars(trello)
+
+    github = None
+    if account.get('github_user'):
+        github = GithubManager(account['github_user'],
+                               account.get('github_password'), gist_cache)
+
+    boards = account.get('boards') or selection_arguments.get('boards')
+    selection = RunSelection(boards, selection_arguments.get('kinds'),
+                             selection_arguments.get('processors'))
+
+    depth = log.context_depth()
+    log.open_context('Account ' + name, account=name)
+
+    trellonos = None
+    try:
+        trellonos = Trellonos(trello, github=github, processor_pool=pool,
+                              selection=selection,
+                              state_directory=state_directory(account),
+                              resume=resume)
+        trellonos.process()
+
+        report['boards'] = len(trellonos.boards)
+        report['ok'] = True
+    except Exception as e:
+        report['error'] = type(e).__name__ + ': ' + str(e)
+        log.message('Run of account ' + name + ' failed: ' +
+                    report['error'])
+
+    # A failure can leave contexts open, which are closed with the account's
+    log.close_contexts(depth)
+
+    # The log of each account goes to its own output board
+    if dump and trellonos is not None:
+        try:
+            trellonos.dump_log()
+        except Exception as e:
+            log.message("Couldn't dump the log of account " + name + ': ' +
+                        str(e))
+
+    # Each account's spans go to a trace of its own, if tracing
+    tracetools.export_from_environment_vars(name)
+
+    # Whatever wasn't dumped or exported mustn't end up with the next
+    # account's
+    log.take_records()
+    tracetools.take_spans()
+    dependencytools.reset()
+
+    report['seconds'] = time.time() - start
+    report['requests'] = trello.request_count
+
+    return report
+
+
+def _run_shard(arguments):
+    """ Runs the accounts of a shard one after another. Returns their
+    reports and the metrics of the run """
+    (accounts, selection_arguments, gist_cache_directory, dump, resume,
+     in_worker) = arguments
+
+    import requests
+    from githubtools import GistCache
+
+    if in_worker:
+        # Metrics copied from the parent process belong to the parent
+        metricstools.take_values()
+
+    session = requests.Session()
+    gist_cache = GistCache(gist_cache_directory)
+
+    reports = [run_account(account, selection_arguments, session,
+                           gist_cache, dump, not in_worker, resume)
+               for account in accounts]
+
+    metric_values = None
+    if in_worker:
+        metric_values = metricstools.take_values()
+
+    return reports, metric_values
+
+
+def run(config, selection_arguments=None, workers=None, dump=True,
+        resume=False):
+    """ Runs Trellonos for every account of a config, in shards run by
+    worker processes. Returns the reports of the accounts, in config
+    order """
+    from githubtools import GIST_CACHE_DIR
+
+    if selection_arguments is None:
+        selection_arguments = {}
+
+    accounts = config['accounts']
+    if workers is None:
+        workers = config.get('workers', 1)
+
+    gist_cache_directory = expanduser(config.get('gist_cache',
+                                                 GIST_CACHE_DIR))
+
+    shards = shard(accounts, max(1, workers))
+
+    log.open_context('Running ' + str(len(accounts)) + ' accounts in ' +
+                     str(len(shards)) + ' shards.')
+
+    if len(shards) == 1:
+        # Processors of accounts run in-process can still use worker pools
+        results = [_run_shard((shards[0], selection_arguments,
+                               gist_cache_directory, dump, resume,
+                               False))]
+    else:
+        import multiprocessing
+
+        pool = multiprocessing.Pool(len(shards))
+        try:
+            results = pool.map(_run_shard,
+                               [(accounts_shard, selection_arguments,
+                                 gist_cache_directory, dump, resume, True)
+                                for accounts_shard in shards])
+        finally:
+            pool.close()
+            pool.join()
+
+    reports = {}
+    for shard_reports, metric_values in results:
+        if metric_values:
+            metricstools.merge_values(metric_values)
+
+        for report in shard_reports:
+            reports[report['account']] = report
+
+    reports = [reports[account['name']] for account in accounts]
+
+    for report in reports:
+        result = 'ok'
+        if not report['ok']:
+            result = 'error'
+
+        ACCOUNT_RUNS.inc(account=report['account'], result=result)
+        ACCOUNT_SECONDS.set(report['seconds'], account=report['account'])
+        ACCOUNT_REQUESTS.set(report['requests'], account=report['account'])
+
+    log.close_context()
+
+    return reports
+
+
+def format_report(reports):
+    """ Text table of the reports of a run, with totals """
+    lines = ['%-20s %-6s %8s %9s %6s' % ('Account', 'Result', 'Seconds',
+                                         'Requests', 'Boards')]
+
+    for report in reports:
+        result = 'ok'
+        if not report['ok']:
+            result = 'error'
+
+        lines.append('%-20s %-6s %8.1f %9d %6d' % (
+            report['account'][:20], result, report['seconds'],
+            report['requests'], report['boards']))
+
+    failed = [report for report in reports if not report['ok']]
+    lines.append('%d accounts, %d failed, %d requests' % (
+        len(reports), len(failed),
+        sum([report['requests'] for report in reports])))
+
+    for report in failed:
+        lines.append(report['account'] + ': ' + report['error'])
+
+    return '\n'.join(lines) + '\n'
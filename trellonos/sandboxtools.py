@@ -0,0 +1,636 @@
+import os
+import copy
+import time
+import pickle
+import signal
+import tempfile
+
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+try:
+    import resource
+except ImportError:
+    # Time and memory limits are only enforced where resource is available
+    resource = None
+
+import logtools as log
+import metricstools
+import tracetools
+
+# Trello wrapper methods which change data. Processors running in worker
+# processes have these recorded instead of carried out, and the recorded
+# mutations are applied by the parent process.
+from trellotools import MUTATING_METHODS
+
+# Wall clock seconds a processor may run in a worker process by default
+DEFAULT_TIMEOUT = 300
+
+# Seconds between checks on the tasks running in worker processes
+POLL_INTERVAL = 0.05
+
+# Trello wrapper methods which create objects
+CREATING_METHODS = ('create_list', 'copy_list', 'create_card', 'copy_card')
+
+# Objects created by recorded mutations get placeholder ids until the
+# mutations are applied
+PENDING_ID_PREFIX = 'pending-'
+
+
+class ProcessorTimeout(Exception):
+    pass
+
+
+def index_objects(boards):
+    """ Maps the ids of the given boards and every list and card they
+    contain, including meta lists, to the Trellonos objects """
+    objects = {}
+
+    for board in boards:
+        objects[board.id] = board
+
+        for list_object in board.all_lists():
+            objects[list_object.id] = list_object
+
+            for card in list_object.cards + list_object.closed_cards:
+                objects[card.id] = card
+
+    return objects
+
+
+def _recorded_method(method_name):
+    """ Makes a RecordingTrello method which records calls to the Trello
+    wrapper method of the same name """
+    def method(self, *args, **kwargs):
+        return self._record(method_name, args, kwargs)
+
+    method.__name__ = method_name
+    return method
+
+
+class RecordingTrello(object):
+    """ Stand-in for the Trello wrapper which records the mutations made
+    through it as (method name, args, kwargs, result) tuples. Reads go
+    straight to the wrapped Trello wrapper. If passthrough is true,
+    mutations are carried out as well. Otherwise they only return
+    placeholder data, and are applied later with a MutationApplier """
+
+    def __init__(self, trello, passthrough=False):
+        self._trello = trello
+        self._passthrough = passthrough
+        self._mutations = []
+        self._pending_count = 0
+
+    @property
+    def mutations(self):
+        return self._mutations
+
+    def take_mutations(self):
+        """ Returns the mutations recorded so far, and forgets them """
+        mutations = self._mutations
+        self._mutations = []
+
+        return mutations
+
+    @property
+    def member(self):
+        return self._trello.member
+
+    def __getattr__(self, name):
+        # Everything that isn't a mutation is delegated
+        return getattr(self._trello, name)
+
+    def get_cards(self, list, *args, **kwargs):
+        # Lists created by recorded mutations don't exist in Trello yet
+        if list['id'].startswith(PENDING_ID_PREFIX):
+            return []
+
+        return self._trello.get_cards(list, *args, **kwargs)
+
+    def _record(self, method_name, args, kwargs):
+        recorded_args = copy.deepcopy(args)
+        recorded_kwargs = copy.deepcopy(kwargs)
+
+        if self._passthrough:
+            result = getattr(self._trello, method_name)(*args, **kwargs)
+        else:
+            result = self._placeholder(method_name, args, kwargs)
+
+        self._mutations.append((method_name, recorded_args, recorded_kwargs,
+                                copy.deepcopy(result)))
+
+        return result
+
+    def _placeholder(self, method_name, args, kwargs):
+        """ Data standing in for the result of a mutation which hasn't been
+        carried out """
+        if method_name not in CREATING_METHODS:
+            return None
+
+        self._pending_count += 1
+        pending_id = PENDING_ID_PREFIX + str(self._pending_count)
+
+        override_params = kwargs.get('override_params', {})
+        if len(args) > 2 and method_name in ('copy_list', 'copy_card'):
+            override_params = args[2]
+
+        if method_name == 'create_list':
+            board_data, name = args[:2]
+            placeholder = {'name': name, 'closed': False, 'pos': None,
+                           'idBoard': board_data['id']}
+        elif method_name == 'copy_list':
+            list_data, board_data = args[:2]
+            placeholder = dict(list_data)
+            placeholder['idBoard'] = board_data['id']
+        elif method_name == 'create_card':
+            list_data, name = args[:2]
+            description = kwargs.get('description', '')
+            if len(args) > 2:
+                description = args[2]
+
+            placeholder = {'name': name, 'desc': description,
+                           'closed': False, 'due': None, 'idMembers': [],
+                           'idChecklists': [], 'idList': list_data['id'],
+                           'idBoard': list_data.get('idBoard')}
+        else:
+            card_data, list_data = args[:2]
+            placeholder = copy.deepcopy(card_data)
+            placeholder['idList'] = list_data['id']
+            placeholder['idChecklists'] = []
+
+        placeholder.update(override_params)
+        placeholder['id'] = pending_id
+
+        return placeholder
+
+
+# Install the recording methods
+for _method_name in MUTATING_METHODS:
+    setattr(RecordingTrello, _method_name, _recorded_method(_method_name))
+
+
+class MutationApplier(object):
+    """ Applies mutations recorded by a RecordingTrello to the Trellonos
+    object model and, through it, to Trello """
+
+    def __init__(self, trello, trellonos):
+        self._trello = trello
+        self._trellonos = trellonos
+        self._objects = None
+
+    def _resolve(self, data):
+        """ Finds the Trellonos object for raw Trello data, or None """
+        if not isinstance(data, dict) or 'id' not in data:
+            return None
+
+        if self._objects is None:
+            self._objects = index_objects(self._trellonos.boards.values())
+
+        return self._objects.get(data['id'])
+
+    def apply(self, mutations):
+        """ Applies the given mutations in order """
+        for method_name, args, kwargs, result in mutations:
+            created = self._apply(method_name, args, kwargs)
+
+            # Later mutations refer to created objects by their original
+            # (often placeholder) id
+            if created is not None and isinstance(result, dict):
+                self._objects[result['id']] = created
+                self._objects[created.id] = created
+
+    def _apply(self, method_name, args, kwargs):
+        """ Applies one mutation, returning the object it created if any """
+        trello = self._trello
+        target = self._resolve(args[0])
+        other = None
+        if len(args) > 1:
+            other = self._resolve(args[1])
+
+        override_params = kwargs.get('override_params', {})
+        if len(args) > 2 and method_name in ('copy_list', 'copy_card'):
+            override_params = args[2]
+
+        if target is None or (method_name in ('move_card', 'copy_card',
+                                              'copy_list', 'move_all_cards')
+                              and other is None):
+            # Objects Trellonos doesn't hold are only changed in Trello
+            getattr(trello, method_name)(*args, **kwargs)
+            return None
+
+        if method_name == 'update_card_name':
+            target.set_name(trello, args[1])
+        elif method_name == 'update_card_description':
+            target.set_description(trello, args[1])
+        elif method_name == 'update_card_due':
+            target.set_due_date(trello, args[1])
+        elif method_name == 'update_card_closed':
+            if args[1] and target.open:
+                target.archive(trello)
+            elif not args[1] and target.closed:
+                target.unarchive(trello)
+        elif method_name == 'add_card_member':
+            target.add_member(trello, args[1])
+        elif method_name == 'remove_card_member':
+            target.remove_member(trello, args[1])
+        elif method_name == 'subscribe_card':
+            target.subscribe(trello)
+        elif method_name == 'unsubscribe_card':
+            target.unsubscribe(trello)
+        elif method_name == 'move_card':
+            target.move(trello, other)
+        elif method_name == 'copy_card':
+            return target.copy(trello, other, override_params)
+        elif method_name == 'delete_card':
+            target.delete(trello)
+        elif method_name == 'create_card':
+            description = kwargs.get('description', '')
+            if len(args) > 2:
+                description = args[2]
+
+            return target.create_card(trello, args[1], description)
+        elif method_name == 'update_list_name':
+            target.set_name(trello, args[1])
+        elif method_name == 'update_list_closed':
+            if args[1] and target.open:
+                target.archive(trello)
+            elif not args[1] and target.closed:
+                target.unarchive(trello)
+        elif method_name == 'sort_list':
+            target.sort(trello, args[1])
+        elif method_name == 'copy_list':
+            return target.copy(trello, other, override_params)
+        elif method_name == 'archive_all_cards':
+            target.archive_all_cards(trello)
+        elif method_name == 'move_all_cards':
+            target.move_all_cards(trello, other)
+        elif method_name == 'create_list':
+            return target.create_list(args[1])
+        elif method_name == 'update_board_closed':
+            if args[1]:
+                target.archive(trello)
+            else:
+                target.unarchive(trello)
+        else:
+            # Mutations the object model doesn't reflect, like attachments
+            getattr(trello, method_name)(*args, **kwargs)
+
+        return None
+
+
+# WORKER PROCESSES #
+
+_worker_trello = None
+_worker_started = None
+
+# (state path, Trellonos, GithubManager, RecordingTrello, objects by id) of
+# the run the worker last loaded
+_worker_state = None
+
+
+def _cpu_time_exceeded(signum, frame):
+    raise ProcessorTimeout('Processor exceeded its CPU time limit')
+
+
+def _init_worker(trello, started):
+    """ Prepares a worker process to run processors. The keys of tasks are
+    put in the started queue when they start """
+    global _worker_trello
+    global _worker_started
+    global _worker_state
+
+    _worker_trello = trello
+    _worker_started = started
+    _worker_state = None
+
+    # Log output and metrics are sent back to the parent process, so drop
+    # what was copied from it
+    log.set_echo(False)
+    log.take_text()
+    metricstools.take_values()
+
+    if resource:
+        signal.signal(signal.SIGXCPU, _cpu_time_exceeded)
+
+
+def _load_state(state_path):
+    """ Loads the Trellonos state of a run, giving it a Trello wrapper
+    which records mutations instead of making them """
+    with open(state_path, 'rb') as f:
+        trellonos, github = pickle.load(f)
+
+    trello = RecordingTrello(_worker_trello)
+    trellonos.update_trello_instance(trello)
+
+    objects = index_objects(trellonos.boards.values())
+
+    return (state_path, trellonos, github, trello, objects)
+
+
+def _address_space_size():
+    """ Current virtual memory size of this process in bytes, or None if it
+    can't be measured """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[0])
+    except (IOError, OSError, ValueError):
+        return None
+
+    return pages * resource.getpagesize()
+
+
+def _set_limits(cpu_timeout, memory_limit):
+    """ Limits the CPU seconds and megabytes of memory the next processor
+    may use in this worker. None removes a limit """
+    if not resource:
+        return
+
+    # The CPU limit counts all time used by the process, so it is offset by
+    # the time used by earlier processors
+    hard_limit = resource.getrlimit(resource.RLIMIT_CPU)[1]
+    soft_limit = hard_limit
+    if cpu_timeout:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft_limit = int(usage.ru_utime + usage.ru_stime + cpu_timeout) + 1
+        if hard_limit != resource.RLIM_INFINITY:
+            soft_limit = min(soft_limit, hard_limit)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft_limit, hard_limit))
+
+    # Likewise, the memory limit is added to what the worker already uses
+    hard_limit = resource.getrlimit(resource.RLIMIT_AS)[1]
+    soft_limit = hard_limit
+    current_size = _address_space_size()
+    if memory_limit and current_size:
+        soft_limit = current_size + int(memory_limit * 1024 * 1024)
+        if hard_limit != resource.RLIM_INFINITY:
+            soft_limit = min(soft_limit, hard_limit)
+    resource.setrlimit(resource.RLIMIT_AS, (soft_limit, hard_limit))
+
+
+def _run_task(task):
+    """ Runs a processor in a worker process. Returns its output, the
+    mutations it made, its log output and its metrics """
+    global _worker_state
+
+    (key, state_path, board_id, processor_id, input_name, target_id, script,
+     cpu_timeout, memory_limit) = task
+
+    _worker_started.put(key)
+
+    # The state of a run is loaded once per worker, and again only after a
+    # processor changed it
+    if _worker_state is None or _worker_state[0] != state_path:
+        _worker_state = _load_state(state_path)
+
+    trellonos, github, trello, objects = _worker_state[1:]
+    board = objects[board_id]
+
+    input = board.processor_input(trellonos.script_manager, github,
+                                  objects[processor_id],
+                                  {input_name: objects[target_id]})
+
+    _set_limits(cpu_timeout, memory_limit)
+    try:
+        output = trellonos.script_manager.execute(script, input, False)
+        ok = True
+    except Exception:
+        # The script manager has logged the error
+        output = {}
+        ok = False
+    finally:
+        _set_limits(None, None)
+
+    mutations = trello.take_mutations()
+    if mutations:
+        _worker_state = None
+
+    # Outputs that can't be sent back are dropped
+    try:
+        pickle.dumps(output, pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        log.message('Discarding processor output: ' + str(e))
+        output = {}
+
+    # Spans of worker processes aren't exported
+    tracetools.take_spans()
+
+    return (output, mutations, ok, log.take_text(),
+            metricstools.take_values())
+
+
+class ProcessorPool(object):
+    """ Runs gist processors in a pool of worker processes, isolated from
+    Trellonos and each other, with time and memory limits. Processors work
+    on copies of the boards, and the changes they make through the Trello
+    wrapper are applied to the real boards afterwards. A processor's YAML
+    can override the limits with timeout, cpu_timeout and memory_limit """
+
+    def __init__(self, trello, workers=None, timeout=DEFAULT_TIMEOUT,
+                 cpu_timeout=None, memory_limit=None):
+        # multiprocessing is only loaded when processors run in a pool
+        import multiprocessing
+
+        if not workers:
+            workers = multiprocessing.cpu_count()
+
+        self._trello = trello
+        self._workers = workers
+        self._timeout = timeout
+        self._cpu_timeout = cpu_timeout
+        self._memory_limit = memory_limit
+
+        self._pool = None
+
+        # Keys of the tasks which started running, put by the workers
+        self._started = None
+
+        # Counts calls of run, so tasks have unique keys
+        self._runs = 0
+
+    @classmethod
+    def from_environment_vars(cls, trello):
+        """ Construct a processor pool using environment variable settings,
+        or return None if processors should run in-process """
+        workers = os.environ.get('TRELLONOS_WORKERS')
+        if not workers:
+            return None
+
+        timeout = float(os.environ.get('TRELLONOS_PROCESSOR_TIMEOUT',
+                                       DEFAULT_TIMEOUT))
+
+        cpu_timeout = os.environ.get('TRELLONOS_PROCESSOR_CPU_TIMEOUT')
+        if cpu_timeout:
+            cpu_timeout = float(cpu_timeout)
+
+        memory_limit = os.environ.get('TRELLONOS_PROCESSOR_MEMORY_LIMIT')
+        if memory_limit:
+            memory_limit = float(memory_limit)
+
+        return cls(trello, int(workers), timeout, cpu_timeout, memory_limit)
+
+    def _get_pool(self):
+        import multiprocessing
+
+        if self._pool is None:
+            self._started = multiprocessing.Queue()
+            self._pool = multiprocessing.Pool(self._workers, _init_worker,
+                                              (self._trello, self._started))
+
+        return self._pool
+
+    def close(self):
+        """ Shuts down the worker processes """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _terminate(self):
+        """ Kills the worker processes, including stuck ones """
+        self._pool.terminate()
+        self._pool.join()
+        self._pool = None
+
+    def _take_started(self, start_times):
+        """ Notes the start times of the tasks which started running,
+        waiting up to POLL_INTERVAL for one to start """
+        block = True
+
+        while True:
+            try:
+                key = self._started.get(block, POLL_INTERVAL)
+            except Empty:
+                return
+
+            start_times.setdefault(key, time.time())
+            block = False
+
+    def _run_tasks(self, tasks, timeout):
+        """ Runs tasks in the pool, returning their results in order. Tasks
+        which fail, or run for longer than timeout seconds, have None as
+        their result. Time spent waiting for a free worker doesn't count """
+        results = [None] * len(tasks)
+        pending = list(range(len(tasks)))
+
+        while pending:
+            pool = self._get_pool()
+            running = dict([(i, pool.apply_async(_run_task, (tasks[i],)))
+                            for i in pending])
+            pending = []
+            start_times = {}
+
+            while running:
+                self._take_started(start_times)
+                now = time.time()
+
+                for i in sorted(running):
+                    async_result = running[i]
+                    if not async_result.ready():
+                        continue
+
+                    del running[i]
+                    try:
+                        results[i] = async_result.get()
+                    except Exception as e:
+                        log.message('Processor failed in its worker '
+                                    'process: ' + type(e).__name__ + ': ' +
+                                    str(e))
+
+                timed_out = [i for i in running if tasks[i][0] in start_times
+                             and now - start_times[tasks[i][0]] > timeout]
+
+                if timed_out:
+                    log.message(str(len(timed_out)) + ' processor runs '
+                                'timed out after ' + str(timeout) +
+                                ' seconds')
+
+                    # Run the rest again in a new pool, because the stuck
+                    # workers can only be killed
+                    pending = sorted([i for i in running
+                                      if i not in timed_out])
+                    self._terminate()
+                    break
+
+        return results
+
+    def _write_state(self, trellonos, github):
+        """ Writes the state processors need to a temporary file, which each
+        worker loads once. Returns its path """
+        handle, state_path = tempfile.mkstemp(prefix='trellonos-',
+                                              suffix='.pickle')
+
+        with os.fdopen(handle, 'wb') as f:
+            pickle.dump((trellonos, github), f, pickle.HIGHEST_PROTOCOL)
+
+        return state_path
+
+    def run(self, trellonos, github, board, processor, input_name, targets,
+            units=None):
+        """ Runs a processor on each of the given targets in parallel, then
+        applies their mutations in order through the board's Trello wrapper.
+        If Trellonos is journaling, units are the journal keys of the
+        targets: each target's mutations are journaled under its unit, which
+        is completed if the run finished without error. Returns the output
+        dictionary and mutations of each run, and whether it finished
+        without error """
+        yaml_data = processor.yaml_data
+        gist_id = yaml_data['gist_id']
+        gist_file = yaml_data['gist_file']
+
+        script = github.get_script(gist_id, gist_file)
+
+        timeout = yaml_data.get('timeout', self._timeout)
+        cpu_timeout = yaml_data.get('cpu_timeout', self._cpu_timeout)
+        memory_limit = yaml_data.get('memory_limit', self._memory_limit)
+
+        self._runs += 1
+        state_path = self._write_state(trellonos, github)
+
+        tasks = []
+        for i in range(len(targets)):
+            tasks.append(((self._runs, i), state_path, board.id, processor.id,
+                          input_name, targets[i].id, script, cpu_timeout,
+                          memory_limit))
+
+        log.open_context('Running ' + str(len(tasks)) +
+                         ' tasks in worker processes', tasks=len(tasks))
+        try:
+            results = self._run_tasks(tasks, timeout)
+        finally:
+            os.remove(state_path)
+        log.close_context()
+
+        applier = MutationApplier(board.trello, trellonos)
+        journal = trellonos.journal
+        outputs = []
+
+        for i, result in enumerate(results):
+            log.open_context('Script ' + gist_file + ' from gist ' + gist_id +
+                             ' in a worker process', gist_id=gist_id,
+                             gist_file=gist_file)
+
+            # Runs which timed out or crashed their worker failed
+            output = {}
+            mutations = []
+            ok = False
+            if result:
+                output, mutations, ok, text, metric_values = result
+                metricstools.merge_values(metric_values)
+
+                for line in text.splitlines():
+                    log.message(line)
+
+                if journal is not None:
+                    journal.begin(units[i])
+
+                applier.apply(mutations)
+
+                if journal is not None and ok:
+                    journal.complete(units[i])
+
+            outputs.append((output, mutations, ok))
+            log.close_context()
+
+        return outputs
@@ -0,0 +1,252 @@
+import re
+import math
+import pickle
+
+import dependencytools
+from dependencytools import content_hash
+
+# This module keeps a full-text search index of the cards of every board:
+# an inverted index from words to the cards containing them, in their names,
+# plain descriptions, YAML values and check item names. It is saved with the
+# board snapshot and kept up to date card by card, so a search never walks
+# every board.
+#
+# Matches are ranked by how rare the words are among all cards, and how
+# important the fields they were found in are.
+
+WORD_REGEX = re.compile(r'\w+', re.UNICODE)
+
+# Weight of a word found in each field of a card
+NAME_WEIGHT = 3
+YAML_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+CHECK_ITEM_WEIGHT = 1
+
+
+def words(text):
+    """ The lowercase words of a text """
+    return WORD_REGEX.findall(text.lower())
+
+
+def _yaml_strings(value):
+    """ Generates the strings and numbers contained in a YAML value """
+    if isinstance(value, dict):
+        for key in value:
+            for string in _yaml_strings(value[key]):
+                yield string
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            for string in _yaml_strings(item):
+                yield string
+    elif value is not None and not isinstance(value, bool):
+        yield u'%s' % value
+
+
+def card_terms(card):
+    """ Dictionary of the words of a card to their weight in it """
+    terms = {}
+
+    def add(text, weight):
+        for word in words(text):
+            terms[word] = terms.get(word, 0) + weight
+
+    add(card.name, NAME_WEIGHT)
+    add(card.description, DESCRIPTION_WEIGHT)
+
+    for string in _yaml_strings(card.yaml_data):
+        add(string, YAML_WEIGHT)
+
+    checklists = card.checklists
+    for checklist_name in checklists:
+        for item_name in checklists[checklist_name].check_items:
+            add(item_name, CHECK_ITEM_WEIGHT)
+
+    return terms
+
+
+class SearchIndex(object):
+    """ Inverted index of the words of every card of the loaded boards """
+
+    def __init__(self):
+        # Word -> {card id: weight}
+        self._postings = {}
+
+        # Card id -> (board id, content hash, terms), to know when a card
+        # changes and which postings to remove when it does
+        self._documents = {}
+
+        # The rest belongs to one run only, and isn't saved
+
+        # Card id -> Card object
+        self._cards = {}
+
+        # Board id -> version of the board when it was last indexed
+        self._board_versions = {}
+
+    def __getstate__(self):
+        return {'postings': self._postings, 'documents': self._documents}
+
+    def __setstate__(self, state):
+        self._postings = state['postings']
+        self._documents = state['documents']
+        self._cards = {}
+        self._board_versions = {}
+
+    @classmethod
+    def load(cls, path):
+        """ Loads an index saved by save(), or returns an empty one """
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return cls()
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+
+    def __len__(self):
+        return len(self._documents)
+
+    def _remove(self, card_id):
+        board_id, content_hash, terms = self._documents.pop(card_id)
+
+        for term in terms:
+            postings = self._postings[term]
+            del postings[card_id]
+
+            if not postings:
+                del self._postings[term]
+
+    def _add(self, card, board_id, content_hash):
+        terms = card_terms(card)
+        self._documents[card.id] = (board_id, content_hash, terms)
+
+        for term in terms:
+            self._postings.setdefault(term, {})[card.id] = terms[term]
+
+    def _index_card(self, card, board_id):
+        """ Indexes a card again if its content changed since it was last
+        indexed. Returns whether it was """
+        self._cards[card.id] = card
+
+        card_hash = content_hash(card)
+        document = self._documents.get(card.id)
+
+        if document and document[:2] == (board_id, card_hash):
+            return False
+
+        if document:
+            self._remove(card.id)
+
+        self._add(card, board_id, card_hash)
+        return True
+
+    def update_board(self, board):
+        """ Indexes the cards of a board which changed since they were last
+        indexed, and forgets its cards which no longer exist. Returns how
+        many cards were indexed again """
+        version = self._board_versions.get(board.id)
+        if version == board.version:
+            return 0
+
+        updated = 0
+
+        # Since the last update of this run, only the cards the board
+        # reports changed need indexing
+        changed_cards = None
+        if version is not None:
+            changed_cards = board.cards_changed_since(version)
+
+        if changed_cards is not None:
+            for card in changed_cards:
+                if board.has_card(card):
+                    updated += self._index_card(card, board.id)
+                elif self._documents.get(card.id, (None,))[0] == board.id:
+                    # Deleted, or moved to another board
+                    self._remove(card.id)
+                    self._cards.pop(card.id, None)
+
+            self._board_versions[board.id] = board.version
+            return updated
+
+        present = set()
+
+        for list_object in board.lists.values():
+            for card in list_object.cards + list_object.closed_cards:
+                present.add(card.id)
+                updated += self._index_card(card, board.id)
+
+        for card_id in [card_id for card_id in self._documents
+                        if self._documents[card_id][0] == board.id and
+                        card_id not in present]:
+            self._remove(card_id)
+            self._cards.pop(card_id, None)
+
+        self._board_versions[board.id] = board.version
+
+        return updated
+
+    def update(self, boards):
+        """ Brings the index up to date with a dictionary of boards. Cards
+        of boards which aren't loaded stay indexed, but are never found """
+        updated = 0
+        for board_name in boards:
+            updated += self.update_board(boards[board_name])
+
+        return updated
+
+    def search(self, text, board_ids=None, open=True, limit=None):
+        """ The cards containing any word of the text, best matches first.
+        Search only the boards of the given ids, if any. open is True for
+        open cards, False for archived ones, None for both """
+        scores = {}
+
+        for word in set(words(text)):
+            postings = self._postings.get(word)
+            if not postings:
+                continue
+
+            # Rare words say more about a card than common ones
+            rarity = math.log(1 + float(len(self._documents)) /
+                              len(postings))
+
+            for card_id in postings:
+                scores[card_id] = scores.get(card_id, 0) + \
+                    postings[card_id] * rarity
+
+        results = []
+
+        # Ties are broken by id, so results don't change between runs
+        for card_id in sorted(scores, key=lambda card_id:
+                              (-scores[card_id], card_id)):
+            card = self._cards.get(card_id)
+            if card is None:
+                continue
+
+            if board_ids is not None and \
+                    self._documents[card_id][0] not in board_ids:
+                continue
+
+            if open is not None and card.open != open:
+                continue
+
+            results.append(card)
+
+            if limit and len(results) >= limit:
+                break
+
+        return results
+
+    def record_reads(self, boards):
+        """ Reports reads of every card of the given boards to markup
+        dependency recording, because any of them could change the results
+        of a search """
+        for board in boards:
+            dependencytools.record('board', board.id)
+
+            for list_object in board.lists.values():
+                dependencytools.record('list', list_object.id)
+                dependencytools.record_all(
+                    [('card', card.id) for card in
+                     list_object.cards + list_object.closed_cards])
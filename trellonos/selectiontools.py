@@ -0,0 +1,78 @@
+# This module decides which parts of a Trellonos run to carry out. A run
+# can be limited to named boards, kinds of processing, individual processor
+# cards (by name or id), or a single card. Anything not limited is run in
+# full.
+
+# Kinds of processing, in the order a board runs them
+PROCESSOR_KINDS = ('board', 'list', 'regex', 'card', 'markup')
+
+# What is run for a single card, unless kinds are given too
+CARD_KINDS = ('card', 'markup')
+
+
+class RunSelection(object):
+    """ The boards, processing kinds, processors and card a run is limited
+    to. Empty selections mean everything """
+
+    def __init__(self, boards=None, kinds=None, processors=None,
+                 card_id=None):
+        for kind in kinds or []:
+            if kind not in PROCESSOR_KINDS:
+                raise ValueError('Unknown processor kind: ' + kind)
+
+        if card_id and not kinds:
+            kinds = CARD_KINDS
+
+        self._boards = set(boards or [])
+        self._kinds = set(kinds or [])
+        self._processors = set(processors or [])
+        self._card_id = card_id
+
+    @property
+    def boards(self):
+        """ Names of the selected boards, empty for all of them """
+        return sorted(self._boards)
+
+    @property
+    def card_id(self):
+        return self._card_id
+
+    @property
+    def is_complete(self):
+        """ Whether everything is selected """
+        return not (self._boards or self._kinds or self._processors or
+                    self._card_id)
+
+    def select_card_board(self, board_name):
+        """ Limits the run to the board containing the selected card """
+        self._boards = set([board_name])
+
+    def wants_board(self, board_name):
+        return not self._boards or board_name in self._boards
+
+    def wants_kind(self, kind):
+        return not self._kinds or kind in self._kinds
+
+    def wants_processor(self, processor):
+        return (not self._processors or processor.name in self._processors or
+                processor.id in self._processors)
+
+    def filter_cards(self, cards):
+        """ The given cards which are selected """
+        if not self._card_id:
+            return cards
+
+        return [card for card in cards if card.id == self._card_id]
+
+    def filter_lists(self, lists):
+        """ The given lists, or only the one containing the selected card """
+        if not self._card_id:
+            return lists
+
+        return [list_object for list_object in lists
+                if self.filter_cards(list_object.cards +
+                                     list_object.closed_cards)]
+
+
+# Everything, for runs without a selection
+ALL = RunSelection()
@@ -0,0 +1,143 @@
+import datetime
+
+import logtools as log
+
+# This module instantiates template lists: each instance is a copy of a list
+# and all its cards, made with a single request, placed where it belongs by
+# the same request, with the markup of its cards filled in. Planner boards
+# use it to create a dated list for each day from one template list, or from
+# a template list per weekday:
+#
+#   templatetools.instantiate_days(trello, board.meta_lists['Weekday'],
+#                                  datetools.now().date(), 7,
+#                                  script_manager=script_manager)
+#
+# creates lists named like 'Wednesday May 06' for the coming week.
+
+# Names of lists created for days
+DAY_NAME_FORMAT = '%A %B %d'
+
+# Gap between the positions Trello gives lists added at the bottom
+POSITION_STEP = 65536
+
+
+def day_name(date, name_format=DAY_NAME_FORMAT):
+    """ Name of the list for the given day """
+    return date.strftime(name_format)
+
+
+def _neighbour(lists, position, after):
+    """ The list closest to a position, on its right if after is True """
+    if after:
+        neighbours = [list_object for list_object in lists
+                      if list_object.position > position]
+        key = lambda list_object: list_object.position
+    else:
+        neighbours = [list_object for list_object in lists
+                      if list_object.position < position]
+        key = lambda list_object: -list_object.position
+
+    if not neighbours:
+        return None
+
+    return min(neighbours, key=key)
+
+
+def positions_between(board, count, after=None, before=None):
+    """ count increasing positions for new lists of a board, between the
+    list after and the list before. With only one of them, the positions
+    are next to it. With neither, they are after the board's last list """
+    lists = list(board.lists.values())
+
+    if after is None and before is None:
+        if lists:
+            after = max(lists, key=lambda list_object: list_object.position)
+    elif before is None:
+        before = _neighbour(lists, after.position, True)
+    elif after is None:
+        after = _neighbour(lists, before.position, False)
+
+    low = 0
+    if after is not None:
+        low = after.position
+
+    high = low + (count + 1) * POSITION_STEP
+    if before is not None:
+        high = before.position
+
+    step = float(high - low) / (count + 1)
+
+    return [low + step * (i + 1) for i in range(count)]
+
+
+def instantiate(trello, template_list, name, destination_board=None,
+                position='bottom', script_manager=None):
+    """ Copies a template list with all its open cards into a new list of
+    the given name, at the given position of the destination board (by
+    default the template's own board). Fills markup in the copied cards if
+    a ScriptManager is given. Returns the new list """
+    if destination_board is None:
+        destination_board = template_list.parent_board
+
+    # Trello copies the cards and positions the list in the same request
+    new_list = template_list.copy(trello, destination_board,
+                                  {'name': name, 'pos': position})
+
+    if script_manager:
+        # Values memoized before the list was added may be stale, such as
+        # counts of the board's lists
+        script_manager.clear_markup_values()
+        new_list.fill_cards_markup(script_manager)
+
+    return new_list
+
+
+def instantiate_days(trello, templates, first_day, days=7,
+                     destination_board=None, after=None, before=None,
+                     script_manager=None, name_format=DAY_NAME_FORMAT):
+    """ Creates a list for each of the given number of days from first_day
+    (a date), named with name_format, from a template list. templates is
+    one list used for every day, or a dictionary of weekday names
+    ('Monday') to lists; days without a template are skipped, as are days
+    whose list already exists.
+
+    The lists are placed in order between the lists after and before of the
+    destination board (see positions_between). Returns the new lists """
+    per_weekday = isinstance(templates, dict)
+
+    if destination_board is None:
+        if per_weekday:
+            destination_board = list(templates.values())[0].parent_board
+        else:
+            destination_board = templates.parent_board
+
+    existing_lists = destination_board.lists
+
+    pending = []
+    for i in range(days):
+        date = first_day + datetime.timedelta(days=i)
+        name = day_name(date, name_format)
+
+        template = templates
+        if per_weekday:
+            template = templates.get(date.strftime('%A'))
+
+        if template is None:
+            continue
+
+        if name in existing_lists:
+            log.message('List ' + name + ' already exists')
+            continue
+
+        pending.append((name, template))
+
+    positions = positions_between(destination_board, len(pending), after,
+                                  before)
+
+    new_lists = []
+    for (name, template), position in zip(pending, positions):
+        new_lists.append(instantiate(trello, template, name,
+                                     destination_board, position,
+                                     script_manager))
+
+    return new_lists
@@ -1,7 +1,22 @@
+import os
 import unittest
 
 import trellotools
 from trellotools import Trello
+from faketrello import FakeTrello, RecordingTransport, ReplayTransport
+
+# Used instead of Trello when no API credentials are set
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'fixtures', 'trellonos-tests.json')
+
+
+def test_trello():
+    """ A Trello wrapper for the real Trello if credentials are set, or for a
+    fake Trello loaded with the test board otherwise """
+    if os.environ.get('TRELLONOS_API_KEY'):
+        return Trello.from_environment_vars()
+
+    return Trello(None, transport=FakeTrello.from_fixture(FIXTURE_PATH))
 
 
 class TrelloToolsTestCase(unittest.TestCase):
@@ -11,7 +26,7 @@ class TrelloToolsTestCase(unittest.TestCase):
 
     def setUp(self):
         # Create an API wrapper object
-        self.trello = Trello.from_environment_vars()
+        self.trello = test_trello()
 
         # Retrieve the test board for convenience of other tests
         self.test_board = None
@@ -40,6 +55,15 @@ class TrelloToolsTestCase(unittest.TestCase):
     def closed_list_count(self):
         return len(self.get_closed_lists())
 
+    def get_card_test_list(self):
+        for list in self.get_open_lists():
+            if list['name'] == 'Card Test':
+                return list
+
+    def card_count(self, card_filter=trellotools.FILTER_ALL):
+        return len(self.trello.get_cards(self.get_card_test_list(),
+                                         card_filter))
+
     # TEST MODULE HELPERS
 
     def test_boolean_to_string(self):
@@ -151,17 +175,160 @@ class TrelloToolsTestCase(unittest.TestCase):
     # TEST CARD FUNCTIONS
 
     def test_get_cards(self):
-        pass
+        all_cards = self.card_count()
+        open_cards = self.card_count(trellotools.FILTER_OPEN)
+        closed_cards = self.card_count(trellotools.FILTER_CLOSED)
+
+        # There should be at least one of each
+        self.assertGreater(open_cards, 0)
+        self.assertGreater(closed_cards, 0)
+
+        # And the total should equal the sum of both counts
+        self.assertEqual(all_cards, open_cards + closed_cards)
+
+        # Only the requested fields should be retrieved
+        cards = self.trello.get_cards(self.get_card_test_list(),
+                                      fields='name')
+        for card in cards:
+            self.assertEqual(sorted(card.keys()), ['id', 'name'])
 
     def test_update_card_closed(self):
-        pass
+        card_list = self.get_card_test_list()
+        open_cards = self.trello.get_cards(card_list,
+                                           trellotools.FILTER_OPEN)
+        first_open_count = len(open_cards)
+
+        # Close one card
+        self.trello.update_card_closed(open_cards[0], True)
+        self.assertEqual(self.card_count(trellotools.FILTER_OPEN),
+                         first_open_count - 1)
+
+        # And open it again
+        self.trello.update_card_closed(open_cards[0], False)
+        self.assertEqual(self.card_count(trellotools.FILTER_OPEN),
+                         first_open_count)
 
     def test_create_card(self):
-        pass
+        first_count = self.card_count()
+        new_card = self.trello.create_card(self.get_card_test_list(),
+                                           'Card Creation Test',
+                                           'Description')
+
+        self.assertEqual(new_card['name'], 'Card Creation Test')
+        self.assertEqual(new_card['desc'], 'Description')
+        self.assertEqual(self.card_count(), first_count + 1)
+
+        self.trello.delete_card(new_card)
 
     def test_delete_card(self):
-        pass
+        new_card = self.trello.create_card(self.get_card_test_list(),
+                                           'Card Deletion Test')
+        first_count = self.card_count()
+
+        self.trello.delete_card(new_card)
+
+        self.assertEqual(self.card_count(), first_count - 1)
+
+    def test_get_checklist(self):
+        cards = self.trello.get_cards(self.get_card_test_list(),
+                                      trellotools.FILTER_OPEN)
+        checklist_cards = [card for card in cards if card['idChecklists']]
+
+        self.assertGreater(len(checklist_cards), 0)
+
+        checklist = self.trello.get_checklist(
+            checklist_cards[0]['idChecklists'][0])
+        self.assertGreater(len(checklist['checkItems']), 0)
+
+        # Checklists can come nested in their cards instead
+        cards = self.trello.get_cards(self.get_card_test_list(),
+                                      trellotools.FILTER_OPEN,
+                                      checklists=trellotools.FILTER_ALL)
+        for card in cards:
+            self.assertEqual([nested['id'] for nested in card['checklists']],
+                             card['idChecklists'])
+
+
+class ReplayTestCase(unittest.TestCase):
+    """ Tests that recorded Trello sessions replay without Trello """
+
+    def test_record_replay(self):
+        recording = RecordingTransport(FakeTrello.from_fixture(FIXTURE_PATH))
+        trello = Trello('key', 'token', transport=recording)
+
+        boards = trello.get_boards()
+        lists = trello.get_lists(boards[0])
+
+        # Credentials aren't recorded
+        for interaction in recording.interactions:
+            self.assertNotIn('key', interaction['params'])
+
+        replay = ReplayTransport(recording.interactions)
+        replayed = Trello('key', 'token', transport=replay)
+
+        self.assertEqual(replayed.get_boards(), boards)
+        self.assertEqual(replayed.get_lists(boards[0]), lists)
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    """ Tests that repeated reads are cached until the wrapper changes what
+    they read """
+
+    def setUp(self):
+        self.recording = RecordingTransport(
+            FakeTrello.from_fixture(FIXTURE_PATH))
+        self.trello = Trello('key', 'token', transport=self.recording)
+
+        board = self.trello.get_boards()[0]
+        self.card_list = [list_data for list_data in
+                          self.trello.get_lists(board)
+                          if list_data['name'] == 'Card Test'][0]
+
+    def open_cards(self):
+        return self.trello.get_cards(self.card_list, trellotools.FILTER_OPEN)
+
+    def test_repeated_reads(self):
+        cards = self.open_cards()
+        request_count = len(self.recording.interactions)
+
+        self.assertEqual(self.open_cards(), cards)
+        self.assertEqual(len(self.recording.interactions), request_count)
+
+        # Changing a cached response doesn't change the cache
+        cards[0]['name'] = 'Changed'
+        self.assertNotEqual(self.open_cards()[0]['name'], 'Changed')
+
+    def test_mutation_invalidates(self):
+        cards = self.open_cards()
+        closed_cards = self.trello.get_cards(self.card_list,
+                                             trellotools.FILTER_CLOSED)
+
+        self.trello.update_card_closed(cards[0], True)
+
+        self.assertEqual(len(self.open_cards()), len(cards) - 1)
+        self.assertEqual(len(self.trello.get_cards(
+            self.card_list, trellotools.FILTER_CLOSED)),
+            len(closed_cards) + 1)
+
+        self.trello.create_card(self.card_list, 'Cache Test')
+        self.assertEqual(len(self.open_cards()), len(cards))
+
+    def test_list_wide_mutations_invalidate_cards(self):
+        card_id = self.open_cards()[0]['id']
+        card = self.trello.get_card(card_id)
+
+        board = self.trello.get_boards()[0]
+        other_list = [list_data for list_data in
+                      self.trello.get_lists(board)
+                      if list_data['name'] == 'List Sorting Test A'][0]
+
+        self.trello.move_all_cards(self.card_list, other_list)
+        self.assertEqual(self.trello.get_card(card_id)['idList'],
+                         other_list['id'])
 
+        self.assertFalse(card['closed'])
+        self.trello.archive_all_cards(other_list)
+        self.assertTrue(self.trello.get_card(card_id)['closed'])
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,190 @@
+import datetime
+import unittest
+
+import datetools
+from board import Board
+from card import Card
+from faketrello import FakeTrello
+from trellotools import Trello
+
+DUE_FIXTURE = {'boards': [{'name': 'Planner', 'lists': [
+    {'name': 'To Do', 'cards': [
+        {'name': 'Late', 'due': '2015-05-01T12:00:00.000Z'},
+        {'name': 'Undated'},
+        {'name': 'Soon', 'due': '2015-05-08T12:00:00.000Z'},
+        {'name': 'Archived', 'due': '2015-05-02T12:00:00.000Z',
+         'closed': True}]},
+    {'name': 'Done', 'cards': [
+        {'name': 'Earliest', 'due': '2015-04-30T12:00:00.000Z'}]}]}]}
+
+
+def fake_trello(fixture):
+    """ A Trello wrapper for a fake Trello loaded with the given fixture """
+    return Trello(None, transport=FakeTrello(fixture))
+
+
+def load_board(trello, name):
+    """ The Trellonos board of the given name, with its meta board if it has
+    one """
+    trello_boards = dict((trello_board['name'], trello_board)
+                         for trello_board in trello.get_boards())
+
+    return Board(trello, trello_boards[name],
+                 trello_boards.get('<' + name + '>'))
+
+
+def names(cards):
+    return [card.name for card in cards]
+
+
+INHERITANCE_FIXTURE = {'boards': [
+    {'name': 'Planner', 'lists': [
+        {'name': 'To Do', 'cards': [
+            {'name': 'Write'},
+            {'name': 'Read', 'desc': '---\ntype: Chore\n'}]},
+        {'name': 'Done', 'cards': [
+            {'name': 'Plan', 'desc': '---\ntype: Task\npriority: low\n'}]}]},
+    {'name': '<Planner>', 'lists': [
+        {'name': '<List Defaults>', 'cards': [
+            {'name': 'To Do', 'desc': '---\ntype: Task\n'}]},
+        {'name': '<Archetypes>', 'cards': [
+            {'name': 'Task', 'desc': '---\npriority: high\n'},
+            {'name': 'Errand', 'desc': '---\npriority: medium\n'}]}]}]}
+
+
+class InheritanceTestCase(unittest.TestCase):
+    """ Tests applying inheritance again to the cards a change affects """
+
+    def setUp(self):
+        self.trello = fake_trello(INHERITANCE_FIXTURE)
+        self.board = load_board(self.trello, 'Planner')
+
+        self.write, self.read = self.board.lists['To Do'].cards
+        self.plan = self.board.lists['Done'].cards[0]
+        self.task, self.errand = self.board._archetypes.cards
+
+    def priorities(self):
+        return [card.yaml_data.get('priority')
+                for card in (self.write, self.read, self.plan)]
+
+    def test_inheritance(self):
+        # The list default gives Write its type, and the archetype the
+        # priority Plan sets itself
+        self.assertEqual('Task', self.write.type_name)
+        self.assertEqual(['high', None, 'low'], self.priorities())
+
+    def test_archetype_renamed(self):
+        self.task.set_name(self.trello, 'Chore')
+        self.assertEqual([None, 'high', 'low'], self.priorities())
+
+        self.errand.set_name(self.trello, 'Task')
+        self.assertEqual(['medium', 'high', 'low'], self.priorities())
+
+    def test_archetype_changed(self):
+        self.task.set_description(self.trello, '---\npriority: urgent\n')
+        self.assertEqual(['urgent', None, 'low'], self.priorities())
+
+        self.task.set_description(self.trello, '')
+        self.assertEqual([None, None, 'low'], self.priorities())
+
+    def test_archetype_archived(self):
+        self.task.archive(self.trello)
+        self.assertEqual([None, None, 'low'], self.priorities())
+
+        self.task.unarchive(self.trello)
+        self.assertEqual(['high', None, 'low'], self.priorities())
+
+        self.task.delete(self.trello)
+        self.assertEqual([None, None, 'low'], self.priorities())
+
+    def test_list_default_changed(self):
+        default = self.board._list_defaults.cards[0]
+
+        default.set_name(self.trello, 'Done')
+        self.assertEqual(None, self.write.type_name)
+        self.assertEqual([None, None, 'low'], self.priorities())
+
+        default.set_name(self.trello, 'To Do')
+        default.set_description(self.trello, '---\ntype: Errand\n')
+        self.assertEqual('Errand', self.write.type_name)
+        self.assertEqual(['medium', None, 'low'], self.priorities())
+
+    def test_cards_changed(self):
+        # Cards inherit again when their own type or list changes
+        self.read.set_description(self.trello, '---\ntype: Errand\n')
+        self.assertEqual(['high', 'medium', 'low'], self.priorities())
+
+        self.write.move(self.trello, self.board.lists['Done'])
+        self.assertEqual(None, self.write.type_name)
+        self.assertEqual([None, 'medium', 'low'], self.priorities())
+
+
+class BoardDueDateTestCase(unittest.TestCase):
+    """ Tests the due date queries of boards """
+
+    def setUp(self):
+        self.trello = fake_trello(DUE_FIXTURE)
+        self.board = load_board(self.trello, 'Planner')
+
+    def date(self, day):
+        return datetime.datetime(2015, 5, day, tzinfo=datetools.UTC)
+
+    def test_cards_due_between(self):
+        cards = self.board.cards_due_between(self.date(1), self.date(8))
+
+        # Open cards only, ordered by due date
+        self.assertEqual(names(cards), ['Late'])
+
+        self.assertEqual(names(self.board.cards_due_between(self.date(1))),
+                         ['Late', 'Soon'])
+        self.assertEqual(names(self.board.cards_due_between()),
+                         ['Earliest', 'Late', 'Soon'])
+
+    def test_naive_bounds(self):
+        # Bounds without a timezone are in UTC, like Trello's dates
+        cards = self.board.cards_due_between(datetime.datetime(2015, 5, 1),
+                                             datetime.datetime(2015, 5, 9))
+
+        self.assertEqual(names(cards), ['Late', 'Soon'])
+
+    def test_overdue_cards(self):
+        self.assertEqual(names(self.board.overdue_cards(self.date(5))),
+                         ['Earliest', 'Late'])
+        self.assertEqual(names(self.board.overdue_cards()),
+                         ['Earliest', 'Late', 'Soon'])
+
+    def test_due_date_changes(self):
+        undated = self.board.lists['To Do'].cards[1]
+        undated.set_due_date(self.trello, self.date(3))
+
+        self.assertEqual(names(self.board.overdue_cards(self.date(5))),
+                         ['Earliest', 'Late', 'Undated'])
+
+        late = self.board.lists['To Do'].cards[0]
+        late.archive(self.trello)
+
+        self.assertEqual(names(self.board.overdue_cards(self.date(5))),
+                         ['Earliest', 'Undated'])
+
+
+class CardDataTestCase(unittest.TestCase):
+    """ Tests the trimming of card payloads """
+
+    def test_fields_for_scripts(self):
+        trello = fake_trello(DUE_FIXTURE)
+        board = load_board(trello, 'Planner')
+        to_do = board.lists['To Do']
+
+        payload = dict(to_do.cards[0].card_data)
+        payload['url'] = 'https://trello.com/c/abcdefgh/late'
+        payload['labels'] = [{'name': 'Urgent', 'color': 'red'}]
+        payload['badges'] = {'comments': 0}
+
+        card = Card(trello, to_do, payload, False)
+
+        self.assertEqual(card.card_data['url'], payload['url'])
+        self.assertEqual(card.card_data['labels'], payload['labels'])
+        self.assertNotIn('badges', card.card_data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import datetime
+
+import datetools
+
+
+class DateToolsTestCase(unittest.TestCase):
+    """ Tests the datetools module """
+
+    def test_parse_trello_date(self):
+        date = datetools.parse_date('2015-05-06T16:30:15.250Z')
+
+        self.assertEqual(date, datetime.datetime(2015, 5, 6, 16, 30, 15,
+                                                 250000, datetools.UTC))
+        self.assertEqual(date.utcoffset(), datetime.timedelta(0))
+
+    def test_parse_other_format(self):
+        # Formats other than Trello's fall back to dateutil
+        date = datetools.parse_date('2015-05-06 16:30:15+00:00')
+
+        self.assertEqual(date, datetime.datetime(2015, 5, 6, 16, 30, 15,
+                                                 0, datetools.UTC))
+
+    def test_parse_without_offset(self):
+        # dateutil leaves dates without an offset naive, but they must still
+        # compare with Trello's dates
+        date = datetools.parse_date('2015-05-06 16:30:15')
+
+        self.assertEqual(date, datetime.datetime(2015, 5, 6, 16, 30, 15,
+                                                 0, datetools.UTC))
+        self.assertLess(date, datetools.now())
+
+    def test_aware(self):
+        naive = datetime.datetime(2015, 5, 6, 16, 30)
+
+        self.assertEqual(datetools.aware(naive).utcoffset(),
+                         datetime.timedelta(0))
+        self.assertIsNone(datetools.aware(None))
+
+        date = datetools.now()
+        self.assertIs(datetools.aware(date), date)
+
+    def test_compare_with_now(self):
+        date = datetools.parse_date('2015-05-06T16:30:15.250Z')
+
+        self.assertLess(date, datetools.now())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from faketrello import FakeTrello
+from trellonos import Trellonos
+from trellotools import Trello
+
+EXPORT_FIXTURE = {'boards': [
+    {'name': 'Planner', 'lists': [
+        {'name': 'To Do', 'cards': [{'name': 'Write'}]}]},
+    {'name': '<Planner>', 'lists': [
+        {'name': '<List Defaults>', 'cards': [
+            {'name': 'To Do', 'desc': '---\ntype: Task\n'}]},
+        {'name': '<Archetypes>', 'cards': [
+            {'name': 'Task', 'desc': '---\npriority: high\n'}]}]}]}
+
+
+class ReadOnlyExportTestCase(unittest.TestCase):
+    """ Tests exporting boards fetched from Trello """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.trello = Trello(None, transport=FakeTrello(EXPORT_FIXTURE))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def export(self, board_names=[]):
+        trellonos = Trellonos(self.trello, board_names,
+                              state_directory=self.directory, read_only=True)
+        return list(trellonos.card_records())
+
+    def test_records_inherit_from_meta_boards(self):
+        # No GitHub account is needed to read the meta boards
+        records = self.export()
+
+        self.assertEqual(1, len(records))
+        self.assertEqual('Task', records[0]['type'])
+        self.assertEqual('high', records[0]['yaml']['priority'])
+
+        self.assertEqual(records, self.export(['Planner']))
+
+    def test_state_is_left_alone(self):
+        self.export()
+
+        self.assertEqual([], os.listdir(self.directory))
+
+
+if __name__ == '__main__':
+    unittest.main()
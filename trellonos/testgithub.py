@@ -0,0 +1,103 @@
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+from githubtools import GistCache, GithubManager, GistUnavailableException
+
+CACHED_GIST = {'etag': '"abc"', 'revision': 'r1', 'public': False,
+               'files': {'script.py': 'output["x"] = 1'}, 'users': ['user']}
+
+
+class FakeResponse(object):
+    """ Stand-in for a requests response of the given status """
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(str(self.status_code) + ' Error',
+                                     response=self)
+
+
+class GistFallbackTestCase(unittest.TestCase):
+    """ Tests when cached gists are used instead of GitHub's answer """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = GistCache(self.directory)
+        self.cache.save('gist', CACHED_GIST)
+
+        self.github = GithubManager('user', 'password', self.cache)
+        self.get = requests.get
+
+    def tearDown(self):
+        requests.get = self.get
+        shutil.rmtree(self.directory)
+
+    def answer(self, response=None, error=None):
+        """ Makes GitHub answer every request with a response or error """
+        def get(*args, **kwargs):
+            if error:
+                raise error
+            return response
+
+        requests.get = get
+
+    def test_not_modified(self):
+        self.answer(FakeResponse(304))
+        self.assertEqual(self.github.get_gist('gist'), CACHED_GIST)
+
+    def test_offline(self):
+        self.answer(error=requests.ConnectionError('offline'))
+        self.assertEqual(self.github.get_gist('gist'), CACHED_GIST)
+
+    def test_timeout(self):
+        self.answer(error=requests.Timeout('timed out'))
+        self.assertEqual(self.github.get_gist('gist'), CACHED_GIST)
+
+    def test_server_error(self):
+        self.answer(FakeResponse(502))
+        self.assertEqual(self.github.get_gist('gist'), CACHED_GIST)
+
+    def test_deleted_gist(self):
+        self.answer(FakeResponse(404))
+        self.assertRaises(GistUnavailableException, self.github.get_gist,
+                          'gist')
+
+    def test_revoked_credentials(self):
+        self.answer(FakeResponse(401))
+        self.assertRaises(GistUnavailableException, self.github.get_gist,
+                          'gist')
+
+    def test_uncached_offline(self):
+        self.answer(error=requests.ConnectionError('offline'))
+        self.assertRaises(GistUnavailableException, self.github.get_gist,
+                          'other')
+
+
+    def test_other_users_offline(self):
+        # The cache is shared, but GitHub never let this user read the gist
+        other = GithubManager('other', 'password', self.cache)
+
+        self.answer(error=requests.ConnectionError('offline'))
+        self.assertRaises(GistUnavailableException, other.get_gist, 'gist')
+
+        # Once GitHub has answered for them, they can use the cached gist
+        self.answer(FakeResponse(304))
+        self.assertEqual(GithubManager('other', 'password',
+                                       self.cache).get_gist('gist')['files'],
+                         CACHED_GIST['files'])
+        self.assertEqual(self.cache.load('gist')['users'], ['user', 'other'])
+
+        self.answer(error=requests.ConnectionError('offline'))
+        self.assertEqual(GithubManager('other', 'password',
+                                       self.cache).get_gist('gist')['files'],
+                         CACHED_GIST['files'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import logtools as log
+import tracetools
+import trellotools
+from faketrello import FakeTrello
+from journaltools import Journal
+from sandboxtools import ProcessorPool
+from testsandbox import FakeGithub, PROCESSOR_YAML
+from trellonos import Trellonos, JOURNAL_FILE
+
+JOURNAL_FIXTURE = {'boards': [
+    {'name': 'Planner', 'lists': [
+        {'name': 'To Do', 'cards': [
+            {'name': 'First', 'desc': '---\ntype: Task\n'},
+            {'name': 'Second', 'desc': '---\ntype: Task\n'},
+            {'name': 'Third', 'desc': '---\ntype: Task\n'}]},
+        {'name': 'Log'}]},
+    {'name': '<Planner>', 'lists': [
+        {'name': 'Templates'},
+        {'name': '<Card Processors>', 'cards': [
+            {'name': 'Task', 'desc': PROCESSOR_YAML % 'task.py'}]}]}]}
+
+# Logs each card, then marks it done
+LOG_SCRIPT = ("card = input['card']\n"
+              "log_list = card.parent_list.parent_board.lists['Log']\n"
+              "log_list.create_card(input['trello'], 'Logged ' + card.name)\n"
+              "if card.name == 'Broken':\n"
+              "    raise ValueError('broken card')\n"
+              "card.set_name(input['trello'], card.name + '!')\n")
+
+
+class KillingGithub(FakeGithub):
+    """ Stand-in for a GithubManager whose process is killed once, after
+    running the processor on the card of the given name """
+
+    def __init__(self, script, kill_after=None):
+        FakeGithub.__init__(self, script)
+        self.kill_after = kill_after
+
+    def execute_gist(self, script_manager, id, filename, input={},
+                     continue_on_error=True):
+        name = input['card'].name
+        output = FakeGithub.execute_gist(self, script_manager, id, filename,
+                                         input, continue_on_error)
+
+        if name == self.kill_after:
+            self.kill_after = None
+            raise KeyboardInterrupt()
+
+        return output
+
+
+class JournalTestCase(unittest.TestCase):
+    """ Tests resuming processing from the journal of an interrupted run """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.transport = FakeTrello(JOURNAL_FIXTURE)
+        self.trello = trellotools.Trello(None, transport=self.transport)
+        self.finish = Journal.finish
+        self.depth = log.context_depth()
+
+    def tearDown(self):
+        Journal.finish = self.finish
+
+        # A killed run leaves its contexts open
+        log.close_contexts(self.depth)
+        tracetools.take_spans()
+        shutil.rmtree(self.directory)
+
+    def process(self, github, resume=False, processor_pool=None):
+        trellonos = Trellonos(self.trello, github=github,
+                              processor_pool=processor_pool,
+                              state_directory=self.directory, resume=resume)
+        trellonos.process()
+
+    def journal(self):
+        return Journal.load(os.path.join(self.directory, JOURNAL_FILE))
+
+    def keep_journal(self):
+        Journal.finish = lambda journal: None
+
+    def names(self, list_name):
+        """ Names of the cards Trello has in the list of the given name """
+        list_ids = [list_id for list_id in self.transport.lists
+                    if self.transport.lists[list_id]['name'] == list_name]
+
+        return sorted(card['name'] for card in self.transport.cards.values()
+                      if card['idList'] in list_ids)
+
+    def test_kill_and_resume(self):
+        github = KillingGithub(LOG_SCRIPT, kill_after='Second')
+        self.assertRaises(KeyboardInterrupt, self.process, github)
+
+        # The run was killed after the second card's mutations were made,
+        # but before its unit was completed
+        journal = self.journal()
+        self.assertEqual(1, len(journal.units))
+        self.assertEqual(1, len(journal.unfinished_units))
+        self.assertEqual(['Logged First', 'Logged Second'],
+                         self.names('Log'))
+
+        self.process(github, resume=True)
+
+        # The second card ran again without repeating what it had done
+        self.assertEqual(['Logged First', 'Logged Second', 'Logged Third'],
+                         self.names('Log'))
+        self.assertEqual(['First!', 'Second!', 'Third!'],
+                         self.names('To Do'))
+        self.assertEqual(None, self.journal())
+
+    def test_failures_are_not_completed(self):
+        self.keep_journal()
+        second = [card for card in self.transport.cards.values()
+                  if card['name'] == 'Second'][0]
+        second['name'] = 'Broken'
+
+        self.process(FakeGithub(LOG_SCRIPT))
+
+        journal = self.journal()
+        self.assertEqual(2, len(journal.units))
+        self.assertNotIn(second['id'],
+                         [unit_key[2] for unit_key in journal.units])
+
+    def test_pool_mutations_are_journaled(self):
+        self.keep_journal()
+
+        pool = ProcessorPool(self.trello, 2)
+        try:
+            self.process(FakeGithub(LOG_SCRIPT), processor_pool=pool)
+        finally:
+            pool.close()
+
+        journal = self.journal()
+        self.assertEqual(3, len(journal.units))
+        self.assertEqual(6, len(journal.mutations))
+        self.assertEqual(['create_card', 'update_card_name'] * 3,
+                         [mutation[0] for mutation in journal.mutations])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import logtools as log
+
+TIMESTAMP_REGEX = r'^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d '
+
+
+class FakeList(object):
+    """ Stand-in for a month list which can fail to take cards """
+
+    def __init__(self):
+        self.cards = []
+        self.fail = False
+
+    def create_card(self, trello, name, description):
+        if self.fail:
+            raise IOError('Trello is down')
+        self.cards.append((name, description))
+
+
+class FakeBoard(object):
+
+    def __init__(self, month_list):
+        self.month_list = month_list
+        self.lists = self
+
+    def get(self, list_name):
+        return self.month_list
+
+
+class LogDumpTestCase(unittest.TestCase):
+    """ Tests that repeated logs are dumped once, and only once uploaded """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.digest_path = os.path.join(self.directory, 'lastlog.digest')
+        self.month_list = FakeList()
+        self.board = FakeBoard(self.month_list)
+        log.take_records()
+
+    def tearDown(self):
+        log.take_records()
+        shutil.rmtree(self.directory)
+
+    def dump(self):
+        log.message('Nothing to do')
+        log.dump(None, self.board, self.digest_path)
+
+    def test_repeated_log_is_dumped_once(self):
+        self.dump()
+        self.dump()
+
+        self.assertEqual(1, len(self.month_list.cards))
+        self.assertIn('Nothing to do', self.month_list.cards[0][1])
+
+    def test_failed_upload_is_retried(self):
+        self.month_list.fail = True
+        self.assertRaises(IOError, self.dump)
+        self.assertFalse(os.path.exists(self.digest_path))
+
+        self.month_list.fail = False
+        self.dump()
+
+        self.assertEqual(1, len(self.month_list.cards))
+
+
+class LogSettingsTestCase(unittest.TestCase):
+    """ Tests the log settings taken from environment variables """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        self.settings = (log._minimum_priority, log._tab_width, log._records,
+                         list(log._sinks))
+        log.take_records()
+
+        # Keep test output quiet
+        log.set_echo(False)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        (log._minimum_priority, log._tab_width, log._records,
+         log._sinks[:]) = self.settings
+        log.take_records()
+        shutil.rmtree(self.directory)
+
+    def init(self, **variables):
+        os.environ.update(variables)
+        log.init_from_environment_vars()
+
+    def texts(self):
+        return [record.text for record in log.take_records()]
+
+    def test_priority_filtering(self):
+        self.init(TRELLONOS_DEBUG_PRIORITY=str(log.PRIORITY_MEDIUM))
+
+        log.open_context('Details', log.PRIORITY_LOW)
+        log.message('Hidden')
+        log.close_context()
+        log.message('Shown')
+
+        self.assertEqual(['Opening debug context: Details',
+                          'Closing debug context: Details', 'Shown'],
+                         self.texts())
+
+        self.init(TRELLONOS_DEBUG_PRIORITY=str(log.PRIORITY_LOW))
+
+        log.open_context('Details', log.PRIORITY_LOW)
+        log.message('Shown too')
+        log.close_context()
+
+        self.assertIn('Shown too', self.texts())
+
+    def test_buffer_drops_oldest_records(self):
+        self.init(TRELLONOS_LOG_BUFFER_SIZE='3')
+
+        for number in range(5):
+            log.message('Line %d', number)
+
+        month_list = FakeList()
+        log.dump(None, FakeBoard(month_list),
+                 os.path.join(self.directory, 'lastlog.digest'))
+
+        description = month_list.cards[0][1]
+        self.assertIn('(2 earlier lines dropped)', description)
+        self.assertNotIn('Line 1', description)
+        self.assertIn('Line 2', description)
+        self.assertIn('Line 4', description)
+
+        # The count starts again after a dump
+        log.message('Line 5')
+        self.assertEqual(0, log._dropped_records)
+
+    def test_file_sink(self):
+        path = os.path.join(self.directory, 'trellonos.log')
+        self.init(TRELLONOS_TAB_WIDTH='2', TRELLONOS_LOG_FILE=path)
+
+        log.open_context('Writing')
+        log.message('Written')
+        log.close_context()
+        log.flush()
+
+        with open(path) as f:
+            lines = f.read().splitlines()
+
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[1].endswith('   Written'))
+        self.assertTrue(re.match(TIMESTAMP_REGEX, lines[1]))
+
+    def test_echo(self):
+        self.assertNotIn(log._stdout_sink, log._sinks)
+
+        log.set_echo(True)
+        self.assertIn(log._stdout_sink, log._sinks)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import shutil
+import tempfile
+import unittest
+
+import dependencytools
+from dependencytools import MarkupDependencies
+from faketrello import FakeTrello
+from pythontools import ScriptManager
+from testboard import fake_trello, load_board
+from trellonos import Trellonos
+from trellotools import Trello
+
+MARKUP_FIXTURE = {'boards': [{'name': 'Planner', 'lists': [
+    {'name': 'To Do', 'cards': [{'name': 'Weather: {{weather()}}'}]}]}]}
+
+LATEST_FIXTURE = {'boards': [{'name': 'Planner', 'lists': [
+    {'name': 'To Do', 'cards': [
+        {'name': "Latest: {{boards['Planner'].lists['Done'].cards[0].name}}",
+         'desc': 'Untouched'}]},
+    {'name': 'Done', 'cards': [{'name': 'Write'}]}]}]}
+
+
+class FlakyTrellonos(object):
+    """ Stand-in for Trellonos whose weather() fails until it is fixed """
+
+    def __init__(self, board):
+        self._board = board
+        self.online = False
+
+    @property
+    def boards(self):
+        dependencytools.record('boards')
+        return {self._board.name: self._board}
+
+    def weather(self):
+        if not self.online:
+            raise IOError('offline')
+
+        return 'sunny'
+
+
+class CountingTransport(FakeTrello):
+    """ Fake Trello which counts the requests that change anything """
+
+    def __init__(self, fixture):
+        FakeTrello.__init__(self, fixture)
+        self.mutations = 0
+
+    def request(self, method, path, params=None, data=None, files=None):
+        if method != 'GET':
+            self.mutations += 1
+
+        return FakeTrello.request(self, method, path, params, data, files)
+
+
+class MarkupDependenciesTestCase(unittest.TestCase):
+    """ Tests skipping markup whose dependencies are unchanged """
+
+    def setUp(self):
+        self.trello = fake_trello(MARKUP_FIXTURE)
+        self.board = load_board(self.trello, 'Planner')
+        self.card = self.board.lists['To Do'].cards[0]
+
+        self.trellonos = FlakyTrellonos(self.board)
+
+    def fill(self, previous_graph):
+        """ Fills the card's markup as a run would, returning the graph to
+        pass to the next run """
+        dependencies = MarkupDependencies(self.trellonos, previous_graph)
+        self.card.fill_markup(self.trello, ScriptManager(self.trellonos),
+                              dependencies)
+
+        return dependencies.graph
+
+    def test_failure_is_evaluated_again(self):
+        graph = self.fill({})
+
+        self.assertEqual(self.card.name, 'Weather: {{weather()}}')
+        self.assertEqual(graph[self.card.id]['dependencies'], None)
+
+        # Nothing the expression read changed, but it failed last time
+        self.trellonos.online = True
+        self.fill(graph)
+
+        self.assertEqual(self.card.name, 'Weather: sunny')
+
+    def test_failure_source_is_kept(self):
+        self.card.set_name(self.trello,
+                           "Weather: {{weather()}}, {{boards['Planner'].name}}")
+        graph = self.fill({})
+
+        # The expression which worked was filled, and the other is tried
+        # again from the card's markup
+        self.assertEqual(self.card.name, 'Weather: {{weather()}}, Planner')
+
+        self.trellonos.online = True
+        self.fill(graph)
+
+        self.assertEqual(self.card.name, 'Weather: sunny, Planner')
+
+    def test_recording_flag(self):
+        self.assertFalse(dependencytools.recording)
+
+        dependencytools.start_recording()
+        dependencytools.start_recording()
+        self.card.name
+        self.assertEqual(dependencytools.stop_recording(),
+                         set([('card', self.card.id)]))
+        self.assertTrue(dependencytools.recording)
+
+        self.assertEqual(dependencytools.stop_recording(), set())
+        self.assertFalse(dependencytools.recording)
+
+        # Reads outside recordings aren't collected anywhere
+        self.card.name
+
+
+class MarkupRunsTestCase(unittest.TestCase):
+    """ Tests filling markup over several runs, which save its
+    dependencies """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.transport = CountingTransport(LATEST_FIXTURE)
+        self.trello = Trello(None, transport=self.transport)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_trellonos(self):
+        """ Processes the boards as a run would, returning the number of
+        changes it made """
+        mutations = self.transport.mutations
+        Trellonos(self.trello, state_directory=self.directory).process()
+
+        return self.transport.mutations - mutations
+
+    def card_names(self):
+        return sorted(card['name'] for card in self.transport.cards.values())
+
+    def rename(self, name, new_name):
+        """ Renames a card between runs, as a user would """
+        card = [card for card in self.transport.cards.values()
+                if card['name'] == name][0]
+        self.trello.update_card_name(card, new_name)
+
+    def test_unchanged_markup_is_skipped(self):
+        self.run_trellonos()
+        self.assertEqual(['Latest: Write', 'Write'], self.card_names())
+
+        # Nothing the markup read changed
+        self.assertEqual(0, self.run_trellonos())
+
+        # The card it read was renamed, so the markup is filled again
+        self.rename('Write', 'Read')
+
+        self.assertEqual(1, self.run_trellonos())
+        self.assertEqual(['Latest: Read', 'Read'], self.card_names())
+
+    def test_edited_cards_keep_their_edits(self):
+        self.run_trellonos()
+
+        self.rename('Latest: Write', 'Latest: nothing')
+        self.rename('Write', 'Read')
+
+        self.assertEqual(0, self.run_trellonos())
+        self.assertEqual(['Latest: nothing', 'Read'], self.card_names())
+
+
+if __name__ == '__main__':
+    unittest.main()
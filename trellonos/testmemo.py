@@ -0,0 +1,146 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import trellotools
+from faketrello import FakeTrello
+from memotools import ResultCache, replayable
+from testsandbox import FakeGithub
+from trellonos import Trellonos
+
+PURE_FIXTURE = {'boards': [
+    {'name': 'Planner', 'lists': [
+        {'name': 'To Do', 'cards': [{'name': 'Write', 'desc': '---\n'
+                                     'type: Task\n'}]},
+        {'name': 'Log'}]},
+    {'name': '<Planner>', 'lists': [{'name': '<Card Processors>', 'cards': [
+        {'name': 'Task', 'desc': '---\ngist_id: gist\ngist_file: task.py\n'
+                                 'pure: true\n'}]}]}]}
+
+LOG_SCRIPT = ("log_list = input['processor'].parent_list.parent_board"
+              ".lists['Log']\n"
+              "card = log_list.create_card(input['trello'], "
+              "'Logged ' + input['card'].name)\n"
+              "card.set_name(input['trello'], card.name + '!')\n"
+              "output['logged'] = True\n")
+
+
+class CountingGithub(FakeGithub):
+    """ FakeGithub counting the runs of its script """
+
+    def __init__(self, script):
+        FakeGithub.__init__(self, script)
+        self.runs = 0
+
+    def execute_gist(self, script_manager, id, filename, input={},
+                     continue_on_error=True):
+        self.runs += 1
+        return FakeGithub.execute_gist(self, script_manager, id, filename,
+                                       input, continue_on_error)
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    """ Tests the cache of processor results """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache', 'results.pickle')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_and_get(self):
+        cache = ResultCache(self.path)
+        self.assertIsNone(cache.get('key'))
+
+        cache.put('key', {'x': 1}, [('update_card_name', ({'id': 'a'}, 'A'),
+                                     {}, None)])
+        self.assertEqual(cache.get('key')[0], {'x': 1})
+
+    def test_save_and_load(self):
+        cache = ResultCache(self.path)
+        cache.put('key', {'x': 1}, [])
+        cache.save()
+
+        self.assertEqual(ResultCache(self.path).get('key'), ({'x': 1}, []))
+
+    def test_least_recently_used_are_evicted(self):
+        cache = ResultCache(self.path, max_entries=2)
+        cache.put('a', {}, [])
+        cache.put('b', {}, [])
+        cache.get('a')
+        cache.put('c', {}, [])
+
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_outputs_which_cant_be_stored(self):
+        cache = ResultCache(self.path)
+        cache.put('big', {'text': 'x' * 100000}, [])
+        cache.put('unpicklable', {'function': lambda: None}, [])
+
+        self.assertIsNone(cache.get('big'))
+        self.assertIsNone(cache.get('unpicklable'))
+
+    def test_replayable(self):
+        created = {'id': 'new'}
+        mutations = [
+            ('create_card', ({'id': 'list'}, 'New'), {}, created),
+            ('update_card_name', (created, 'New!'), {}, None),
+            ('update_card_name', ({'id': 'old'}, 'Old!'), {}, None)]
+
+        self.assertEqual(replayable(mutations), mutations[2:])
+
+
+class ResultReplayTestCase(unittest.TestCase):
+    """ Tests replaying cached results of pure processors """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.transport = FakeTrello(PURE_FIXTURE)
+        self.trello = trellotools.Trello(None, transport=self.transport)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_processor(self, github):
+        """ Runs the Task processor in a new run, returning its outputs """
+        trellonos = Trellonos(self.trello, github=github,
+                              state_directory=self.directory)
+        board = trellonos.boards['Planner']
+        processor = board._card_processors.cards[0]
+
+        outputs = board.run_processor(trellonos, github,
+                                      trellonos.script_manager, processor,
+                                      'card', board.get_cards('Task'))
+        trellonos.result_cache.save()
+
+        return outputs
+
+    def card_names(self):
+        return sorted([card['name'] for card in
+                       self.transport.cards.values()])
+
+    def test_replay_creates_nothing(self):
+        github = CountingGithub(LOG_SCRIPT)
+
+        self.assertEqual(self.run_processor(github), [{'logged': True}])
+        self.assertEqual(self.run_processor(github), [{'logged': True}])
+
+        self.assertEqual(github.runs, 1)
+        self.assertEqual(self.card_names(), ['Logged Write!', 'Task',
+                                             'Write'])
+
+    def test_failures_are_not_cached(self):
+        github = CountingGithub("raise IOError('GitHub is down')\n")
+
+        self.assertEqual(self.run_processor(github), [{}])
+        self.assertEqual(self.run_processor(github), [{}])
+
+        self.assertEqual(github.runs, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+try:
+    from urllib2 import urlopen, HTTPError
+except ImportError:
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+
+import metricstools
+
+# Defined at import, as modules do, so worker processes have them too
+REQUESTS = metricstools.counter('trellonos_test_requests_total',
+                                'Requests made by the tests', ('status',))
+QUEUE = metricstools.gauge('trellonos_test_queue', 'Queued test tasks')
+SECONDS = metricstools.histogram('trellonos_test_seconds',
+                                 'Test task durations', ('task',),
+                                 buckets=(0.5, 1))
+
+
+def _init_worker():
+    """ Drops the values a worker inherits, which its parent counts """
+    metricstools.take_values()
+
+
+def _count_in_worker():
+    """ Counts a request in a worker process, returning its values """
+    REQUESTS.inc(status='200')
+    SECONDS.observe(0.25, task='worker')
+
+    return metricstools.take_values()
+
+
+class MetricsTestCase(unittest.TestCase):
+    """ Tests keeping metrics and rendering them in the text exposition
+    format """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        metricstools.take_values()
+
+    def tearDown(self):
+        metricstools.take_values()
+        shutil.rmtree(self.directory)
+
+    def lines(self, metric):
+        return metric.render()[2:]
+
+    def test_counter(self):
+        REQUESTS.inc(status='200')
+        REQUESTS.inc(2, status='200')
+        REQUESTS.inc(status='404')
+
+        self.assertEqual(REQUESTS.render(), [
+            '# HELP trellonos_test_requests_total Requests made by the tests',
+            '# TYPE trellonos_test_requests_total counter',
+            'trellonos_test_requests_total{status="200"} 3.0',
+            'trellonos_test_requests_total{status="404"} 1.0'])
+
+        self.assertRaises(ValueError, REQUESTS.inc, method='GET')
+
+    def test_gauge(self):
+        QUEUE.set(4)
+        QUEUE.set(2)
+
+        self.assertEqual(self.lines(QUEUE), ['trellonos_test_queue 2.0'])
+
+    def test_histogram(self):
+        for value in (0.25, 0.5, 4):
+            SECONDS.observe(value, task='sync')
+
+        self.assertEqual(self.lines(SECONDS), [
+            'trellonos_test_seconds_bucket{task="sync",le="0.5"} 2.0',
+            'trellonos_test_seconds_bucket{task="sync",le="1.0"} 2.0',
+            'trellonos_test_seconds_bucket{task="sync",le="+Inf"} 3.0',
+            'trellonos_test_seconds_sum{task="sync"} 4.75',
+            'trellonos_test_seconds_count{task="sync"} 3.0'])
+
+    def test_label_escaping(self):
+        REQUESTS.inc(status='a "quoted"\\path\nline')
+
+        self.assertEqual(self.lines(REQUESTS), [
+            'trellonos_test_requests_total'
+            '{status="a \\"quoted\\"\\\\path\\nline"} 1.0'])
+
+    def test_values_from_other_processes(self):
+        REQUESTS.inc(status='200')
+        SECONDS.observe(2, task='worker')
+        QUEUE.set(1)
+
+        pool = multiprocessing.Pool(1, _init_worker)
+        try:
+            values = pool.apply(_count_in_worker)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.assertEqual(sorted(values), ['trellonos_test_requests_total',
+                                          'trellonos_test_seconds'])
+
+        metricstools.merge_values(values)
+
+        self.assertEqual(self.lines(REQUESTS),
+                         ['trellonos_test_requests_total{status="200"} 2.0'])
+        self.assertIn('trellonos_test_seconds_count{task="worker"} 2.0',
+                      self.lines(SECONDS))
+        self.assertIn('trellonos_test_seconds_sum{task="worker"} 2.25',
+                      self.lines(SECONDS))
+
+        # Taken values are cleared
+        self.assertEqual(metricstools.take_values()['trellonos_test_queue'],
+                         {(): 1})
+        self.assertEqual(self.lines(QUEUE), [])
+
+    def test_write_textfile(self):
+        REQUESTS.inc(status='200')
+        path = os.path.join(self.directory, 'trellonos.prom')
+
+        metricstools.write_textfile(path)
+
+        # Only the finished file is left for the collector
+        self.assertEqual(os.listdir(self.directory), ['trellonos.prom'])
+        with open(path) as f:
+            text = f.read()
+        self.assertEqual(text, metricstools.render())
+        self.assertIn('trellonos_test_requests_total{status="200"} 1.0\n',
+                      text)
+
+    def test_server(self):
+        REQUESTS.inc(status='200')
+        server = metricstools.start_server(0, '127.0.0.1')
+        url = 'http://127.0.0.1:%d' % server.server_address[1]
+
+        try:
+            response = urlopen(url + '/metrics')
+            self.assertIn('text/plain', response.info()['Content-Type'])
+            self.assertIn('trellonos_test_requests_total{status="200"} 1.0',
+                          response.read().decode('utf-8'))
+
+            self.assertRaises(HTTPError, urlopen, url + '/other')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import sys
+import subprocess
+import unittest
+
+PACKAGE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Run in a fresh interpreter, so nothing is imported already
+IMPORT_CODE = """
+import os
+import sys
+import trellonos.cli
+
+# The package's files which were imported. Python 2 also keeps None in
+# sys.modules for names its implicit relative imports tried
+package = os.path.dirname(os.path.abspath(trellonos.__file__))
+print(','.join(sorted(
+    os.path.splitext(os.path.basename(module.__file__))[0]
+    for module in list(sys.modules.values())
+    if module is not None and getattr(module, '__file__', None) and
+    os.path.dirname(os.path.abspath(module.__file__)) == package)))
+from trellonos import Trello, Trellonos
+print(Trello.__name__ + ',' + Trellonos.__name__)
+"""
+
+
+class PackageImportTestCase(unittest.TestCase):
+    """ Tests that the package imports its modules when they are used """
+
+    def test_import_is_lazy(self):
+        # From outside the package, so that the package is imported rather
+        # than its trellonos module
+        root = os.path.dirname(PACKAGE_DIRECTORY)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([root, PACKAGE_DIRECTORY])
+
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_CODE],
+                                         cwd=root, env=env).decode('utf-8')
+        modules, names = output.split()
+
+        # The command line only needs its selections to parse arguments
+        self.assertEqual('__init__,cli,selectiontools', modules)
+        self.assertEqual('Trello,Trellonos', names)
+
+
+if __name__ == '__main__':
+    unittest.main()
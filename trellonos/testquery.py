@@ -0,0 +1,163 @@
+import datetime
+import unittest
+
+import datetools
+from querytools import ANY, CardIndex
+from testboard import fake_trello, load_board, names
+
+QUERY_FIXTURE = {'boards': [
+    {'name': 'Planner', 'lists': [
+        {'name': 'To Do', 'cards': [
+            {'name': 'Write', 'desc': '---\ntype: Task\npriority: high\n',
+             'due': '2015-05-03T12:00:00.000Z'},
+            {'name': 'Read', 'desc': '---\ntype: Task\ntags: [a, b]\n'},
+            {'name': 'Call', 'desc': '---\ntype: Chore\npriority: low\n',
+             'due': '2015-05-01T12:00:00.000Z'}]},
+        {'name': 'Done', 'cards': [
+            {'name': 'Plan', 'desc': '---\ntype: Task\npriority: high\n',
+             'due': '2015-05-02T12:00:00.000Z'},
+            {'name': 'Old', 'desc': '---\ntype: Task\n', 'closed': True}]}]},
+    {'name': 'Garden', 'lists': [{'name': 'Beds'}]},
+    {'name': '<Planner>', 'lists': [{'name': 'Templates'}]}]}
+
+
+def date(day):
+    return datetime.datetime(2015, 5, day, tzinfo=datetools.UTC)
+
+
+def index_state(index):
+    """ The entries of a card index, by card names """
+    state = {'cards': names(index.cards),
+             'due': names(index.due_cards),
+             'due_dates': index.due_dates,
+             'keys': index.keys}
+
+    for index_name in ('by_type', 'by_yaml_key', 'by_yaml_value',
+                       'by_member'):
+        entries = getattr(index, index_name)
+        state[index_name] = dict((key, sorted(names(entries[key])))
+                                 for key in entries)
+
+    return state
+
+
+class CardQueryTestCase(unittest.TestCase):
+    """ Tests answering board queries from the card indexes """
+
+    def setUp(self):
+        self.trello = fake_trello(QUERY_FIXTURE)
+        self.board = load_board(self.trello, 'Planner')
+
+    def test_type_and_yaml(self):
+        self.assertEqual(['Write', 'Read', 'Plan'],
+                         names(self.board.query(type='Task')))
+        self.assertEqual(['Write', 'Plan'],
+                         names(self.board.query(yaml={'priority': 'high'})))
+        self.assertEqual(['Write', 'Call', 'Plan'],
+                         names(self.board.query(yaml={'priority': ANY})))
+
+        # Unhashable values are compared card by card
+        self.assertEqual(['Read'],
+                         names(self.board.query(yaml={'tags': ['a', 'b']})))
+
+    def test_other_criteria(self):
+        self.assertEqual(['Old'], names(self.board.query(open=False)))
+        self.assertEqual(['Plan'],
+                         names(self.board.query(type='Task', list='Done')))
+        self.assertEqual(['Call'], names(self.board.query(
+            where=lambda card: card.name.startswith('C'))))
+
+        # Due dates, in board order
+        self.assertEqual(['Write', 'Plan'],
+                         names(self.board.query(due_after=date(2))))
+        self.assertEqual(['Call', 'Plan'],
+                         names(self.board.query(due_before=date(3))))
+
+
+class CardIndexUpdateTestCase(unittest.TestCase):
+    """ Tests keeping the card indexes up to date as cards change """
+
+    def setUp(self):
+        self.trello = fake_trello(QUERY_FIXTURE)
+        self.board = load_board(self.trello, 'Planner')
+        self.to_do = self.board.lists['To Do']
+        self.done = self.board.lists['Done']
+
+        # Build the indexes
+        self.board.query()
+        self.index = self.board._card_index
+
+    def assertIndexCurrent(self):
+        # Single card changes update the indexes instead of rebuilding them
+        self.assertIs(self.index, self.board._card_index)
+
+        fresh_index = CardIndex(self.board.lists.values())
+        self.assertEqual(index_state(fresh_index), index_state(self.index))
+
+    def test_card_changes(self):
+        write, read, call = self.to_do.cards
+
+        read.set_due_date(self.trello, date(2))
+        self.assertIndexCurrent()
+        self.assertEqual(['Call', 'Read', 'Plan', 'Write'],
+                         names(self.board.cards_due_between()))
+
+        write.set_description(self.trello, '---\ntype: Chore\n')
+        self.assertIndexCurrent()
+        self.assertEqual(['Write', 'Call'],
+                         names(self.board.query(type='Chore')))
+
+        call.subscribe(self.trello)
+        self.assertIndexCurrent()
+        self.assertEqual(['Call'], names(self.board.query(
+            member=self.trello.member)))
+
+        call.set_name(self.trello, 'Phone')
+        self.assertIndexCurrent()
+
+    def test_cards_added_moved_and_removed(self):
+        write, read, call = self.to_do.cards
+
+        write.move(self.trello, self.done)
+        self.assertIndexCurrent()
+        self.assertEqual(['Read', 'Plan', 'Write'],
+                         names(self.board.query(type='Task')))
+
+        read.archive(self.trello)
+        self.assertIndexCurrent()
+        self.assertEqual(['Read', 'Old'], names(self.board.query(open=False)))
+
+        self.to_do.create_card(self.trello, 'Shop', '---\ntype: Chore\n')
+        self.assertIndexCurrent()
+        self.assertEqual(['Call', 'Shop'],
+                         names(self.board.query(type='Chore')))
+
+        call.delete(self.trello)
+        self.assertIndexCurrent()
+        self.assertEqual(['Shop'], names(self.board.query(type='Chore')))
+
+        # Cards moved to another board leave this board's indexes
+        garden = load_board(self.trello, 'Garden')
+        self.done.cards[0].move(self.trello, garden.lists['Beds'])
+        self.assertIndexCurrent()
+        self.assertEqual(['Write'], names(self.board.query(type='Task')))
+
+    def test_changes_to_many_cards(self):
+        self.to_do.archive_all_cards(self.trello)
+        self.assertIndexCurrent()
+
+        self.done.move_all_cards(self.trello, self.to_do)
+        self.assertIndexCurrent()
+        self.assertEqual(['Plan'], names(self.board.query()))
+
+    def test_new_lists(self):
+        shopping = self.board.create_list('Shopping')
+        shopping.create_card(self.trello, 'Milk', '---\ntype: Chore\n')
+
+        # Cards of lists the indexes don't know make them be built again
+        self.assertEqual(['Call', 'Milk'],
+                         names(self.board.query(type='Chore')))
+
+
+if __name__ == '__main__':
+    unittest.main()
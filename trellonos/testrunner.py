@@ -0,0 +1,172 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import dependencytools
+import logtools as log
+import runnertools
+import tracetools
+import trellotools
+from faketrello import FakeTrello
+
+RUNNER_FIXTURE = {'boards': [{'name': 'Planner', 'lists': [
+    {'name': 'To Do', 'cards': [{'name': 'Write'}]}]}]}
+
+
+class FakeResponse(object):
+
+    def __init__(self, value):
+        self._value = value
+        self.content = json.dumps(value) if value is not None else ''
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._value
+
+
+class FakeSession(object):
+    """ Stand-in for a requests session, answering from a fake Trello """
+
+    def __init__(self, fake_trello):
+        self._fake_trello = fake_trello
+
+    def request(self, method, url, params=None, data=None, files=None,
+                timeout=None):
+        path = url[len(trellotools.BASE_URL):]
+        return FakeResponse(self._fake_trello.request(method, path, params,
+                                                      data, files))
+
+
+class BrokenSession(object):
+    """ Stand-in for a requests session which fails in the middle of
+    recording markup dependencies """
+
+    def request(self, *args, **kwargs):
+        dependencytools.start_recording()
+        raise IOError('Trello is unreachable')
+
+
+class ShardTestCase(unittest.TestCase):
+
+    def test_shards(self):
+        accounts = ['a', 'b', 'c', 'd', 'e']
+
+        self.assertEqual([['a', 'c', 'e'], ['b', 'd']],
+                         runnertools.shard(accounts, 2))
+        self.assertEqual([['a', 'b', 'c', 'd', 'e']],
+                         runnertools.shard(accounts, 1))
+
+        # No empty shards for idle workers
+        self.assertEqual([['a'], ['b']], runnertools.shard(['a', 'b'], 4))
+
+
+class LoadConfigTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'accounts.yaml')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self, text):
+        with open(self.path, 'w') as f:
+            f.write(text)
+
+        return runnertools.load_config(self.path)
+
+    def test_valid_config(self):
+        config = self.load('workers: 2\n'
+                           'accounts:\n'
+                           '  - {name: alice, api_key: k1, token: t1}\n'
+                           '  - {name: bob, api_key: k2, token: t2,'
+                           ' boards: [Planner]}\n')
+
+        self.assertEqual(2, config['workers'])
+        self.assertEqual(['alice', 'bob'],
+                         [account['name'] for account in config['accounts']])
+
+    def test_invalid_configs(self):
+        self.assertRaises(ValueError, self.load, '')
+        self.assertRaises(ValueError, self.load, 'accounts: []\n')
+        self.assertRaises(ValueError, self.load,
+                          'accounts:\n  - {name: alice, api_key: k1}\n')
+        self.assertRaises(ValueError, self.load,
+                          'accounts:\n'
+                          '  - {name: alice, api_key: k1, token: t1}\n'
+                          '  - {name: alice, api_key: k2, token: t2}\n')
+
+
+class RunAccountTestCase(unittest.TestCase):
+    """ Tests that a failed account doesn't affect the next """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.tracing = tracetools.recording
+        self.trace_path = os.environ.get('TRELLONOS_TRACE_PATH')
+        tracetools.enable()
+
+    def tearDown(self):
+        tracetools.recording = self.tracing
+        os.environ.pop('TRELLONOS_TRACE_PATH', None)
+        if self.trace_path is not None:
+            os.environ['TRELLONOS_TRACE_PATH'] = self.trace_path
+        tracetools.take_spans()
+        shutil.rmtree(self.directory)
+
+    def account(self, name):
+        return {'name': name, 'api_key': 'key', 'token': 'token',
+                'state_directory': os.path.join(self.directory, name)}
+
+    def run_account(self, name, session):
+        return runnertools.run_account(self.account(name), {}, session,
+                                       dump=False)
+
+    def test_failures_are_isolated(self):
+        broken = self.run_account('broken', BrokenSession())
+
+        self.assertFalse(broken['ok'])
+        self.assertIn('Trello is unreachable', broken['error'])
+
+        # Nothing the failure left behind outlives the account
+        self.assertEqual(0, log.context_depth())
+        self.assertFalse(dependencytools.recording)
+        self.assertEqual([], tracetools.take_spans())
+        self.assertEqual('', log.take_text())
+
+        working = self.run_account('working',
+                                   FakeSession(FakeTrello(RUNNER_FIXTURE)))
+
+        self.assertTrue(working['ok'])
+        self.assertEqual(None, working['error'])
+        self.assertEqual(1, working['boards'])
+        self.assertTrue(working['requests'] > 0)
+        self.assertEqual(0, log.context_depth())
+
+    def test_trace_per_account(self):
+        os.environ['TRELLONOS_TRACE_PATH'] = os.path.join(self.directory,
+                                                          'trace.json')
+
+        for name in ('alice', 'bob'):
+            self.run_account(name, FakeSession(FakeTrello(RUNNER_FIXTURE)))
+
+        for name in ('alice', 'bob'):
+            with open(os.path.join(self.directory,
+                                   'trace.' + name + '.json')) as f:
+                events = json.load(f)['traceEvents']
+
+            self.assertIn('Account ' + name,
+                          [event['name'] for event in events])
+            self.assertEqual(1, len([event for event in events
+                                     if event['name'].startswith('Account')]))
+
+        self.assertFalse(os.path.exists(os.path.join(self.directory,
+                                                     'trace.json')))
+
+
+if __name__ == '__main__':
+    unittest.main()
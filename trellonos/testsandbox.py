@@ -0,0 +1,199 @@
+import shutil
+import tempfile
+import unittest
+
+import trellotools
+from faketrello import FakeTrello
+from sandboxtools import (MUTATING_METHODS, RecordingTrello, MutationApplier,
+                          ProcessorPool)
+from testboard import fake_trello
+from trellonos import Trellonos
+
+PROCESSOR_YAML = '---\ngist_id: gist\ngist_file: %s\n'
+
+SANDBOX_FIXTURE = {'boards': [
+    {'name': 'Planner', 'lists': [{'name': 'To Do', 'cards': [
+        {'name': 'First', 'desc': '---\ntype: Task\n'},
+        {'name': 'Second', 'desc': '---\ntype: Task\n'},
+        {'name': 'Third', 'desc': '---\ntype: Task\n'}]}]},
+    {'name': '<Planner>', 'lists': [{'name': '<Card Processors>', 'cards': [
+        {'name': 'Task', 'desc': PROCESSOR_YAML % 'task.py'}]}]}]}
+
+SCRIPTS = {
+    'rename': "card = input['card']\n"
+              "card.set_name(input['trello'], card.name + '!')\n",
+    'environment': "output['board'] = input['script_manager']"
+                   ".evaluate_markup(\"{{boards['Planner'].name}}\")\n"
+                   "output['github'] = input['github'].name\n",
+    'attach': "input['trello'].add_card_attachment(input['card'].card_data, "
+              "'notes.txt', 'notes', 'text/plain')\n",
+    'nap': "import time\ntime.sleep(0.3)\noutput['done'] = True\n",
+    'stuck': "import time\ntime.sleep(30)\n",
+}
+
+
+class FakeGithub(object):
+    """ Stand-in for a GithubManager with every script in one gist """
+
+    name = 'fake github'
+
+    def __init__(self, script):
+        self._script = script
+
+    def get_gist(self, id):
+        return {'revision': 'r1', 'public': False,
+                'files': {'task.py': self._script}}
+
+    def get_script(self, id, filename):
+        return self._script
+
+    def execute_gist(self, script_manager, id, filename, input={},
+                     continue_on_error=True):
+        return script_manager.execute(self._script, input, continue_on_error)
+
+
+class MutatingMethodsTestCase(unittest.TestCase):
+    """ Tests the recording of mutations made through the Trello wrapper """
+
+    def test_every_mutation_is_recorded(self):
+        self.assertIn('add_card_attachment', MUTATING_METHODS)
+        self.assertIn('update_card_name', MUTATING_METHODS)
+        self.assertNotIn('get_cards', MUTATING_METHODS)
+
+        trello = fake_trello({'boards': [{'name': 'Board'}]})
+        recording = RecordingTrello(trello)
+
+        for method_name in MUTATING_METHODS:
+            self.assertTrue(getattr(trellotools.Trello, method_name).mutates)
+
+        recording.add_card_attachment({'id': 'card'}, 'notes.txt', 'notes',
+                                      'text/plain')
+        self.assertEqual([mutation[0] for mutation in recording.mutations],
+                         ['add_card_attachment'])
+        self.assertEqual(recording.take_mutations()[0][1][1], 'notes.txt')
+        self.assertEqual(recording.mutations, [])
+
+
+class ProcessorPoolTestCase(unittest.TestCase):
+    """ Tests running processors in worker processes """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.transport = FakeTrello(SANDBOX_FIXTURE)
+        self.trello = trellotools.Trello(None, transport=self.transport)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_processor(self, script_name, workers=2, timeout=10):
+        """ Runs a script as the card processor of every Task card, returning
+        the outputs, and the Trellonos object """
+        github = FakeGithub(SCRIPTS[script_name])
+        trellonos = Trellonos(self.trello, github=github,
+                              state_directory=self.directory)
+        board = trellonos.boards['Planner']
+        processor = board._card_processors.cards[0]
+
+        pool = ProcessorPool(self.trello, workers, timeout)
+        try:
+            results = pool.run(trellonos, github, board, processor, 'card',
+                               board.get_cards('Task'))
+        finally:
+            pool.close()
+
+        return [output for output, mutations, ok in results], trellonos
+
+    def test_mutations_are_applied(self):
+        outputs, trellonos = self.run_processor('rename')
+
+        cards = trellonos.boards['Planner'].lists['To Do'].cards
+        self.assertEqual([card.name for card in cards],
+                         ['First!', 'Second!', 'Third!'])
+        self.assertEqual(sorted([card['name'] for card in
+                                 self.transport.cards.values()]),
+                         ['First!', 'Second!', 'Task', 'Third!'])
+
+    def test_processor_environment(self):
+        # Workers give processors markup and GitHub, as in-process runs do
+        outputs, trellonos = self.run_processor('environment')
+
+        self.assertEqual(outputs, [{'board': 'Planner',
+                                    'github': 'fake github'}] * 3)
+
+    def test_attachments_are_recorded(self):
+        self.run_processor('attach')
+
+        # Workers record attachments, and the parent process uploads them
+        self.assertEqual(len(self.transport.attachments), 3)
+
+    def test_queued_time_is_not_timed(self):
+        # One worker runs the tasks one after another, which takes longer
+        # than the timeout of each
+        outputs, trellonos = self.run_processor('nap', workers=1,
+                                                timeout=0.8)
+
+        self.assertEqual(outputs, [{'done': True}] * 3)
+
+    def test_timeout(self):
+        outputs, trellonos = self.run_processor('stuck', timeout=0.5)
+
+        self.assertEqual(outputs, [{}] * 3)
+
+
+class MutationApplierTestCase(unittest.TestCase):
+    """ Tests applying recorded mutations to the object model """
+
+    def setUp(self):
+        self.transport = FakeTrello(SANDBOX_FIXTURE)
+        self.trello = trellotools.Trello(None, transport=self.transport)
+        directory = tempfile.mkdtemp()
+        try:
+            self.trellonos = Trellonos(self.trello, github=FakeGithub(''),
+                                       state_directory=directory)
+        finally:
+            shutil.rmtree(directory)
+
+        self.board = self.trellonos.boards['Planner']
+        self.to_do = self.board.lists['To Do']
+        self.recording = RecordingTrello(self.trello)
+
+    def apply(self):
+        MutationApplier(self.trello, self.trellonos).apply(
+            self.recording.take_mutations())
+
+    def test_created_cards_are_referred_to(self):
+        new_card = self.recording.create_card({'id': self.to_do.id}, 'Fourth')
+        self.recording.update_card_name(new_card, 'Fourth!')
+        self.apply()
+
+        self.assertEqual(self.to_do.cards[-1].name, 'Fourth!')
+        self.assertIn('Fourth!', [card['name'] for card in
+                                  self.transport.cards.values()])
+
+    def test_members_are_indexed(self):
+        card = self.to_do.cards[0]
+        member = {'id': 'member'}
+        self.assertEqual(self.board.query(member=member), [])
+
+        self.recording.add_card_member(card.card_data, member)
+        self.apply()
+        self.assertEqual(self.board.query(member=member), [card])
+
+        self.recording.remove_card_member(card.card_data, member)
+        self.apply()
+        self.assertEqual(self.board.query(member=member), [])
+
+    def test_lists_are_unarchived(self):
+        list_data = {'id': self.to_do.id}
+        self.recording.update_list_closed(list_data, True)
+        self.recording.update_list_closed(list_data, False)
+        self.apply()
+
+        self.assertTrue(self.to_do.open)
+        self.assertIs(self.board.lists['To Do'], self.to_do)
+        self.assertEqual([card.name for card in self.board.query()],
+                         ['First', 'Second', 'Third'])
+        self.assertFalse(self.transport.lists[self.to_do.id]['closed'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+
+import searchtools
+from searchtools import SearchIndex
+from testboard import fake_trello, load_board, names
+
+SEARCH_FIXTURE = {'boards': [
+    {'name': 'Planner', 'lists': [
+        {'name': 'To Do', 'cards': [
+            {'name': 'Water the plants'},
+            {'name': 'Buy seeds', 'desc': 'Tomato and basil seeds'},
+            {'name': 'Call the plumber'}]},
+        {'name': 'Done', 'cards': [{'name': 'Plant the tomatoes'}]}]},
+    {'name': 'Garden', 'lists': [{'name': 'Beds'}]}]}
+
+
+class SearchIndexTestCase(unittest.TestCase):
+    """ Tests keeping the search index up to date card by card """
+
+    def setUp(self):
+        self.trello = fake_trello(SEARCH_FIXTURE)
+        self.board = load_board(self.trello, 'Planner')
+        self.garden = load_board(self.trello, 'Garden')
+        self.boards = {'Planner': self.board, 'Garden': self.garden}
+
+        self.index = SearchIndex()
+        self.assertEqual(4, self.index.update(self.boards))
+
+        # Count the cards hashed to find whether they changed
+        self.hashed = []
+        self.content_hash = searchtools.content_hash
+
+        def content_hash(card):
+            self.hashed.append(card.name)
+            return self.content_hash(card)
+
+        searchtools.content_hash = content_hash
+
+    def tearDown(self):
+        searchtools.content_hash = self.content_hash
+
+    def search(self, text):
+        self.index.update(self.boards)
+        return names(self.index.search(text))
+
+    def test_search(self):
+        self.assertEqual(['Buy seeds', 'Plant the tomatoes'],
+                         names(self.index.search('tomato seeds tomatoes')))
+        self.assertEqual([], self.search('plumbing'))
+        self.assertEqual([], self.hashed)
+
+    def test_only_changed_cards_are_indexed(self):
+        card = self.board.lists['To Do'].cards[2]
+        card.set_name(self.trello, 'Call the electrician')
+
+        self.assertEqual(['Call the electrician'], self.search('electrician'))
+        self.assertEqual([], self.search('plumber'))
+        self.assertEqual(['Call the electrician'], self.hashed)
+
+        # Nothing changed since
+        self.assertEqual(0, self.index.update(self.boards))
+
+    def test_removed_cards(self):
+        to_do = self.board.lists['To Do']
+        to_do.cards[0].delete(self.trello)
+        self.assertEqual([], self.search('water'))
+
+        to_do.cards[0].move(self.trello, self.garden.lists['Beds'])
+        self.assertEqual(['Buy seeds'], self.search('basil'))
+        self.assertEqual(['Buy seeds'],
+                         names(self.index.search('basil',
+                                                 [self.garden.id])))
+        self.assertEqual([], self.index.search('basil', [self.board.id]))
+
+        self.assertEqual(3, len(self.index))
+        self.assertEqual(['Buy seeds'], self.hashed)
+
+    def test_changes_to_lists(self):
+        self.board.lists['Done'].archive(self.trello)
+
+        # Every card of the board is checked again
+        self.assertEqual([], self.search('tomatoes'))
+        self.assertEqual(3, len(self.hashed))
+
+
+if __name__ == '__main__':
+    unittest.main()
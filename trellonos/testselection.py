@@ -0,0 +1,154 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from selectiontools import RunSelection
+from testboard import fake_trello, load_board, names
+from testsandbox import FakeGithub, PROCESSOR_YAML
+from trellonos import (Trellonos, MARKUP_DEPENDENCIES_FILE, SNAPSHOT_FILE)
+
+SELECTION_FIXTURE = {'boards': [
+    {'name': 'Planner', 'lists': [
+        {'name': 'To Do', 'cards': [
+            {'name': 'Write', 'desc': '---\ntype: Task\n'},
+            {'name': 'Read', 'desc': '---\ntype: Task\n'}]},
+        {'name': 'Notes', 'cards': [
+            {'name': 'Board {{boards["Planner"].name}}'},
+            {'name': 'List {{boards["Planner"].lists["To Do"].name}}'}]}]},
+    {'name': 'Garden', 'lists': [{'name': 'Beds'}]},
+    {'name': '<Planner>', 'lists': [
+        {'name': 'Templates'},
+        {'name': '<Card Processors>', 'cards': [
+            {'name': 'Task', 'desc': PROCESSOR_YAML % 'task.py'}]}]}]}
+
+RENAME_SCRIPT = ("card = input['card']\n"
+                 "card.set_name(input['trello'], card.name + '!')\n")
+
+
+class RunSelectionTestCase(unittest.TestCase):
+    """ Tests deciding which parts of a run to carry out """
+
+    def setUp(self):
+        self.trello = fake_trello(SELECTION_FIXTURE)
+        self.board = load_board(self.trello, 'Planner')
+        self.to_do = self.board.lists['To Do']
+        self.write = self.to_do.cards[0]
+
+    def test_everything_by_default(self):
+        selection = RunSelection()
+
+        self.assertTrue(selection.is_complete)
+        self.assertTrue(selection.wants_board('Planner'))
+        self.assertTrue(selection.wants_kind('board'))
+        self.assertTrue(selection.wants_processor(self.write))
+        self.assertEqual(self.to_do.cards,
+                         selection.filter_cards(self.to_do.cards))
+
+    def test_unknown_kind(self):
+        self.assertRaises(ValueError, RunSelection, kinds=['cards'])
+
+    def test_boards_kinds_and_processors(self):
+        selection = RunSelection(boards=['Planner'], kinds=['list'],
+                                 processors=['Write'])
+
+        self.assertFalse(selection.is_complete)
+        self.assertEqual(['Planner'], selection.boards)
+        self.assertFalse(selection.wants_board('Garden'))
+        self.assertFalse(selection.wants_kind('card'))
+
+        # Processors are selected by name or id
+        read = self.to_do.cards[1]
+        self.assertTrue(selection.wants_processor(self.write))
+        self.assertFalse(selection.wants_processor(read))
+        self.assertTrue(RunSelection(processors=[read.id])
+                        .wants_processor(read))
+
+    def test_card_selection(self):
+        selection = RunSelection(card_id=self.write.id)
+
+        # A card's own processing, unless kinds are given
+        self.assertTrue(selection.wants_kind('card'))
+        self.assertTrue(selection.wants_kind('markup'))
+        self.assertFalse(selection.wants_kind('list'))
+        self.assertTrue(RunSelection(kinds=['list'], card_id=self.write.id)
+                        .wants_kind('list'))
+
+        self.assertEqual(['Write'],
+                         names(selection.filter_cards(self.to_do.cards)))
+
+        lists = [self.board.lists[name] for name in sorted(self.board.lists)]
+        self.assertEqual([self.to_do], selection.filter_lists(lists))
+
+        selection.select_card_board('Planner')
+        self.assertEqual(['Planner'], selection.boards)
+
+    def test_get_card(self):
+        card = self.trello.get_card(self.write.id)
+        self.assertEqual('Write', card['name'])
+
+        card = self.trello.get_card(self.write.id, fields='idBoard')
+        self.assertEqual({'id': self.write.id, 'idBoard': self.board.id},
+                         card)
+
+
+class SelectiveRunTestCase(unittest.TestCase):
+    """ Tests runs limited to a single card """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.trello = fake_trello(SELECTION_FIXTURE)
+        self.github = FakeGithub(RENAME_SCRIPT)
+
+        # A full run saves the snapshot and markup dependencies
+        self.process()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def process(self, selection=None):
+        trellonos = Trellonos(self.trello, github=self.github,
+                              selection=selection,
+                              state_directory=self.directory)
+        trellonos.process()
+
+        return trellonos
+
+    def read_state(self, filename):
+        with open(os.path.join(self.directory, filename), 'rb') as f:
+            return f.read()
+
+    def test_only_the_card_is_processed(self):
+        board = load_board(self.trello, 'Planner')
+        write = board.lists['To Do'].cards[0]
+
+        trellonos = self.process(RunSelection(card_id=write.id))
+
+        # Only the card's board is fetched
+        self.assertEqual(['Planner'], sorted(trellonos.boards))
+
+        board = load_board(self.trello, 'Planner')
+        self.assertEqual(['Write!!', 'Read!'],
+                         names(board.lists['To Do'].cards))
+        self.assertEqual(['Board Planner', 'List To Do'],
+                         names(board.lists['Notes'].cards))
+
+    def test_state_of_other_cards_is_kept(self):
+        snapshot = self.read_state(SNAPSHOT_FILE)
+        graph = pickle.loads(self.read_state(MARKUP_DEPENDENCIES_FILE))
+        self.assertEqual(2, len(graph))
+
+        board = load_board(self.trello, 'Planner')
+        read = board.lists['To Do'].cards[1]
+        self.process(RunSelection(card_id=read.id))
+
+        # The snapshot of every board isn't replaced by one of a single
+        # board, and cards left out keep their dependencies
+        self.assertEqual(snapshot, self.read_state(SNAPSHOT_FILE))
+        self.assertEqual(graph,
+                         pickle.loads(self.read_state(MARKUP_DEPENDENCIES_FILE)))
+
+
+if __name__ == '__main__':
+    unittest.main()
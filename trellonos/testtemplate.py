@@ -0,0 +1,154 @@
+import datetime
+import unittest
+
+import templatetools
+from faketrello import FakeTrello
+from pythontools import ScriptManager
+from testboard import load_board, names
+from trellotools import Trello
+
+# May 4th 2015 was a Monday
+MONDAY = datetime.date(2015, 5, 4)
+
+TEMPLATE_FIXTURE = {'boards': [
+    {'name': 'Planner', 'lists': [
+        {'name': 'Inbox'},
+        {'name': 'Someday'}]},
+    {'name': '<Planner>', 'lists': [
+        {'name': 'Day', 'cards': [
+            {'name': 'Plan'},
+            {'name': 'Review'},
+            {'name': 'Skipped', 'closed': True}]},
+        {'name': 'Rest Day', 'cards': [
+            {'name': 'Rest'}]},
+        {'name': 'Counted Day', 'cards': [
+            {'name': "Lists: {{boards['Planner'].lists.__len__()}}"}]}]}]}
+
+
+class PlannerTrellonos(object):
+    """ Stand-in for Trellonos holding one board, for markup """
+
+    def __init__(self, board):
+        self.boards = {board.name: board}
+
+
+class PositionStub(object):
+
+    def __init__(self, position):
+        self.position = position
+
+
+class BoardStub(object):
+    """ Stand-in for a board with lists at the given positions """
+
+    def __init__(self, *positions):
+        self.lists = dict((str(position), PositionStub(position))
+                          for position in positions)
+
+
+class PositionsTestCase(unittest.TestCase):
+    """ Tests choosing positions for new lists """
+
+    def test_after_last_list(self):
+        board = BoardStub(100, 300)
+        step = templatetools.POSITION_STEP
+
+        self.assertEqual(templatetools.positions_between(board, 2),
+                         [300 + step, 300 + step * 2])
+
+    def test_between_lists(self):
+        board = BoardStub(100, 200, 500)
+        after = board.lists['100']
+        before = board.lists['500']
+
+        self.assertEqual(
+            templatetools.positions_between(board, 3, after, before),
+            [200.0, 300.0, 400.0])
+
+        # With one side given, the other is its neighbour
+        self.assertEqual(templatetools.positions_between(board, 1, after),
+                         [150.0])
+        self.assertEqual(
+            templatetools.positions_between(board, 1, before=before),
+            [350.0])
+
+    def test_empty_board(self):
+        step = templatetools.POSITION_STEP
+
+        self.assertEqual(templatetools.positions_between(BoardStub(), 1),
+                         [step])
+
+
+class InstantiateDaysTestCase(unittest.TestCase):
+    """ Tests creating dated lists from templates on the fake Trello """
+
+    def setUp(self):
+        self.transport = FakeTrello(TEMPLATE_FIXTURE)
+        self.trello = Trello(None, transport=self.transport)
+        self.board = load_board(self.trello, 'Planner')
+
+    def template(self, name):
+        return self.board.meta_lists[name]
+
+    def list_order(self):
+        """ Names of the board's lists in Trello, in board order """
+        board_id = self.board.id
+        lists = [list_data for list_data in self.transport.lists.values()
+                 if list_data['idBoard'] == board_id]
+
+        return [list_data['name'] for list_data in
+                sorted(lists, key=lambda list_data: list_data['pos'])]
+
+    def instantiate_days(self, templates, days=3, **kwargs):
+        return templatetools.instantiate_days(
+            self.trello, templates, MONDAY, days, self.board, **kwargs)
+
+    def test_days_between_lists(self):
+        new_lists = self.instantiate_days(
+            self.template('Day'), after=self.board.lists['Inbox'],
+            before=self.board.lists['Someday'])
+
+        self.assertEqual([new_list.name for new_list in new_lists],
+                         ['Monday May 04', 'Tuesday May 05',
+                          'Wednesday May 06'])
+        self.assertEqual(self.list_order(),
+                         ['Inbox', 'Monday May 04', 'Tuesday May 05',
+                          'Wednesday May 06', 'Someday'])
+
+        # Only the open cards of the template are copied
+        for new_list in new_lists:
+            self.assertEqual(names(new_list.cards), ['Plan', 'Review'])
+            self.assertIs(self.board.lists[new_list.name], new_list)
+
+    def test_existing_lists_are_skipped(self):
+        self.instantiate_days(self.template('Day'), days=2)
+        new_lists = self.instantiate_days(self.template('Day'))
+
+        self.assertEqual([new_list.name for new_list in new_lists],
+                         ['Wednesday May 06'])
+        self.assertEqual(self.list_order(),
+                         ['Inbox', 'Someday', 'Monday May 04',
+                          'Tuesday May 05', 'Wednesday May 06'])
+
+    def test_template_per_weekday(self):
+        new_lists = self.instantiate_days(
+            {'Monday': self.template('Day'),
+             'Wednesday': self.template('Rest Day')})
+
+        self.assertEqual([new_list.name for new_list in new_lists],
+                         ['Monday May 04', 'Wednesday May 06'])
+        self.assertEqual(names(new_lists[0].cards), ['Plan', 'Review'])
+        self.assertEqual(names(new_lists[1].cards), ['Rest'])
+
+    def test_markup_is_filled_per_list(self):
+        script_manager = ScriptManager(PlannerTrellonos(self.board))
+        new_lists = self.instantiate_days(self.template('Counted Day'),
+                                          script_manager=script_manager)
+
+        # Each list's markup sees the lists created before it
+        self.assertEqual([new_list.cards[0].name for new_list in new_lists],
+                         ['Lists: 3', 'Lists: 4', 'Lists: 5'])
+
+
+if __name__ == '__main__':
+    unittest.main()
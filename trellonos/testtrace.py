@@ -0,0 +1,48 @@
+import unittest
+
+import tracetools
+
+
+class SpanRecordingTestCase(unittest.TestCase):
+    """ Tests that finished spans are only kept while tracing """
+
+    def setUp(self):
+        self.recording = tracetools.recording
+        tracetools.take_spans()
+
+    def tearDown(self):
+        tracetools.recording = self.recording
+        tracetools.take_spans()
+
+    def run_span(self):
+        tracetools.start_span('outer')
+        tracetools.start_span('inner', card='c')
+        tracetools.end_span()
+        tracetools.end_span()
+
+    def test_spans_dropped_when_not_tracing(self):
+        tracetools.recording = False
+        self.run_span()
+
+        self.assertEqual([], tracetools.take_spans())
+
+    def test_spans_kept_when_tracing(self):
+        tracetools.enable()
+        self.run_span()
+
+        spans = tracetools.take_spans()
+        self.assertEqual(['inner', 'outer'], [span.name for span in spans])
+        self.assertEqual(['outer', 'inner'], spans[0].path)
+        self.assertEqual([], tracetools.take_spans())
+
+    def test_spans_bounded(self):
+        tracetools.enable()
+        for i in range(tracetools.MAX_SPANS + 10):
+            tracetools.start_span('span')
+            tracetools.end_span()
+
+        self.assertEqual(tracetools.MAX_SPANS, len(tracetools.take_spans()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+from collections import deque
+
+# This module times the nested contexts of the debug log as spans, and
+# exports them once a run is over. logtools starts and ends a span with each
+# context, and Trello API calls are counted by every span open when they are
+# made.
+#
+# Exports are Chrome trace-event JSON (viewable in chrome://tracing or
+# Perfetto) and folded stacks for flamegraph tools.
+#
+# Spans are only kept once finished while tracing is on (TRELLONOS_TRACE_PATH
+# is set, or enable() was called), and then only the most recent MAX_SPANS.
+
+
+class Span(object):
+    """ One timed context, with its attributes """
+
+    __slots__ = ('name', 'parent', 'depth', 'start', 'end', 'attributes',
+                 'api_calls')
+
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent else 0
+        self.start = time.time()
+        self.end = None
+        self.attributes = attributes
+        self.api_calls = 0
+
+    @property
+    def duration(self):
+        """ Seconds the span lasted, or has lasted so far """
+        end = self.end
+        if end is None:
+            end = time.time()
+
+        return end - self.start
+
+    @property
+    def path(self):
+        """ Names of this span and its ancestors, outermost first """
+        names = []
+
+        span = self
+        while span:
+            names.append(span.name)
+            span = span.parent
+
+        return names[::-1]
+
+
+MAX_SPANS = 100000
+
+recording = bool(os.environ.get('TRELLONOS_TRACE_PATH'))
+
+_open_spans = []
+_finished_spans = deque(maxlen=MAX_SPANS)
+
+
+def enable():
+    """ Keeps finished spans for export """
+    global recording
+    recording = True
+
+
+def start_span(name, **attributes):
+    """ Starts a span nested in the innermost open span """
+    parent = None
+    if _open_spans:
+        parent = _open_spans[-1]
+
+    span = Span(name, parent, attributes)
+    _open_spans.append(span)
+
+    return span
+
+
+def end_span():
+    """ Ends the innermost open span """
+    span = _open_spans.pop()
+    span.end = time.time()
+
+    if recording:
+        _finished_spans.append(span)
+
+    return span
+
+
+def count_api_call():
+    """ Counts a Trello API call in every open span """
+    for span in _open_spans:
+        span.api_calls += 1
+
+
+def take_spans():
+    """ Returns the spans finished since the last call, and clears them """
+    spans = list(_finished_spans)
+    _finished_spans.clear()
+    return spans
+
+
+def chrome_trace(spans):
+    """ Chrome trace-event JSON of the given spans, as a dictionary """
+    pid = os.getpid()
+    events = []
+
+    for span in spans:
+        args = dict(span.attributes)
+        args['api_calls'] = span.api_calls
+
+        events.append({
+            'name': span.name,
+            'ph': 'X',
+            'ts': int(span.start * 1000000),
+            'dur': int(span.duration * 1000000),
+            'pid': pid,
+            'tid': pid,
+            'args': args
+        })
+
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def folded_stacks(spans):
+    """ Folded stack lines of the given spans, weighted by the microseconds
+    spent in each span itself rather than in its children """
+    self_times = {}
+    paths = {}
+
+    for span in spans:
+        self_times[id(span)] = self_times.get(id(span), 0) + span.duration
+        paths[id(span)] = span.path
+
+        if span.parent:
+            self_times[id(span.parent)] = (self_times.get(id(span.parent), 0) -
+                                           span.duration)
+
+    weights = {}
+    for key in paths:
+        # Semicolons separate frames, so they can't appear in names
+        stack = ';'.join([name.replace(';', ',') for name in paths[key]])
+        weights[stack] = (weights.get(stack, 0) +
+                          max(0, int(self_times[key] * 1000000)))
+
+    return [stack + ' ' + str(weights[stack]) for stack in sorted(weights)]
+
+
+def export(path, spans=None):
+    """ Writes the given spans, or all finished spans, as Chrome trace JSON
+    to path and as folded stacks to path + '.folded' """
+    if spans is None:
+        spans = take_spans()
+
+    with open(path, 'w') as f:
+        json.dump(chrome_trace(spans), f)
+
+    with open(path + '.folded', 'w') as f:
+        for line in folded_stacks(spans):
+            f.write(line + '\n')
+
+
+def account_path(path, account):
+    """ The path of the trace of one account of a run of many, such as
+    trace.alice.json for trace.json """
+    root, extension = os.path.splitext(path)
+    return root + '.' + account + extension
+
+
+def export_from_environment_vars(account=None):
+    """ Exports all finished spans if TRELLONOS_TRACE_PATH is set, to a
+    path of the given account's own if one is given """
+    path = os.environ.get('TRELLONOS_TRACE_PATH')
+    if path:
+        path = os.path.expanduser(path)
+        if account:
+            path = account_path(path, account)
+
+        export(path)
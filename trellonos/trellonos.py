@@ -1,30 +1,99 @@
+import os
 import re
+import time
 
 from trellotools import Trello
 from githubtools import GithubManager
 from pythontools import ScriptManager
+from sandboxtools import ProcessorPool
+from memotools import ResultCache
 import pickle
 import logtools as log
+import metricstools
 from board import Board
+from dependencytools import MarkupDependencies
+from searchtools import SearchIndex
+from journaltools import Journal, JournalingTrello
+import journaltools
+import dependencytools
+import exporttools
+import selectiontools
 from os.path import expanduser
 home = expanduser("~")
 
+CARDS_LOADED = metricstools.gauge(
+    'trellonos_cards_loaded', 'Cards loaded, including archived cards, by '
+    'board', ('board',))
+RUN_SECONDS = metricstools.gauge(
+    'trellonos_run_duration_seconds', 'Time taken by the last run')
+LAST_RUN = metricstools.gauge(
+    'trellonos_last_run_timestamp_seconds', 'When the last run finished')
+
 TRELLONOS_REGEX = re.compile('^<.+>$')
 OUTPUT_BOARD_NAME = 'Trellonos Output'
 
+# Files of the state kept between runs, in the state directory (the home
+# directory unless another is given)
+SNAPSHOT_FILE = '.lasttrellonos'
+MARKUP_DEPENDENCIES_FILE = '.lasttrellonos.markup'
+SEARCH_INDEX_FILE = '.lasttrellonos.search'
+RESULT_CACHE_FILE = '.trellonos/results.pickle'
+LOG_DIGEST_FILE = '.trellonos/lastlog.digest'
+JOURNAL_FILE = '.trellonos/journal.pickle'
+
+# Attributes which belong to the process which made them, and aren't
+# pickled for worker processes
+PROCESS_ATTRIBUTES = ('_trello', '_script_manager', '_processor_pool',
+                      '_result_cache', '_search_index', '_journal')
+
 
 class Trellonos(object):
     """ Top-level container of Trello data and core processor """
 
-    def __init__(self, trello, boards_needed=[], github=None):
+    def __init__(self, trello, boards_needed=[], github=None,
+                 processor_pool=None, selection=None, state_directory=home,
+                 resume=False, read_only=False):
         self._trello = trello
+        # Read-only instances (for exports) load every board with its meta
+        # board, and leave the state kept between runs alone
+        self._read_only = read_only
+        self._state_directory = state_directory
         self._github = github
         self._script_manager = ScriptManager(self)
 
+        # The parts of the run to carry out. Only selected boards are
+        # fetched
+        if selection is None:
+            selection = selectiontools.ALL
+        self._selection = selection
+
+        if selection.card_id:
+            card_board = self.find_card_board(selection.card_id)
+            selection.select_card_board(card_board)
+
+        # The output board is needed for dumping the log
+        if not boards_needed and selection.boards:
+            boards_needed = selection.boards + [OUTPUT_BOARD_NAME]
+
+        # Processors run in-process unless a pool of workers is given
+        self._processor_pool = processor_pool
+
+        # Results of deterministic processors, loaded when first needed
+        self._result_cache = None
+
+        # Full-text index of every card, loaded when first searched
+        self._search_index = None
+
+        # Progress of processing, kept so an interrupted run can be resumed
+        self._journal = None
+
         self._boards_needed = boards_needed
 
-        if boards_needed == 'USE_BACKUP':
-            with open(home + '/.lasttrellonos', 'r') as f:
+        if resume and self.resume_journal():
+            # The boards were loaded from the journal
+            pass
+        elif boards_needed == 'USE_BACKUP':
+            with open(self.state_path(SNAPSHOT_FILE), 'rb') as f:
                 self._boards = pickle.load(f)
 
             self._boards_needed = []
@@ -34,17 +103,83 @@ class Trellonos(object):
                 self._boards[board].update_trello_instance(trello)
         else:
             self.populate_boards()
-            self.serialize_boards()
+
+            # A snapshot of only some boards would hide the others
+            if not self._boards_needed and not read_only:
+                self.serialize_boards()
+
+    def __getstate__(self):
+        # Worker processes get the boards, and the GitHub account to run
+        # their processors
+        state = dict(self.__dict__)
+        for name in PROCESS_ATTRIBUTES:
+            del state[name]
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+        for name in PROCESS_ATTRIBUTES:
+            setattr(self, name, None)
+        self._script_manager = ScriptManager(self)
 
     @classmethod
-    def from_environment_vars(cls):
+    def from_environment_vars(cls, selection=None, resume=False):
         trello = Trello.from_environment_vars()
         github = GithubManager.from_environment_vars()
-        return cls(trello, github)
+        processor_pool = ProcessorPool.from_environment_vars(trello)
+        return cls(trello, github=github, processor_pool=processor_pool,
+                   selection=selection, resume=resume)
+
+    def resume_journal(self):
+        """ Loads the boards of an interrupted run from its journal, with
+        the changes it made. Returns False if there is no run to resume """
+        journal = Journal.load(self.state_path(JOURNAL_FILE))
+        if journal is None:
+            log.message('No interrupted run to resume')
+            return False
+
+        self._boards = journal.boards
+        journaltools.replay(self, journal)
+
+        self._journal = journal
+        return True
+
+    def find_card_board(self, card_id):
+        """ The name by which Trellonos knows the board containing a card """
+        card = self._trello.get_card(card_id, fields='idBoard')
+
+        for trello_board in self._trello.get_boards():
+            if trello_board['id'] == card['idBoard']:
+                board_name = trello_board['name']
+
+                # Cards of meta boards belong to the board they describe
+                if re.search(TRELLONOS_REGEX, board_name):
+                    board_name = board_name[1:-1]
+
+                return board_name
+
+        raise ValueError('Card ' + card_id + ' is not on an open board')
+
+    def state_path(self, filename):
+        """ Path of a file of the state kept between runs """
+        return os.path.join(self._state_directory, filename)
+
+    def update_trello_instance(self, trello):
+        """ Gives Trellonos and every board a new Trello wrapper """
+        self._trello = trello
+
+        for name in self._boards:
+            self._boards[name].update_trello_instance(trello)
 
     def serialize_boards(self):
-        with open(home + '/.lasttrellonos', 'w+') as f:
-            pickle.dump(self._boards, f)
+        # Binary protocol, which pickles the slotted wrappers compactly
+        with open(self.state_path(SNAPSHOT_FILE), 'wb') as f:
+            pickle.dump(self._boards, f, pickle.HIGHEST_PROTOCOL)
+
+        # Keep the search index in step with the snapshot
+        self.search_index.save(self.state_path(SEARCH_INDEX_FILE))
 
     def populate_boards(self):
         trello = self._trello
@@ -79,8 +214,8 @@ class Trellonos(object):
 
         # first construct processor-enabled board objects from normal boards
         # and meta counterparts as long as a Github object is provided to
-        # process them
-        if github != None:
+        # process them, or the boards are only read
+        if github != None or self._read_only:
             for board_name in meta_boards:
                 normal_board = non_meta_boards[board_name]
                 meta_board = meta_boards[board_name]
@@ -96,22 +231,93 @@ class Trellonos(object):
 
                 self._boards[board_name] = board_object
 
+        for board_name in self._boards:
+            num_cards = 0
+            for list_object in self._boards[board_name].all_lists():
+                num_cards += (len(list_object.cards) +
+                              len(list_object.closed_cards))
+
+            CARDS_LOADED.set(num_cards, board=board_name)
+
         log.close_context()
 
 
 
     @property
     def boards(self):
+        dependencytools.record('boards')
         return self._boards
 
     @property
     def trello(self):
         return self._trello
 
+    @property
+    def github(self):
+        return self._github
+
+    def query(self, board=None, **criteria):
+        """ Retrieve the cards of every open board, or of the named board,
+        matching the given criteria. See Board.query """
+        boards = self.boards
+
+        if board is not None:
+            return boards[board].query(**criteria)
+
+        cards = []
+        for board_name in sorted(boards):
+            cards.extend(boards[board_name].query(**criteria))
+
+        return cards
+
+    @property
+    def search_index(self):
+        """ The full-text index of the cards of every board, brought up to
+        date with any cards which changed """
+        if self._search_index is None:
+            self._search_index = SearchIndex.load(
+                self.state_path(SEARCH_INDEX_FILE))
+
+        self._search_index.update(self._boards)
+
+        return self._search_index
+
+    def search(self, text, board=None, open=True, limit=None):
+        """ Retrieve the cards of every board, or of the named board,
+        containing any word of the text in their names, descriptions, YAML
+        values or check items. The best matches come first. open is True for
+        open cards, False for archived ones, None for both """
+        boards = self.boards
+        if board is not None:
+            boards = {board: boards[board]}
+
+        index = self.search_index
+        index.record_reads(boards.values())
+
+        board_ids = set([boards[name].id for name in boards])
+        return index.search(text, board_ids, open, limit)
+
     @property
     def script_manager(self):
         return self._script_manager
 
+    @property
+    def journal(self):
+        """ The journal of the processing in progress, or None """
+        return self._journal
+
+    @property
+    def processor_pool(self):
+        return self._processor_pool
+
+    @property
+    def result_cache(self):
+        if self._result_cache is None:
+            self._result_cache = ResultCache.from_environment_vars(
+                self.state_path(RESULT_CACHE_FILE))
+
+        return self._result_cache
+
     def process(self):
         """ Runs all Trellonos processing of open boards """
 
@@ -119,18 +325,103 @@ class Trellonos(object):
             log.message("Can't run Trellonos processing without a Github account")
 
         log.open_context('Trellonos processing.')
+        start = time.time()
 
-        # Run each board's processing
+        # Journal the progress of processors, continuing the journal of an
+        # interrupted run
+        if self._journal is None:
+            self._journal = Journal(self.state_path(JOURNAL_FILE))
+            self._journal.start(self._boards)
+        else:
+            self._journal.reopen()
+
+        journaling_trello = JournalingTrello(self._trello, self._journal)
         for name in self._boards:
-            board = self._boards[name]
-            board.process(self, self._github, self._script_manager)
+            self._boards[name].update_trello_instance(journaling_trello)
+
+        # Run each board's processing
+        try:
+            for name in self._boards:
+                if not self._selection.wants_board(name):
+                    continue
+
+                board = self._boards[name]
+                board.process(self, self._github, self._script_manager,
+                              self._selection)
+        finally:
+            for name in self._boards:
+                self._boards[name].update_trello_instance(self._trello)
+
+        if self._processor_pool:
+            self._processor_pool.close()
+
+        if self._result_cache:
+            self._result_cache.save()
+
+        # Then fill each board's markup fields, which may read anything the
+        # processors changed
+        if self._selection.wants_kind('markup'):
+            self.fill_markup()
+
+        # Save the cards changed by this run, if anything searched
+        if self._search_index is not None:
+            self.search_index.save(self.state_path(SEARCH_INDEX_FILE))
+
+        # Nothing is left to resume
+        self._journal.finish()
+        self._journal = None
+
+        log.close_context()
+
+        RUN_SECONDS.set(time.time() - start)
+        LAST_RUN.set(time.time())
+
+    def load_markup_dependencies(self):
+        """ Loads the markup dependency graph saved by the last run """
+        try:
+            with open(self.state_path(MARKUP_DEPENDENCIES_FILE), 'rb') as f:
+                return pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return {}
+
+    def save_markup_dependencies(self, graph):
+        with open(self.state_path(MARKUP_DEPENDENCIES_FILE), 'wb') as f:
+            pickle.dump(graph, f, pickle.HIGHEST_PROTOCOL)
+
+    def fill_markup(self):
+        """ Fills markup expressions in every board, skipping cards whose
+        markup and dependencies haven't changed since the last run """
+        log.open_context('Filling markup.')
+        self._script_manager.clear_markup_values()
+
+        previous_graph = self.load_markup_dependencies()
+        dependencies = MarkupDependencies(self, previous_graph)
 
-        # Then fill each board's markup fields
         for name in self._boards:
+            if not self._selection.wants_board(name):
+                continue
+
             board = self._boards[name]
-            board.fill_cards_markup(self._script_manager)
+            board.fill_cards_markup(self._script_manager, dependencies,
+                                    self._selection)
+
+        graph = dependencies.graph
+
+        # Cards left out of a selective run keep their dependencies
+        if not self._selection.is_complete:
+            merged_graph = dict(previous_graph)
+            merged_graph.update(graph)
+            graph = merged_graph
+
+        self.save_markup_dependencies(graph)
 
         log.close_context()
 
+    def card_records(self, include_closed=False):
+        """ Generates a flat record of every card in every board, for
+        exporting """
+        return exporttools.card_records(self._boards, include_closed)
+
     def dump_log(self):
-        log.dump(self._trello, self.boards[OUTPUT_BOARD_NAME])
+        log.dump(self._trello, self.boards[OUTPUT_BOARD_NAME],
+                 self.state_path(LOG_DIGEST_FILE))
@@ -1,13 +1,53 @@
 import os
-import json
+import re
+import copy
+import time
+import threading
+from collections import OrderedDict, deque
 
-from trello import TrelloApi
-import requests
+import metricstools
+import tracetools
 
 
 API_VERSION = '1'
 BASE_URL = 'https://api.trello.com/' + API_VERSION + '/'
 
+# Seconds to wait on a Trello request
+TRELLO_TIMEOUT = 30
+
+# Times a request refused for exceeding the rate limit is tried again
+MAX_RATE_LIMIT_RETRIES = 5
+
+# Requests Trello allows each token in a period of seconds
+TOKEN_RATE_LIMIT = 100
+RATE_LIMIT_PERIOD = 10
+
+# Ids in request paths, replaced so requests group by endpoint
+ID_REGEX = re.compile(r'(?<=/)[0-9a-f]{24}(?=/|$)')
+
+# Mutations of every card of a list, named by the end of their path
+LIST_WIDE_MUTATIONS = ('/archiveAllCards', '/moveAllCards')
+
+# Most GET responses kept by the response cache of one run
+DEFAULT_RESPONSE_CACHE_SIZE = 256
+
+REQUESTS = metricstools.counter(
+    'trellonos_trello_requests_total', 'Trello API requests',
+    ('method', 'endpoint', 'status'))
+REQUEST_SECONDS = metricstools.histogram(
+    'trellonos_trello_request_duration_seconds',
+    'Time taken by successful Trello API requests', ('method', 'endpoint'))
+RATE_LIMIT_WAITS = metricstools.counter(
+    'trellonos_trello_rate_limit_waits_total',
+    'Trello API requests delayed by the rate limit')
+RATE_LIMIT_WAIT_SECONDS = metricstools.counter(
+    'trellonos_trello_rate_limit_wait_seconds_total',
+    'Time spent waiting on the Trello rate limit')
+RESPONSE_CACHE_REQUESTS = metricstools.counter(
+    'trellonos_trello_response_cache_requests_total',
+    'Trello API reads, by result: hit or miss of the response cache',
+    ('result',))
+
 FILTER_OPEN = 'open'
 FILTER_CLOSED = 'closed'
 FILTER_ALL = 'all'
@@ -22,30 +62,251 @@ def boolean_to_string(boolean):
         return "false"
 
 
+def mutation(method):
+    """ Marks a Trello wrapper method as one which changes Trello. Stand-ins
+    for the wrapper which record or replay changes (see sandboxtools and
+    journaltools) take the list of these methods from MUTATING_METHODS """
+    method.mutates = True
+    return method
+
+
+def _error_status(error):
+    """ The HTTP status of a failed request, if it got a response """
+    status = getattr(error, 'status', None)
+
+    response = getattr(error, 'response', None)
+    if status is None and response is not None:
+        status = response.status_code
+
+    return status
+
+
+def _retry_delay(error, attempt):
+    """ Seconds to wait before retrying a rate limited request: as long as
+    Trello asks, or exponentially longer each attempt """
+    response = getattr(error, 'response', None)
+    if response is not None and response.headers.get('Retry-After'):
+        return float(response.headers['Retry-After'])
+
+    return 2 ** attempt
+
+
+def _objects(response):
+    """ The Trello objects at the top level of a response """
+    if isinstance(response, dict):
+        return [response]
+
+    if isinstance(response, list):
+        return [obj for obj in response if isinstance(obj, dict)]
+
+    return []
+
+
+class ResponseCache(object):
+    """ Size-bounded, least recently used cache of the GET responses of one
+    run. Responses are tagged with the ids of the objects they name or
+    contain, so a mutation of an object discards every response it could
+    change: the object's own, and those of the list and board containing
+    it """
+
+    def __init__(self, max_entries=DEFAULT_RESPONSE_CACHE_SIZE):
+        self._max_entries = max_entries
+
+        # Request key -> (response, tags)
+        self._entries = OrderedDict()
+
+        # Object id -> ids of the list and board containing it, and list or
+        # board id -> ids of the objects in it, learned from responses
+        self._parents = {}
+        self._children = {}
+
+        # Scripts fetch from several threads
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _learn(self, response):
+        for obj in _objects(response):
+            parents = [obj[field] for field in ('idList', 'idBoard')
+                       if obj.get(field)]
+            if 'id' in obj and parents:
+                self._parents[obj['id']] = parents
+
+                for parent_id in parents:
+                    self._children.setdefault(parent_id, set()).add(obj['id'])
+
+    def get(self, key):
+        """ A copy of the cached response for a request key, or None """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+
+            # Mark as most recently used
+            self._entries[key] = entry
+
+        # Callers may change the responses they get
+        return copy.deepcopy(entry[0])
+
+    def put(self, key, path, response):
+        """ Caches the response of a GET request """
+        tags = set(ID_REGEX.findall(path))
+        tags.update([obj['id'] for obj in _objects(response) if 'id' in obj])
+
+        with self._lock:
+            self._learn(response)
+
+            self._entries.pop(key, None)
+            self._entries[key] = (copy.deepcopy(response), tags)
+
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def mutated(self, path, params, data, response):
+        """ Discards the responses a mutation could have changed """
+        path_ids = ID_REGEX.findall(path)
+        ids = set(path_ids)
+        for fields in (params, data):
+            for field in fields or {}:
+                # idList, idBoard, idListSource, idCardSource...
+                if field.startswith('id') and fields[field]:
+                    ids.add(fields[field])
+
+        with self._lock:
+            for obj_id in list(ids):
+                ids.update(self._parents.get(obj_id, []))
+
+            # Mutations of a whole list change each of its cards too
+            if path.endswith(LIST_WIDE_MUTATIONS):
+                for obj_id in path_ids:
+                    ids.update(self._children.get(obj_id, ()))
+
+            self._learn(response)
+
+            for key in [key for key in self._entries
+                        if self._entries[key][1] & ids]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._parents.clear()
+            self._children.clear()
+
+
+class RateLimiter(object):
+    """ Keeps requests within a budget of a number of requests per period,
+    by waiting before requests which would exceed it """
+
+    def __init__(self, requests, seconds=RATE_LIMIT_PERIOD):
+        self._requests = requests
+        self._seconds = seconds
+
+        # Times of the requests made in the last period
+        self._times = deque()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """ Waits until a request can be made, and counts it """
+        with self._lock:
+            now = time.time()
+
+            while self._times and self._times[0] <= now - self._seconds:
+                self._times.popleft()
+
+            if len(self._times) >= self._requests:
+                delay = self._times.popleft() + self._seconds - now
+                RATE_LIMIT_WAITS.inc()
+                RATE_LIMIT_WAIT_SECONDS.inc(delay)
+                time.sleep(delay)
+                now = time.time()
+
+            self._times.append(now)
+
+
+class HttpTransport(object):
+    """ Sends Trello requests over HTTP. Transports take a method, a path
+    relative to the API root, query params, form data and files, and return
+    the decoded JSON response (None if it is empty) """
+
+    def __init__(self, base_url=BASE_URL, timeout=TRELLO_TIMEOUT,
+                 session=None):
+        self._base_url = base_url
+        self._timeout = timeout
+
+        # Transports can share a session, and its pool of connections
+        if session is None:
+            # requests is slow to import, so it's only loaded for real HTTP
+            import requests
+            session = requests.Session()
+        self._session = session
+
+    def request(self, method, path, params=None, data=None, files=None):
+        response = self._session.request(method, self._base_url + path,
+                                         params=params, data=data,
+                                         files=files, timeout=self._timeout)
+        response.raise_for_status()
+
+        if not response.content:
+            return None
+
+        return response.json()
+
+
 class Trello(object):
     """ Wrapper of the Trello API """
 
-    def __init__(self, api_key, token=None):
-        # Store the API key and token for things the Python API can't do
+    def __init__(self, api_key, token=None, transport=None,
+                 cache_size=DEFAULT_RESPONSE_CACHE_SIZE, rate_limiter=None):
+        # Store the API key and token, sent with every request
         self.__api_key = api_key
         self.__token = token
 
-        # Make a Trello Python API wrapper object for the things it CAN do
-        self._trello = TrelloApi(api_key, token)
+        # Reads repeated within a run are answered from memory. A size of 0
+        # turns the cache off
+        self._cache = None
+        if cache_size:
+            self._cache = ResponseCache(cache_size)
+
+        # Everything goes through the transport, so it can be replaced by
+        # a fake Trello for testing
+        if transport is None:
+            transport = HttpTransport()
+        self._transport = transport
 
-        # Retrieve this Trello user
-        self._member = self._trello.members.get('me')
+        # This Trello user, retrieved when first needed
+        self._member = None
+
+        # Requests can be held within a budget, which otherwise only
+        # Trello enforces
+        self._rate_limiter = rate_limiter
+
+        # Requests sent to Trello, not counting cached responses
+        self.request_count = 0
 
     @classmethod
     def from_environment_vars(cls):
         """ Construct a Trello wrapper using environment variable settings """
         api_key = os.environ['TRELLONOS_API_KEY']
         token = os.environ['TRELLONOS_TOKEN']
-        return cls(api_key, token)
+        cache_size = int(os.environ.get('TRELLONOS_RESPONSE_CACHE_SIZE',
+                                        DEFAULT_RESPONSE_CACHE_SIZE))
+
+        rate_limiter = None
+        rate_limit = os.environ.get('TRELLONOS_RATE_LIMIT')
+        if rate_limit:
+            rate_limiter = RateLimiter(int(rate_limit))
+
+        return cls(api_key, token, cache_size=cache_size,
+                   rate_limiter=rate_limiter)
 
     # PROPERTIES #
     @property
     def member(self):
+        if self._member is None:
+            self._member = self._request('GET', 'members/me')
+
         return self._member
 
     # REQUESTS HELPERS #
@@ -66,53 +327,135 @@ class Trello(object):
 
         return params
 
+    def clear_cache(self):
+        """ Forgets every cached response, for example after something
+        other than this wrapper changed Trello """
+        if self._cache is not None:
+            self._cache.clear()
+
+    def _request(self, method, path, params={}, data=None, files=None):
+        """ Makes one Trello API request and returns its decoded response,
+        answering reads from the response cache when possible. Every API
+        call goes through here """
+        cache = self._cache
+
+        if cache is not None and method == 'GET':
+            key = (path, tuple(sorted(params.items())))
+
+            response = cache.get(key)
+            if response is not None:
+                RESPONSE_CACHE_REQUESTS.inc(result='hit')
+                return response
+
+            RESPONSE_CACHE_REQUESTS.inc(result='miss')
+
+            response = self._send(method, path, params, data, files)
+            if response is not None:
+                cache.put(key, path, response)
+
+            return response
+
+        response = self._send(method, path, params, data, files)
+
+        if cache is not None:
+            cache.mutated(path, params, data, response)
+
+        return response
+
+    def _send(self, method, path, params, data, files):
+        """ Sends a request through the transport, retrying requests refused
+        by the rate limit """
+        tracetools.count_api_call()
+
+        endpoint = ID_REGEX.sub(':id', path)
+
+        attempt = 0
+        while True:
+            if self._rate_limiter:
+                self._rate_limiter.wait()
+
+            self.request_count += 1
+            start = time.time()
+
+            try:
+                response = self._transport.request(
+                    method, path, self.request_params(params), data, files)
+            except Exception as e:
+                status = _error_status(e)
+                REQUESTS.inc(method=method, endpoint=endpoint,
+                             status=status or 'error')
+
+                if status != 429 or attempt >= MAX_RATE_LIMIT_RETRIES:
+                    raise
+
+                # Wait out the rate limit, then try again
+                delay = _retry_delay(e, attempt)
+                RATE_LIMIT_WAITS.inc()
+                RATE_LIMIT_WAIT_SECONDS.inc(delay)
+                time.sleep(delay)
+
+                attempt += 1
+                continue
+
+            REQUESTS.inc(method=method, endpoint=endpoint, status=200)
+            REQUEST_SECONDS.observe(time.time() - start, method=method,
+                                    endpoint=endpoint)
+
+            return response
+
     # BOARDS #
 
     def get_boards(self, board_filter=FILTER_OPEN):
         """ Retrieves an optionally filtered list of Trello boards """
+        # Boards of the token's own member need no member lookup
+        return self._request('GET', 'members/me/boards',
+                             {'filter': board_filter})
 
-        boards = self._trello.members.get_board(
-            self._member['id'], filter=board_filter)
-
-        return boards
+    @mutation
+    def update_board_closed(self, board, value):
+        """ Opens or closes a board """
+        self._request('PUT', 'boards/' + board['id'] + '/closed',
+                      {'value': boolean_to_string(value)})
 
     # LISTS #
 
     def get_lists(self, board, list_filter=FILTER_OPEN):
         """ Retrieves an optionally filtered list of Trello lists """
-
-        lists = self._trello.boards.get_list(board['id'], filter=list_filter)
-
-        return lists
+        return self._request('GET', 'boards/' + board['id'] + '/lists',
+                             {'filter': list_filter})
 
     def get_list(self, list_id):
         """ Retrieves a list given its ID """
-        return self._trello.lists.get(list_id)
+        return self._request('GET', 'lists/' + list_id)
 
+    @mutation
     def update_list_name(self, list, name):
         """ Changes the name of a list """
-        self._trello.lists.update_name(list['id'], name)
+        self._request('PUT', 'lists/' + list['id'] + '/name',
+                      {'value': name})
 
+    @mutation
     def update_list_closed(self, list, value):
         """ Opens or closes a list """
-        self._trello.lists.update_closed(list['id'],
-                                          boolean_to_string(value))
+        self._request('PUT', 'lists/' + list['id'] + '/closed',
+                      {'value': boolean_to_string(value)})
 
+    @mutation
     def create_list(self, board, list_name):
         """ Creates a new list in the given board """
-        return self._trello.boards.new_list(board['id'], list_name)
+        return self._request('POST', 'lists',
+                             {'name': list_name, 'idBoard': board['id']})
 
+    @mutation
     def sort_list(self, list, position):
         """ Sorts the given list to the given position. Position can be
         'top' or 'bottom' or a positive number """
+        self._request('PUT', 'lists/' + list['id'] + '/pos',
+                      {'value': position})
 
-        url = BASE_URL + 'lists/' + list['id'] + '/pos'
-        requests.put(url, params=self.request_params({'value': position}))
-
+    @mutation
     def copy_list(self, list, board, override_params={}):
         """ Copies the given list into a new list in the given board """
-        url = BASE_URL + 'lists/'
-
         params = {}
 
         params['name'] = list['name']
@@ -122,71 +465,129 @@ class Trello(object):
         for override_param in override_params:
             params[override_param] = override_params[override_param]
 
-        request = requests.post(url, data=self.request_params(params))
+        return self._request('POST', 'lists', data=params)
 
-        # Return the output
-        return json.loads(request.text)
+    @mutation
+    def archive_all_cards(self, list):
+        """ Archives every card in the given list with a single request """
+        self._request('POST', 'lists/' + list['id'] + '/archiveAllCards')
+
+    @mutation
+    def move_all_cards(self, list, destination_list):
+        """ Moves every card in the given list to the destination list with
+        a single request """
+        params = {
+            'idBoard': destination_list['idBoard'],
+            'idList': destination_list['id']
+        }
+
+        self._request('POST', 'lists/' + list['id'] + '/moveAllCards',
+                      params)
 
     # CARDS #
 
-    def get_cards(self, list, card_filter=FILTER_ALL, fields=None):
-        """ Retrieves cards from the given list """
+    def get_cards(self, list, card_filter=FILTER_ALL, fields=None,
+                  checklists=None):
+        """ Retrieves cards from the given list. Checklists can be nested
+        in the cards (checklists='all') to save a request per checklist """
+        params = {'filter': card_filter}
+        if fields:
+            params['fields'] = fields
+        if checklists:
+            params['checklists'] = checklists
+
+        return self._request('GET', 'lists/' + list['id'] + '/cards', params)
 
-        cards = self._trello.lists.get_card(
-            list['id'], filter=card_filter, fields=fields)
+    def get_card(self, card_id, fields=None):
+        """ Retrieves a card given its ID """
+        params = {}
+        if fields:
+            params['fields'] = fields
 
-        return cards
+        return self._request('GET', 'cards/' + card_id, params)
 
+    @mutation
     def create_card(self, list, card_name, description=''):
         """ Creates a new Trello card with a name and optional description """
-        return self._trello.cards.new(card_name, list['id'], description)
+        return self._request('POST', 'cards', {'name': card_name,
+                                               'idList': list['id'],
+                                               'desc': description})
 
+    @mutation
     def delete_card(self, card):
         """ Deletes a Trello card completely """
-        self._trello.cards.delete(card['id'])
+        self._request('DELETE', 'cards/' + card['id'])
 
+    @mutation
     def update_card_name(self, card, name):
         """ Renames a Trello card """
-        self._trello.cards.update_name(card['id'], name)
+        self._request('PUT', 'cards/' + card['id'] + '/name', {'value': name})
 
+    @mutation
     def update_card_description(self, card, description):
         """ Changes the description of a Trello card """
-        self._trello.cards.update_desc(card['id'], description)
+        self._request('PUT', 'cards/' + card['id'] + '/desc',
+                      {'value': description})
+
+    @mutation
+    def update_card_due(self, card, due):
+        """ Changes the due date of a Trello card. A due date of None
+        removes it """
+        if due is None:
+            due = 'null'
+
+        self._request('PUT', 'cards/' + card['id'] + '/due', {'value': due})
+
+    @mutation
+    def add_card_attachment(self, card, filename, data, mime_type):
+        """ Uploads a file as an attachment of a Trello card """
+        files = {'file': (filename, data, mime_type)}
+        params = {'name': filename, 'mimeType': mime_type}
 
+        return self._request('POST', 'cards/' + card['id'] + '/attachments',
+                             params, files=files)
+
+    @mutation
     def update_card_closed(self, card, value):
         """ Changes the archival status of a card (open/closed) """
-        self._trello.cards.update_closed(card['id'],
-                                          boolean_to_string(value))
+        self._request('PUT', 'cards/' + card['id'] + '/closed',
+                      {'value': boolean_to_string(value)})
 
+    @mutation
     def add_card_member(self, card, member):
         """ Adds a member to a card, subscribing them to notifications
         from it """
-        self._trello.cards.new_member(card['id'], member['id'])
+        self._request('POST', 'cards/' + card['id'] + '/idMembers',
+                      {'value': member['id']})
 
+    @mutation
     def subscribe_card(self, card):
         """ Adds the member running Trellonos to a card """
-        self.add_card_member(card, self._member)
+        self.add_card_member(card, self.member)
 
+    @mutation
     def remove_card_member(self, card, member):
         """ Removes a member from a Trello card """
-        self._trello.cards.delete_member_idMember(member['id'], card['id'])
+        self._request('DELETE', 'cards/' + card['id'] + '/idMembers/' +
+                      member['id'])
 
+    @mutation
     def unsubscribe_card(self, card):
         """ Removes the member running Trellonos from a card """
-        self.remove_card_member(card, self._member)
+        self.remove_card_member(card, self.member)
 
-    def move_card(self, card, list):
-        """ Moves a card to a new list """
-        # TODO this doesn't work
-        url = BASE_URL + 'cards/' + card['id'] + '/idList'
-        params = self.request_params({'value': list['id']})
+    @mutation
+    def move_card(self, card, list, board=None):
+        """ Moves a card to a new list, optionally in another board """
+        params = {'idList': list['id']}
+        if board:
+            params['idBoard'] = board['id']
 
-        requests.put(url, params=params)
+        return self._request('PUT', 'cards/' + card['id'], params)
 
+    @mutation
     def copy_card(self, card, list, override_params={}):
         """ Copies the given card into a new card in the given list """
-        url = BASE_URL + 'cards/'
-
         params = {}
 
         params['due'] = card['due']
@@ -197,17 +598,19 @@ class Trello(object):
         for override_param in override_params:
             params[override_param] = override_params[override_param]
 
-        request = requests.post(url, data=self.request_params(params))
-
-        # Return the output
-        return json.loads(request.text)
+        return self._request('POST', 'cards', data=params)
 
     # CHECKLISTS
 
     def get_checklist(self, id, checklist_filter=FILTER_ALL, fields=None):
         """ Retrieves the checklist corresponding to the given id """
+        params = {}
+        if fields:
+            params['fields'] = fields
+
+        return self._request('GET', 'checklists/' + id, params)
 
-        checklist = self._trello.checklists.get(
-            id, fields=fields)
 
-        return checklist
+# Every Trello wrapper method which changes Trello
+MUTATING_METHODS = tuple(sorted([name for name, value in vars(Trello).items()
+                                 if getattr(value, 'mutates', False)]))